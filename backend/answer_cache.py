@@ -0,0 +1,122 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Words that don't change the meaning of a yes/no question. Negations are
+# deliberately kept: "is he dead" and "is he not dead" are different questions.
+STOPWORDS = frozenset("""
+a an the
+is are was were be been being am
+do does did has have had will would shall should can could may might must
+please me just really actually
+""".split())
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+
+def normalize_question(question):
+    """Fold case, punctuation and stopwords: 'Was he dead?' -> 'he dead'"""
+    tokens = [token for token in TOKEN_PATTERN.findall(question.lower()) if token not in STOPWORDS]
+    return " ".join(tokens)
+
+
+class AnswerCache:
+    """LRU/TTL cache of host answers keyed by puzzle identity and normalized question.
+
+    With ``similarity`` > 0, a miss on the exact key falls back to the cached
+    question for the same puzzle with the highest token Jaccard similarity at
+    or above that threshold.
+    """
+
+    def __init__(self, max_entries=10000, ttl=3600, similarity=0.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+        # (puzzle_id, normalized) -> (answer, expires_at)
+        self._entries = OrderedDict()
+        # puzzle_id -> {normalized: token set}, for similarity lookups
+        self._by_puzzle = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, puzzle_id, question):
+        if not self.enabled:
+            return None
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+
+        now = time.time()
+        with self._lock:
+            key = (puzzle_id, normalized)
+            if key not in self._entries and self.similarity > 0:
+                key = self._most_similar(puzzle_id, normalized)
+                similar = key is not None
+            else:
+                similar = False
+
+            entry = self._entries.get(key) if key is not None else None
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if similar:
+                self.similar_hits += 1
+            return entry[0]
+
+    def put(self, puzzle_id, question, answer):
+        if not self.enabled:
+            return
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+
+        with self._lock:
+            key = (puzzle_id, normalized)
+            self._entries[key] = (answer, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            self._by_puzzle.setdefault(puzzle_id, {})[normalized] = frozenset(normalized.split())
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses
+            }
+
+    def _most_similar(self, puzzle_id, normalized):
+        tokens = frozenset(normalized.split())
+        best_key, best_score = None, self.similarity
+        for candidate, candidate_tokens in self._by_puzzle.get(puzzle_id, {}).items():
+            score = len(tokens & candidate_tokens) / len(tokens | candidate_tokens)
+            if score >= best_score:
+                best_key, best_score = (puzzle_id, candidate), score
+        return best_key
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        puzzle_id, normalized = key
+        questions = self._by_puzzle.get(puzzle_id)
+        if questions is not None:
+            questions.pop(normalized, None)
+            if not questions:
+                del self._by_puzzle[puzzle_id]
@@ -1,21 +1,92 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import requests
 import os
 import json
 import time
+import random
+import re
 from dotenv import load_dotenv
 import uuid
+import hashlib
+import atexit
+import logging
+import sqlite3
+
+from answer_cache import AnswerCache
+from context_cache import ContextCache
+from call_scheduler import CallScheduler, Overloaded, ASK, INTRO, GENERATION, PREFETCH, PRIORITY_NAMES
+from conversation import ConversationContext, VERDICT_PATTERN
+from gemini_client import GeminiClient, GeminiAPIError, UpstreamHealth
+from hedging import Hedger
+from intent_router import IntentRouter, GIVE_UP, SOLUTION, HINT, REPEAT, GREETING, HELP
+from leaderboard import Leaderboard
+from minhash import MinHashIndex
+from log_utils import configure_logging, log_payload, LazyJSON, Truncated, request_id_var, session_id_var
+import metrics
+from puzzle_library import PuzzleLibrary, signature_text
+from puzzle_pool import PuzzlePool
+from puzzle_themes import PUZZLE_TYPES
+from rooms import RoomHub
+from session_store import create_session_store
 
 # Load environment variables
 load_dotenv()
+configure_logging()
+logger = logging.getLogger("riddlesense")
 
 app = Flask(__name__)
 CORS(app)
 
 # API Key for Google Gemini API
 API_KEY = os.getenv("GEMINI_API_KEY", "")
-BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+# Point GEMINI_BASE_URL at mock_gemini.py to run without the real API
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+# Models to call, primary first; slow calls are hedged to the next one
+GEMINI_MODELS = [model.strip() for model in os.getenv("GEMINI_MODELS", "gemini-2.0-flash").split(",") if model.strip()]
+
+def model_url(model, stream=False):
+    method = "streamGenerateContent" if stream else "generateContent"
+    return f"{GEMINI_BASE_URL}/models/{model}:{method}"
+
+# Shared keep-alive client for all upstream calls
+gemini_client = GeminiClient(
+    pool_size=int(os.getenv("GEMINI_POOL_SIZE", "10")),
+    connect_timeout=float(os.getenv("GEMINI_CONNECT_TIMEOUT", "5")),
+    read_timeout=float(os.getenv("GEMINI_READ_TIMEOUT", "60")),
+    max_retries=int(os.getenv("GEMINI_MAX_RETRIES", "3")),
+    backoff_base=float(os.getenv("GEMINI_BACKOFF_BASE", "0.5")),
+    backoff_max=float(os.getenv("GEMINI_BACKOFF_MAX", "20")),
+    on_retry=lambda reason: metrics.UPSTREAM_RETRIES.inc(reason=reason)
+)
+
+# Outbound calls are admitted at GEMINI_RATE_LIMIT per minute, interactive turns first
+upstream_scheduler = CallScheduler(
+    rate=float(os.getenv("GEMINI_RATE_LIMIT", "0")) / 60,
+    burst=int(os.getenv("GEMINI_RATE_BURST", "10")),
+    max_queue=int(os.getenv("GEMINI_QUEUE_SIZE", "100")),
+    max_wait=float(os.getenv("GEMINI_QUEUE_TIMEOUT", "10")),
+    on_admit=lambda priority, waited: metrics.UPSTREAM_QUEUE_WAIT.observe(waited, priority=PRIORITY_NAMES[priority]),
+    on_shed=lambda priority, reason: metrics.UPSTREAM_SHED.inc(priority=PRIORITY_NAMES[priority], reason=reason)
+)
+# Scheduling class of each call phase; pool refills run as PREFETCH instead
+PHASE_PRIORITIES = {"ask": ASK, "intro": INTRO, "generation": GENERATION}
+
+# A call in a hedged phase still unanswered at its model's GEMINI_HEDGE_PERCENTILE
+# latency is sent again to the next model, and the first good reply wins
+hedger = Hedger(
+    GEMINI_MODELS,
+    percentile=float(os.getenv("GEMINI_HEDGE_PERCENTILE", "95")),
+    initial_delay=float(os.getenv("GEMINI_HEDGE_DELAY", "2")),
+    min_delay=float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "0.1")),
+    phases=[phase.strip() for phase in os.getenv("GEMINI_HEDGE_PHASES", "ask").split(",") if phase.strip()],
+    max_workers=int(os.getenv("GEMINI_HEDGE_THREADS", "64")),
+    on_hedge=lambda outcome: metrics.UPSTREAM_HEDGES.inc(outcome=outcome),
+    on_latency=lambda model, kind, seconds: metrics.MODEL_LATENCY.observe(seconds, model=model, kind=kind)
+)
+
+# Gemini counts as down for a while after a call fails even after retries
+upstream_health = UpstreamHealth(cooldown=float(os.getenv("GEMINI_OUTAGE_COOLDOWN", "30")))
 
 # Helper functions for score calculation
 def calculate_base_points(difficulty):
@@ -49,25 +120,61 @@ def calculate_time_factor(time_spent, difficulty):
         return max(0.5, 1.0 - (time_spent - expected_time) / (expected_time * 2))
 
 # Store game states
-# Format: {session_id: {'riddle': {...}, 'messages': [...], 'score': 0}}
-game_sessions = {}
+# Format: {session_id: {'riddle': {...}, 'puzzle_id': '...', 'messages': [...], 'facts': [...], 'score': 0}}
+# SESSION_BACKEND=sqlite or redis shares sessions between worker processes and hosts
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+session_store = create_session_store(
+    os.getenv("SESSION_BACKEND", "memory"),
+    ttl=SESSION_TTL,
+    max_sessions=int(os.getenv("SESSION_MAX_COUNT", "10000")),
+    max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024))),
+    sqlite_path=os.getenv("SESSION_SQLITE_PATH", "sessions.db"),
+    redis_url=os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0"),
+    # Journal of the in-memory store, so a restart picks up every game in progress
+    journal_path=os.getenv("SESSION_JOURNAL") or None,
+    journal_segment_bytes=int(os.getenv("SESSION_JOURNAL_SEGMENT_BYTES", str(32 * 1024 * 1024))),
+    on_journal_compact=lambda sessions, seconds: metrics.SESSION_JOURNAL_COMPACTION.observe(seconds)
+)
 
-def generate_gemini_request(messages):
-    print("Generating Gemini API request format...")
+# Answers to repeated questions, shared by every session playing the same puzzle
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    similarity=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+)
+
+# Bounded per-call context: host rules, digest of earlier facts, recent turns
+conversation = ConversationContext(
+    window=int(os.getenv("CONTEXT_WINDOW_MESSAGES", "12")),
+    max_facts=int(os.getenv("CONTEXT_MAX_FACTS", "40"))
+)
+
+# Answers give-up, solution and meta requests locally; INTENT_ROUTER=false sends everything to Gemini
+intent_router = IntentRouter(
+    min_confidence=float(os.getenv("INTENT_MIN_CONFIDENCE", "0.9"))
+) if os.getenv("INTENT_ROUTER", "true").lower() == "true" else None
+
+def generate_gemini_request(messages, system_instruction=None, generation_config=None, cached_content=None):
     contents = []
+    system_parts = [system_instruction] if system_instruction else []
     
     # Convert message format for Gemini API
-    for i, message in enumerate(messages):
+    for message in messages:
         role = message.get("role")
         content = message.get("content")
         
+        # System messages go to the dedicated systemInstruction field
+        if role == "system":
+            system_parts.append(content)
+            continue
+        
         # Map roles to Gemini format - check if this role is supported
-        if role == "user" or role == "system":
+        if role == "user":
             gemini_role = "user"
         elif role == "assistant":
             gemini_role = "model"
         else:
-            print(f"WARNING: Unknown role '{role}'. Defaulting to 'user'.")
+            logger.warning("Unknown role '%s'. Defaulting to 'user'.", role)
             gemini_role = "user"
         
         # Create content object
@@ -76,110 +183,383 @@ def generate_gemini_request(messages):
             "parts": [{"text": content}]
         }
         contents.append(content_obj)
-        
-        # If this is system message, add a virtual assistant confirmation
-        if i == 0 and role == "system":
-            assistant_content = {
-                "role": "model",
-                "parts": [{"text": "I understand. I'll act as an AI assistant for the turtle soup game."}]
-            }
-            contents.append(assistant_content)
     
     result = {"contents": contents}
-    print(f"Final request structure: {json.dumps(result)[:300]}...")
+    if cached_content:
+        # Requests using cached content can't set a system instruction, so
+        # whatever isn't cached leads the first user turn instead
+        result["cachedContent"] = cached_content
+        if system_parts:
+            if not contents or contents[0]["role"] != "user":
+                contents.insert(0, {"role": "user", "parts": []})
+            contents[0]["parts"].insert(0, {"text": "\n\n".join(system_parts)})
+    elif system_parts:
+        result["systemInstruction"] = {"parts": [{"text": "\n\n".join(system_parts)}]}
+    if generation_config:
+        result["generationConfig"] = generation_config
     return result
 
-def call_gemini_api(messages):
-    url = f"{BASE_URL}?key={API_KEY}"
-    payload = generate_gemini_request(messages)
-    
-    headers = {
-        'Content-Type': 'application/json'
+def extract_usage(data):
+    """Token counts from a response's usageMetadata, or None if it has none"""
+    usage = data.get("usageMetadata") if isinstance(data, dict) else None
+    if not usage:
+        return None
+    return {
+        "prompt": usage.get("promptTokenCount", 0),
+        "response": usage.get("candidatesTokenCount", 0),
+        "cached": usage.get("cachedContentTokenCount", 0)
     }
+
+def record_gemini_call(phase, status, started, usage=None):
+    """Record latency, outcome and token usage of one upstream call"""
+    metrics.UPSTREAM_LATENCY.observe(time.time() - started, phase=phase)
+    metrics.UPSTREAM_RESPONSES.inc(phase=phase, status=status)
+    upstream_health.record(status)
+    if usage:
+        metrics.UPSTREAM_TOKENS.inc(usage["prompt"], phase=phase, kind="prompt")
+        metrics.UPSTREAM_TOKENS.inc(usage["response"], phase=phase, kind="response")
+        if usage.get("cached"):
+            metrics.UPSTREAM_TOKENS.inc(usage["cached"], phase=phase, kind="cached")
+        metrics.PROMPT_TOKENS.observe(usage["prompt"], phase=phase)
+
+def add_usage(target, usage):
+    """Accumulate token usage into a session (or pooled puzzle) dict"""
+    if usage:
+        totals = target.setdefault("usage", {"prompt": 0, "response": 0})
+        totals["prompt"] += usage["prompt"]
+        totals["response"] += usage["response"]
+
+def request_payload(model, messages, system_instruction=None, generation_config=None, cached=None):
+    """Request body for ``model``; a system instruction starting with a prefix cached for it sends that part by handle"""
+    if cached is not None and cached.model == model and system_instruction and system_instruction.startswith(cached.prefix):
+        return generate_gemini_request(messages, system_instruction[len(cached.prefix):], generation_config, cached.name)
+    return generate_gemini_request(messages, system_instruction, generation_config)
+
+def cache_dropped(cached, model, response):
+    """Whether a call failed because the upstream no longer has its cached prefix; forgets the handle if so"""
+    if cached is None or cached.model != model or response.status_code not in CACHE_MISS_STATUSES:
+        return False
+    logger.info("Cached prompt prefix %s was rejected with %s; sending the full prompt", cached.name, response.status_code)
+    context_cache.invalidate(cached)
+    return True
+
+def call_gemini_api(messages, system_instruction=None, phase="ask", generation_config=None, priority=None, cached=None):
+    payload = request_payload(hedger.primary, messages, system_instruction, generation_config, cached)
+    
+    # Wait for the rate limiter; raises Overloaded if the call is shed
+    priority = PHASE_PRIORITIES[phase] if priority is None else priority
+    upstream_scheduler.acquire(priority)
     
-    print(f"Making API call to {url}")
-    print(f"Request payload (first part): {json.dumps(payload)[:200]}...")
+    logger.debug("Making %s API call to %s", phase, hedger.primary)
+    log_payload(logger, "Request payload: %s", payload)
     
-    response = requests.post(url, headers=headers, json=payload)
+    started = time.time()
+    metrics.UPSTREAM_IN_FLIGHT.inc(phase=phase)
+    def call(model):
+        url = f"{model_url(model)}?key={API_KEY}"
+        response = gemini_client.post(url, request_payload(model, messages, system_instruction, generation_config, cached))
+        if cache_dropped(cached, model, response):
+            response.close()
+            response = gemini_client.post(url, request_payload(model, messages, system_instruction, generation_config))
+        return response
     
-    print(f"API response status code: {response.status_code}")
+    try:
+        # A hedge only goes out if the rate limiter has a token to spare
+        model, response = hedger.run(
+            phase,
+            call,
+            ok=lambda response: response.status_code == 200,
+            discard=lambda response: response.close(),
+            may_hedge=lambda: upstream_scheduler.try_acquire(priority)
+        )
+    except requests.RequestException as e:
+        logger.warning("API request failed: %s", e.__class__.__name__)
+        record_gemini_call(phase, "error", started)
+        return {"message": f"Error calling AI API: {e.__class__.__name__}", "success": False}
+    finally:
+        metrics.UPSTREAM_IN_FLIGHT.dec(phase=phase)
     
-    if response.status_code == 200:
-        data = response.json()
-        print(f"Response contains candidates: {bool('candidates' in data)}")
+    logger.debug("API response status code from %s: %s", model, response.status_code)
+    
+    result = gemini_result(response.status_code, response.text)
+    record_gemini_call(phase, response.status_code, started, result.get("usage"))
+    return result
+
+def gemini_result(status_code, body):
+    """Turn a generateContent HTTP response into a {'message', 'success', 'usage'} result"""
+    if status_code == 200:
+        data = json.loads(body)
         
         if "candidates" in data and len(data["candidates"]) > 0:
             try:
                 text_response = data["candidates"][0]["content"]["parts"][0]["text"]
-                print(f"Successfully extracted response text (first 100 chars): {text_response[:100]}...")
-                return {"message": text_response, "success": True}
+                logger.debug("Extracted response text: %s", Truncated(text_response))
+                return {"message": text_response, "success": True, "usage": extract_usage(data)}
             except (KeyError, IndexError) as e:
-                print(f"Error extracting text from response: {e}")
-                print(f"Response structure: {json.dumps(data)[:500]}...")
+                logger.warning("Error extracting text from response: %s", e)
+                log_payload(logger, "Response structure: %s", data, limit=500)
                 return {"message": f"Error parsing AI response: {str(e)}", "success": False}
         else:
-            print(f"No candidates in response: {json.dumps(data)[:200]}")
+            logger.warning("No candidates in response: %s", LazyJSON(data, 200))
             return {"message": "Error: No valid response from AI API", "success": False}
     else:
-        print(f"API error response: {response.text}")
-        return {"message": f"Error calling AI API: {response.status_code} - {response.text}", "success": False}
+        logger.warning("API error response %s: %s", status_code, Truncated(body, 500))
+        return {"message": f"Error calling AI API: {status_code} - {body}", "success": False}
 
-@app.route('/api/start_game', methods=['POST'])
-def start_game():
-    session_id = str(uuid.uuid4())
-    
+def parse_stream_line(line):
+    """(text parts, usage) carried by one line of a streamGenerateContent SSE response"""
+    # Each server-sent event carries a partial GenerateContentResponse
+    if not line or not line.startswith("data:"):
+        return [], None
     try:
-        # Get game settings from request
-        data = request.json or {}
-        difficulty = data.get('difficulty', 'medium')
-        puzzle_length = data.get('puzzleLength', 'medium')
-        theme = data.get('theme', 'random')
-        
-        print(f"Creating a new puzzle with settings: difficulty={difficulty}, length={puzzle_length}, theme={theme}")
-        
-        # Map theme to puzzle type
-        puzzle_types = {
-            "random": [
-                "murder mystery",
-                "strange occurrence",
-                "unexplained phenomenon",
-                "bizarre situation",
-                "unexpected outcome",
-                "mysterious disappearance",
-                "unusual death",
-                "surprising discovery"
-            ],
-            "mystery": ["murder mystery", "mysterious disappearance", "unsolved crime"],
-            "adventure": ["wilderness survival", "expedition gone wrong", "lost explorer"],
-            "scifi": ["alien encounter", "time paradox", "futuristic technology malfunction"],
-            "historical": ["historical event", "ancient mystery", "historical figure's secret"]
-        }
-        
-        # Select puzzle type based on theme
-        available_types = puzzle_types.get(theme, puzzle_types["random"])
-        
-        import random
-        chosen_type = random.choice(available_types)
-        
-        # Customize prompt based on difficulty and length
-        difficulty_guidelines = {
-            "easy": "Make the puzzle relatively straightforward with clear logical connections.",
-            "medium": "Create a moderately challenging puzzle with some unexpected elements.",
-            "hard": "Design a complex puzzle with surprising twists that requires careful thinking to solve."
-        }
-        
-        length_guidelines = {
-            "short": "Keep the puzzle statement brief (1-2 sentences) and the solution concise.",
-            "medium": "Create a moderately detailed puzzle (2-3 sentences) with a comprehensive solution.",
-            "long": "Develop an elaborate puzzle scenario (3-5 sentences) with a detailed solution."
+        data = json.loads(line[len("data:"):])
+    except ValueError:
+        return [], None
+    try:
+        parts = data["candidates"][0]["content"]["parts"]
+    except (KeyError, IndexError, TypeError):
+        parts = []
+    return [part["text"] for part in parts if part.get("text")], extract_usage(data)
+
+def open_stream(model, messages, system_instruction=None, cached=None):
+    """Start a streaming call to ``model`` and read up to its first text.
+
+    Returns (response, remaining lines, first texts, usage so far); lines is
+    None if the call failed.
+    """
+    url = f"{model_url(model, stream=True)}?alt=sse&key={API_KEY}"
+    response = gemini_client.post(url, request_payload(model, messages, system_instruction, cached=cached), stream=True)
+    if cache_dropped(cached, model, response):
+        response.close()
+        response = gemini_client.post(url, request_payload(model, messages, system_instruction), stream=True)
+    if response.status_code != 200:
+        return response, None, [], None
+    lines = response.iter_lines(decode_unicode=True)
+    try:
+        for line in lines:
+            texts, usage = parse_stream_line(line)
+            if texts:
+                return response, lines, texts, usage
+    except BaseException:
+        response.close()
+        raise
+    return response, lines, [], None
+
+def stream_gemini_api(messages, system_instruction=None, phase="ask", usage=None, cached=None):
+    """Yield response text chunks from Gemini's streamGenerateContent endpoint.
+
+    Hedged on time to the first chunk. If ``usage`` is a dict it is filled
+    with the call's token counts. Raises GeminiAPIError if the upstream call
+    fails, or Overloaded before anything is sent if the scheduler sheds it.
+    """
+    priority = PHASE_PRIORITIES[phase]
+    upstream_scheduler.acquire(priority)
+
+    logger.debug("Making streaming %s API call to %s", phase, hedger.primary)
+
+    started = time.time()
+    status = "error"
+    call_usage = None
+    metrics.UPSTREAM_IN_FLIGHT.inc(phase=phase)
+    try:
+        try:
+            model, (response, lines, texts, call_usage) = hedger.run(
+                phase,
+                lambda model: open_stream(model, messages, system_instruction, cached),
+                ok=lambda opened: opened[1] is not None,
+                discard=lambda opened: opened[0].close(),
+                kind=f"{phase}_first_chunk",
+                may_hedge=lambda: upstream_scheduler.try_acquire(priority)
+            )
+        except requests.RequestException as e:
+            logger.warning("Streaming API request failed: %s", e.__class__.__name__)
+            raise GeminiAPIError(f"Error calling AI API: {e.__class__.__name__}")
+
+        logger.debug("Streaming API response status code from %s: %s", model, response.status_code)
+        status = response.status_code
+
+        with response:
+            if response.status_code != 200:
+                logger.warning("API error response %s: %s", response.status_code, Truncated(response.text, 500))
+                raise GeminiAPIError(f"Error calling AI API: {response.status_code} - {response.text}")
+
+            yield from texts
+            for line in lines:
+                texts, line_usage = parse_stream_line(line)
+                # Usage is cumulative; the last event carries the totals
+                call_usage = line_usage or call_usage
+                yield from texts
+    finally:
+        metrics.UPSTREAM_IN_FLIGHT.dec(phase=phase)
+        record_gemini_call(phase, status, started, call_usage)
+        if usage is not None and call_usage:
+            usage.update(call_usage)
+
+def register_prefix(prefix, ttl):
+    """Cache a host prompt upstream for the primary model. Returns (model, cached content name)."""
+    model = hedger.primary
+    upstream_scheduler.acquire(PREFETCH)
+    started = time.time()
+    try:
+        response = gemini_client.post(f"{GEMINI_BASE_URL}/cachedContents?key={API_KEY}", {
+            "model": f"models/{model}",
+            "systemInstruction": {"parts": [{"text": prefix}]},
+            "ttl": f"{int(ttl)}s"
+        })
+    except requests.RequestException:
+        record_gemini_call("cache", "error", started)
+        raise
+    record_gemini_call("cache", response.status_code, started)
+    if response.status_code != 200:
+        raise GeminiAPIError(f"Error caching prompt prefix: {response.status_code} - {Truncated(response.text, 200)}")
+    return model, response.json()["name"]
+
+def release_prefix(name):
+    gemini_client.delete(f"{GEMINI_BASE_URL}/{name}?key={API_KEY}")
+
+# Statuses of a call whose cached prefix has expired or been deleted upstream
+CACHE_MISS_STATUSES = (400, 403, 404)
+
+# With GEMINI_CONTEXT_CACHE=true each puzzle's host prompt is cached upstream
+# once, and turns send its handle plus the fact digest and recent messages
+context_cache = ContextCache(
+    register_prefix,
+    release_prefix,
+    ttl=SESSION_TTL,
+    on_event=lambda event: metrics.CONTEXT_CACHE.inc(event=event)
+) if os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() == "true" else None
+
+def cached_prefix(game_state, prompt):
+    """Upstream handle for a session's host prompt, or None to send it in full"""
+    if context_cache is None:
+        return None
+    return context_cache.get(game_state['puzzle_id'], prompt)
+
+def attach_context(game_state):
+    """Keep the puzzle's cached prompt alive for a new session"""
+    if context_cache is not None:
+        context_cache.attach(game_state['puzzle_id'])
+
+def detach_context(game_state):
+    """Release the puzzle's cached prompt once no session is playing it"""
+    if context_cache is not None:
+        context_cache.detach(game_state['puzzle_id'])
+
+# Customize prompt based on difficulty and length
+DIFFICULTY_GUIDELINES = {
+    "easy": "Make the puzzle relatively straightforward with clear logical connections.",
+    "medium": "Create a moderately challenging puzzle with some unexpected elements.",
+    "hard": "Design a complex puzzle with surprising twists that requires careful thinking to solve."
+}
+
+LENGTH_GUIDELINES = {
+    "short": "Keep the puzzle statement brief (1-2 sentences) and the solution concise.",
+    "medium": "Create a moderately detailed puzzle (2-3 sentences) with a comprehensive solution.",
+    "long": "Develop an elaborate puzzle scenario (3-5 sentences) with a detailed solution."
+}
+
+# Fallback to a simple built-in puzzle if every generation attempt fails
+FALLBACK_PUZZLE = "A man is found dead in a room with 53 bicycles. What happened?"
+FALLBACK_SOLUTION = "The man was a cyclist in a bicycle race and was poisoned by a competitor. The 53 bicycles are from all the competitors in the race."
+FALLBACK_INTRO = f"Welcome! Here is your puzzle:\n\n{FALLBACK_PUZZLE}\n\nAsk me yes-or-no questions to work out what happened."
+FALLBACK_HINTS = [
+    "The man's job matters.",
+    "Think about what the bicycles have in common with him.",
+    "He was taking part in a competition.",
+    "Someone who wanted to win had a reason to harm him."
+]
+FALLBACK_KEY_FACTS = [
+    "The man was a competitive cyclist.",
+    "He was poisoned by a rival competitor.",
+    "The 53 bicycles belong to the other competitors in the race."
+]
+
+# Every puzzle is generated with a graded hint ladder and its key facts, so
+# hints and reveals are served from the session without another call
+HINT_COUNT = (3, 5)
+KEY_FACT_COUNT = (3, 8)
+
+# Ask Gemini for JSON matching a schema instead of scraping JSON out of prose.
+# The intro comes back in the same reply, saving a second call per puzzle.
+STRUCTURED_OUTPUT = os.getenv("GEMINI_STRUCTURED_OUTPUT", "true").lower() == "true"
+# Generation calls per puzzle when the reply fails validation
+GENERATION_ATTEMPTS = max(1, int(os.getenv("PUZZLE_GENERATION_ATTEMPTS", "3")))
+# Puzzles requested per call when refilling the pool (needs structured output)
+BATCH_SIZE = max(1, int(os.getenv("PUZZLE_BATCH_SIZE", "4")))
+
+# Every generated puzzle is checked against those already issued, and
+# near-duplicates are rejected before they reach a player
+puzzle_index = MinHashIndex(
+    threshold=float(os.getenv("PUZZLE_DUPLICATE_THRESHOLD", "0.5")),
+    max_entries=int(os.getenv("PUZZLE_INDEX_SIZE", "10000"))
+)
+
+PUZZLE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "puzzle": {"type": "STRING", "description": "The puzzle statement shown to the player"},
+        "solution": {"type": "STRING", "description": "The detailed hidden solution"},
+        "intro": {
+            "type": "STRING",
+            "description": "The host's opening message: a short welcome that presents the puzzle "
+                           "statement and invites yes-or-no questions, without hinting at the solution"
+        },
+        "hints": {
+            "type": "ARRAY",
+            "items": {"type": "STRING"},
+            "minItems": HINT_COUNT[0],
+            "maxItems": HINT_COUNT[1],
+            "description": "Hints ordered from vague to specific; none may state the solution outright"
+        },
+        "key_facts": {
+            "type": "ARRAY",
+            "items": {"type": "STRING"},
+            "minItems": KEY_FACT_COUNT[0],
+            "maxItems": KEY_FACT_COUNT[1],
+            "description": "Short, self-contained facts of the solution a player must uncover"
         }
-        
-        difficulty_guide = difficulty_guidelines.get(difficulty, difficulty_guidelines["medium"])
-        length_guide = length_guidelines.get(puzzle_length, length_guidelines["medium"])
-        
-        user_message = {
-            "role": "user",
-            "content": f"""Create a lateral thinking puzzle (also known as a situation puzzle) about a {chosen_type}. 
+    },
+    "required": ["puzzle", "solution", "intro", "hints", "key_facts"],
+    "propertyOrdering": ["puzzle", "solution", "intro", "hints", "key_facts"]
+}
+
+START_MESSAGE = {"role": "user", "content": "Let's start the game. Present the puzzle to me."}
+
+def puzzle_key(difficulty, puzzle_length, theme):
+    """Normalize game settings to a pool bucket; unknown values generate the default prompt anyway"""
+    return (
+        difficulty if difficulty in DIFFICULTY_GUIDELINES else "medium",
+        puzzle_length if puzzle_length in LENGTH_GUIDELINES else "medium",
+        theme if theme in PUZZLE_TYPES else "random"
+    )
+
+def build_generation_message(difficulty, puzzle_length, theme, count=1):
+    # Select puzzle types based on theme
+    available_types = PUZZLE_TYPES.get(theme, PUZZLE_TYPES["random"])
+    chosen_types = [random.choice(available_types) for _ in range(count)]
+    if count == 1:
+        subject = f"Create a lateral thinking puzzle (also known as a situation puzzle) about a {chosen_types[0]}."
+    else:
+        subject = (f"Create {count} different lateral thinking puzzles (also known as situation puzzles), one about "
+                   f"each of these: {'; '.join('a ' + chosen for chosen in chosen_types)}. Every puzzle must have its "
+                   "own premise and twist, and each one gets its own intro, hints and key facts.")
+
+    difficulty_guide = DIFFICULTY_GUIDELINES.get(difficulty, DIFFICULTY_GUIDELINES["medium"])
+    length_guide = LENGTH_GUIDELINES.get(puzzle_length, LENGTH_GUIDELINES["medium"])
+    bundle_guide = (f"Also write {HINT_COUNT[0]}-{HINT_COUNT[1]} hints, ordered from vague to specific, that "
+                    f"never state the solution outright, and {KEY_FACT_COUNT[0]}-{KEY_FACT_COUNT[1]} short key "
+                    "facts of the solution that a player must uncover.")
+    if STRUCTURED_OUTPUT:
+        output_format = ("Also write the intro: your opening message as the game host, welcoming the player "
+                         f"and presenting the puzzle statement without hinting at the solution. {bundle_guide}")
+    else:
+        output_format = (f'{bundle_guide} Respond with ONLY a JSON object in the format {{"puzzle": "...puzzle '
+                         'statement...", "solution": "...detailed solution...", "hints": ["..."], '
+                         '"key_facts": ["..."]} without any markdown formatting or additional text.')
+
+    return {
+        "role": "user",
+        "content": f"""{subject} 
             
             IMPORTANT GUIDELINES:
             1. BE CREATIVE - DO NOT use common tropes like 'ice melting', 'suicide', or 'man found dead in a room'
@@ -189,86 +569,177 @@ def start_game():
             5. {difficulty_guide}
             6. {length_guide}
             
-            Respond with ONLY a JSON object in the format {{"puzzle": "...puzzle statement...", "solution": "...detailed solution..."}} without any markdown formatting or additional text."""
+            {output_format}"""
+    }
+
+def puzzle_generation_config(count=1):
+    """generationConfig for puzzle generation calls, or None in prose mode"""
+    if not STRUCTURED_OUTPUT:
+        return None
+    schema = PUZZLE_SCHEMA
+    if count > 1:
+        schema = {
+            "type": "OBJECT",
+            "properties": {"puzzles": {"type": "ARRAY", "items": PUZZLE_SCHEMA, "minItems": 1, "maxItems": count}},
+            "required": ["puzzles"]
         }
-        
-        print("Calling Gemini API to generate puzzle...")
-        # Call Gemini to generate the puzzle
-        messages = [user_message]
-        api_result = call_gemini_api(messages)
-        
-        # Extract the actual response text from the returned dictionary
-        if isinstance(api_result, dict):
-            ai_response = api_result.get('message', '')
-            print(f"API Response: {ai_response[:200] if isinstance(ai_response, str) else 'Not a string'}...")
-        else:
-            ai_response = str(api_result)
-            print(f"API Response: {ai_response[:200]}...")
-        
-        # Try to extract JSON from the response even if it contains markdown or extra text
-        try:
-            # First try to parse as is
+    return {"responseMimeType": "application/json", "responseSchema": schema}
+
+def extract_json_object(text):
+    """First JSON object in a model reply, tolerating markdown fences or prose around it"""
+    text = text.strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = None
+        decoder = json.JSONDecoder()
+        for match in re.finditer(r"\{", text):
             try:
-                response_data = json.loads(ai_response)
+                data, _ = decoder.raw_decode(text, match.start())
+                break
             except json.JSONDecodeError:
-                # Try to find JSON object within the text
-                print("Initial JSON parse failed, trying to extract JSON object from text...")
-                import re
-                # Look for content between curly braces
-                json_match = re.search(r'\{[^\{\}]*"puzzle"[^\{\}]*"solution"[^\{\}]*\}', ai_response)
-                if json_match:
-                    json_str = json_match.group(0)
-                    print(f"Found potential JSON: {json_str[:100]}...")
-                    response_data = json.loads(json_str)
-                else:
-                    # Look for content between code blocks if it's formatted as markdown
-                    json_match = re.search(r'```(?:json)?\s*({[^`]*})\s*```', ai_response)
-                    if json_match:
-                        json_str = json_match.group(1)
-                        print(f"Found JSON in code block: {json_str[:100]}...")
-                        response_data = json.loads(json_str)
-                    else:
-                        print(f"Could not find JSON pattern in response: {ai_response}")
-                        raise ValueError("Could not extract JSON from response")
-            
-            # Extract puzzle and solution
-            puzzle = response_data.get("puzzle")
-            solution = response_data.get("solution")
-            
-            if not puzzle or not solution:
-                print(f"Error: Missing puzzle or solution in response: {ai_response}")
-                raise ValueError(f"Missing puzzle or solution in response: {ai_response[:500]}")
-                
-        except Exception as e:
-            print(f"Error processing API response: {str(e)}\nResponse was: {ai_response}")
-            # Fallback to a simple built-in puzzle if API parsing fails
-            puzzle = "A man is found dead in a room with 53 bicycles. What happened?"
-            solution = "The man was a cyclist in a bicycle race and was poisoned by a competitor. The 53 bicycles are from all the competitors in the race."
-            print("Using fallback puzzle due to API response processing error")
-        
-        print(f"Successfully parsed puzzle: {puzzle[:50]}...")
-        print(f"Successfully parsed solution: {solution[:50]}...")
-        
-        # Store the game state
-        game_sessions[session_id] = {
-            "riddle": {
-                "puzzle": puzzle,
-                "solution": solution
-            },
-            "messages": [
-                user_message,
-                {"role": "assistant", "content": ai_response}
-            ],
-            "score": 0,
-            "game_over": False
-        }
-        
-        # Set up the game with another system message for ongoing interactions
-        setup_message = {
-            "role": "system",
-            "content": f"""
+                continue
+    if not isinstance(data, dict):
+        raise ValueError("Could not extract a JSON object from response")
+    return data
+
+def string_list(data, field, count, required):
+    """Non-empty strings of a list field, capped at count[1]; ValueError if required and short"""
+    value = data.get(field)
+    items = [item.strip() for item in value if isinstance(item, str) and item.strip()] if isinstance(value, list) else []
+    if required and len(items) < count[0]:
+        raise ValueError(f"Expected at least {count[0]} '{field}' in response, got {len(items)}")
+    return items[:count[1]]
+
+def parse_puzzle_response(ai_response, structured=False):
+    """Validated puzzle bundle from a generation reply.
+
+    Returns 'puzzle', 'solution', 'hints' and 'key_facts', plus 'intro' for
+    structured replies. Raises ValueError if the reply isn't a JSON object with
+    non-empty strings for every text field; the hint ladder and key facts are
+    required in structured replies and best-effort in prose ones.
+    """
+    return validate_puzzle(extract_json_object(ai_response), structured)
+
+def parse_puzzle_batch(ai_response):
+    """(valid bundles, number of invalid candidates) of a batch generation reply"""
+    items = extract_json_object(ai_response).get("puzzles")
+    if not isinstance(items, list):
+        raise ValueError("Missing 'puzzles' list in response")
+    valid, invalid = [], 0
+    for item in items:
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("Puzzle is not an object")
+            valid.append(validate_puzzle(item, structured=True))
+        except ValueError:
+            invalid += 1
+    return valid, invalid
+
+def validate_puzzle(data, structured):
+    """Bundle fields of one generated puzzle object; see parse_puzzle_response"""
+    fields = ["puzzle", "solution", "intro"] if structured else ["puzzle", "solution"]
+    result = {}
+    for field in fields:
+        value = data.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"Missing or empty '{field}' in response")
+        result[field] = value.strip()
+    result["hints"] = string_list(data, "hints", HINT_COUNT, structured)
+    result["key_facts"] = string_list(data, "key_facts", KEY_FACT_COUNT, structured)
+    return result
+
+def admit_puzzle(generated):
+    """Record a puzzle as issued, or reject it as a near-duplicate of one that was"""
+    if puzzle_library is not None:
+        try:
+            # Including those other workers have filed since the last check
+            puzzle_library.sync_index()
+        except sqlite3.Error:
+            logger.exception("Could not load puzzle signatures from the library")
+    added, similarity = puzzle_index.add_if_novel(
+        puzzle_fingerprint(generated["puzzle"], generated["solution"]),
+        signature_text(generated["puzzle"], generated["solution"])
+    )
+    metrics.PUZZLE_SIMILARITY.observe(similarity)
+    if not added:
+        metrics.PUZZLE_GENERATIONS.inc(outcome="duplicate")
+        logger.info("Rejected near-duplicate puzzle (similarity %.2f): %s", similarity, Truncated(generated["puzzle"], 80))
+    return added
+
+def check_generation(api_result, attempt, batch=False):
+    """Valid, novel puzzles from one generation call; empty if none survived"""
+    message = api_result.get("message", "")
+    try:
+        if batch:
+            candidates, invalid = parse_puzzle_batch(message)
+        else:
+            candidates, invalid = [parse_puzzle_response(message, structured=STRUCTURED_OUTPUT)], 0
+    except ValueError as e:
+        metrics.PUZZLE_GENERATIONS.inc(outcome="invalid")
+        logger.warning("Invalid puzzle reply (attempt %d/%d): %s. Response was: %s",
+                       attempt, GENERATION_ATTEMPTS, e, Truncated(message, 500))
+        return []
+    if invalid:
+        metrics.PUZZLE_GENERATIONS.inc(invalid, outcome="invalid")
+        logger.warning("Skipped %d invalid puzzles in batch reply (attempt %d/%d)", invalid, attempt, GENERATION_ATTEMPTS)
+    accepted = [generated for generated in candidates if admit_puzzle(generated)]
+    metrics.PUZZLE_GENERATIONS.inc(len(accepted), outcome="valid")
+    return accepted
+
+def fallback_generation(key=None, reason="fallback"):
+    """Puzzle for a game that can't be generated: a library puzzle if there is one, else the built-in one"""
+    stored = puzzle_library.pick(key, relaxed=True) if puzzle_library is not None and key else None
+    if stored is not None:
+        logger.info("Serving library puzzle (%s) for %s", reason, key)
+        metrics.LIBRARY_PUZZLES.inc(reason=reason)
+        return stored
+    logger.warning("Using the built-in fallback puzzle")
+    metrics.FALLBACK_PUZZLES.inc()
+    return {
+        "puzzle": FALLBACK_PUZZLE,
+        "solution": FALLBACK_SOLUTION,
+        "intro": FALLBACK_INTRO,
+        "hints": list(FALLBACK_HINTS),
+        "key_facts": list(FALLBACK_KEY_FACTS)
+    }
+
+def puzzle_entry(generated, spent):
+    """Pool/session entry for a generated puzzle whose intro is known; ``spent`` carries its token usage"""
+    # Only the host rules and the game conversation are kept; the generation
+    # prompt and raw JSON reply are never resent
+    entry = {
+        "puzzle_id": puzzle_fingerprint(generated["puzzle"], generated["solution"]),
+        "puzzle": generated["puzzle"],
+        "solution": generated["solution"],
+        "intro": generated["intro"],
+        "hints": generated["hints"],
+        "key_facts": generated["key_facts"],
+        "system_prompt": build_setup_message(generated["puzzle"], generated["solution"], generated["key_facts"])["content"],
+        "messages": [dict(START_MESSAGE), {"role": "assistant", "content": generated["intro"]}]
+    }
+    add_usage(entry, spent.get("usage"))
+    return entry
+
+def puzzle_fingerprint(puzzle, solution):
+    """Stable identity for a puzzle, shared by every session that plays it"""
+    return hashlib.sha1(f"{puzzle}\n{solution}".encode("utf-8")).hexdigest()[:16]
+
+def host_prompt(game_state):
+    """Host rules for a session, rendered from its riddle rather than stored per session"""
+    riddle = game_state['riddle']
+    return build_setup_message(riddle['puzzle'], riddle['solution'], riddle.get('key_facts', ()))['content']
+
+def build_setup_message(puzzle, solution, key_facts=()):
+    # Set up the game with another system message for ongoing interactions
+    facts = "".join(f"\n- {fact}" for fact in key_facts)
+    facts = f"KEY FACTS OF THE SOLUTION (answer consistently with these):{facts}\n" if facts else ""
+    return {
+        "role": "system",
+        "content": f"""
 You are hosting a Lateral Thinking Puzzle game. The puzzle is: "{puzzle}"
 The hidden solution is: "{solution}"
+{facts}
 
 RULES FOR RESPONDING:
 1. When the player asks questions or makes guesses about the puzzle, evaluate their input carefully.
@@ -307,50 +778,575 @@ RULES FOR RESPONDING:
 
 Remember: Your goal is to be a fair and engaging puzzle master, challenging the player while helping them eventually reach the solution.
 """
-        }
-        
-        game_sessions[session_id]["messages"].append(setup_message)
-        
-        # Call Gemini again to get initial game message
-        user_message = {
-            "role": "user",
-            "content": "Let's start the game. Present the puzzle to me."
-        }
-        game_sessions[session_id]["messages"].append(user_message)
-        
-        print("Calling Gemini API to get intro message...")
-        intro_result = call_gemini_api(game_sessions[session_id]["messages"])
+    }
+
+def generation_steps(difficulty, puzzle_length, theme, allow_fallback=False, priority=GENERATION):
+    """The work of generate_puzzle_entry, apart from the upstream calls.
+
+    Yields the call_gemini_api keyword arguments of each call it needs and is
+    sent the call's result, or thrown the Overloaded it raised, so the Flask
+    and asyncio modes share everything but the transport; see advance.
+    """
+    logger.info("Creating a new puzzle with settings: difficulty=%s, length=%s, theme=%s", difficulty, puzzle_length, theme)
+
+    user_message = build_generation_message(difficulty, puzzle_length, theme)
+    spent = {}
+    generated = None
+    for attempt in range(1, GENERATION_ATTEMPTS + 1):
+        try:
+            api_result = yield dict(messages=[user_message], phase="generation",
+                                    generation_config=puzzle_generation_config(), priority=priority)
+        except Overloaded:
+            metrics.PUZZLE_GENERATIONS.inc(outcome="shed")
+            break
+        add_usage(spent, api_result.get("usage"))
+        if not api_result.get("success"):
+            # The client already retried transient upstream errors
+            metrics.PUZZLE_GENERATIONS.inc(outcome="error")
+            break
+        accepted = check_generation(api_result, attempt)
+        if accepted:
+            generated = accepted[0]
+            break
+
+    # Only puzzles generated and introduced by Gemini go into the library
+    fresh = generated is not None
+    if generated is None:
+        if not allow_fallback:
+            return None
+        generated = fallback_generation(puzzle_key(difficulty, puzzle_length, theme))
+
+    logger.debug("Parsed puzzle: %s", Truncated(generated["puzzle"], 50))
+
+    if "intro" not in generated:
+        system_prompt = build_setup_message(generated["puzzle"], generated["solution"], generated["key_facts"])["content"]
+        try:
+            intro_result = yield dict(messages=[START_MESSAGE], system_instruction=system_prompt, phase="intro",
+                                      priority=PREFETCH if priority == PREFETCH else INTRO)
+        except Overloaded as e:
+            intro_result = {"message": f"Error calling AI API: {e}", "success": False}
+        add_usage(spent, intro_result.get("usage"))
+        if not intro_result.get('success') and not allow_fallback:
+            return None
+        generated["intro"] = intro_result.get('message', '')
+        logger.debug("Intro response: %s", Truncated(generated["intro"]))
+        fresh = fresh and intro_result.get('success')
+
+    entry = puzzle_entry(generated, spent)
+    if fresh:
+        store_puzzles(puzzle_key(difficulty, puzzle_length, theme), [entry])
+    return entry
+
+def advance(steps, result=None, error=None):
+    """Resume generation steps with a call's result or Overloaded error.
+
+    Returns (True, the next call's keyword arguments), or (False, the entry)
+    once they are done.
+    """
+    try:
+        return True, steps.throw(error) if error is not None else steps.send(result)
+    except StopIteration as done:
+        return False, done.value
+
+def generate_puzzle_entry(difficulty, puzzle_length, theme, allow_fallback=False, priority=GENERATION):
+    """Generate a puzzle bundle: puzzle, solution, intro, hint ladder and key facts.
+
+    With structured output the whole bundle comes from one schema-constrained
+    call, retried up to PUZZLE_GENERATION_ATTEMPTS times while the reply fails
+    validation; in prose mode the intro takes a second call. Returns a dict
+    with the bundle, the host 'system_prompt', the 'messages' that seed a
+    session and the token 'usage' spent. Returns None
+    if generation failed, unless allow_fallback is set, in which case a
+    library puzzle or the built-in fallback puzzle is used. Calls are
+    scheduled at ``priority``; a shed call counts as a failed generation.
+    """
+    steps = generation_steps(difficulty, puzzle_length, theme, allow_fallback, priority)
+    running, value = advance(steps)
+    while running:
+        try:
+            result, error = call_gemini_api(**value), None
+        except Overloaded as e:
+            result, error = None, e
+        running, value = advance(steps, result, error)
+    return value
+
+def split_usage(spent, count):
+    """Even share of one call's token usage for each of ``count`` puzzles it produced"""
+    usage = spent.get("usage")
+    if not usage or count < 2:
+        return spent
+    return {"usage": {kind: value // count for kind, value in usage.items()}}
+
+def generate_puzzle_batch(difficulty, puzzle_length, theme, count=None, priority=PREFETCH):
+    """Generate up to ``count`` (PUZZLE_BATCH_SIZE) distinct puzzle entries with one call.
+
+    Invalid and near-duplicate candidates are dropped; the call is retried
+    within PUZZLE_GENERATION_ATTEMPTS only if none survive. Returns a list,
+    empty if generation failed. Without structured output this generates a
+    single puzzle. Calls are scheduled as prefetch work by default, behind
+    anything a player is waiting on.
+    """
+    count = count or BATCH_SIZE
+    if count < 2 or not STRUCTURED_OUTPUT:
+        entry = generate_puzzle_entry(difficulty, puzzle_length, theme, priority=priority)
+        return [entry] if entry is not None else []
+
+    logger.info("Creating %d puzzles with settings: difficulty=%s, length=%s, theme=%s", count, difficulty, puzzle_length, theme)
+
+    user_message = build_generation_message(difficulty, puzzle_length, theme, count)
+    spent = {}
+    accepted = []
+    for attempt in range(1, GENERATION_ATTEMPTS + 1):
+        try:
+            api_result = call_gemini_api([user_message], phase="generation",
+                                         generation_config=puzzle_generation_config(count), priority=priority)
+        except Overloaded:
+            metrics.PUZZLE_GENERATIONS.inc(outcome="shed")
+            break
+        add_usage(spent, api_result.get("usage"))
+        if not api_result.get("success"):
+            metrics.PUZZLE_GENERATIONS.inc(outcome="error")
+            break
+        accepted = check_generation(api_result, attempt, batch=True)
+        if accepted:
+            break
+
+    share = split_usage(spent, len(accepted))
+    entries = [puzzle_entry(generated, share) for generated in accepted]
+    store_puzzles(puzzle_key(difficulty, puzzle_length, theme), entries)
+    return entries
+
+def store_puzzles(key, entries):
+    """File newly generated puzzles in the library; a library failure never costs a game"""
+    if puzzle_library is None or not entries:
+        return
+    try:
+        puzzle_library.add(key, entries)
+    except sqlite3.Error:
+        logger.exception("Could not store %d puzzles in the library", len(entries))
+
+def library_entry(key, reason):
+    """Session entry for a library puzzle in ``key``'s bucket, or None if there is none"""
+    stored = puzzle_library.pick(key) if puzzle_library is not None else None
+    if stored is None:
+        return None
+    logger.info("Serving library puzzle (%s) for %s", reason, key)
+    metrics.LIBRARY_PUZZLES.inc(reason=reason)
+    return puzzle_entry(stored, {})
+
+def ready_puzzle(difficulty, puzzle_length, theme):
+    """Entry for a new game that needs no upstream call, or None to generate one live.
+
+    PUZZLE_LIBRARY_SHARE of games replay a library puzzle; the rest come from
+    the warm pool. While Gemini is rate-limited or down, games never wait on
+    it: they start on a library puzzle, or the built-in one.
+    """
+    key = puzzle_key(difficulty, puzzle_length, theme)
+    if LIBRARY_SHARE and random.random() < LIBRARY_SHARE:
+        entry = library_entry(key, "mix")
+        if entry is not None:
+            return entry
+    entry = puzzle_pool.pop(key)
+    if entry is not None:
+        logger.info("Serving pooled puzzle for difficulty=%s, length=%s, theme=%s", difficulty, puzzle_length, theme)
+        return entry
+    if upstream_health.degraded:
+        return puzzle_entry(fallback_generation(key, reason="outage"), {})
+    return None
+
+def record_play(game_state):
+    """Count a new game towards its puzzle's play count"""
+    if puzzle_library is not None:
+        try:
+            puzzle_library.record_play(game_state['puzzle_id'])
+        except sqlite3.Error:
+            logger.exception("Could not record a play in the puzzle library")
+
+def record_solve(game_state):
+    """Count a game the player solved towards its puzzle's solve rate"""
+    if puzzle_library is not None:
+        try:
+            puzzle_library.record_solve(game_state['puzzle_id'])
+        except sqlite3.Error:
+            logger.exception("Could not record a solve in the puzzle library")
+
+# Every generated puzzle is kept on disk, to replay and to fall back on; PUZZLE_LIBRARY=false disables it
+puzzle_library = PuzzleLibrary(
+    os.getenv("PUZZLE_LIBRARY_PATH", "puzzles.db"),
+    index=puzzle_index
+) if os.getenv("PUZZLE_LIBRARY", "true").lower() == "true" else None
+if puzzle_library is not None:
+    # New puzzles are checked against the stored ones, not just this process's
+    puzzle_library.sync_index()
+# Fraction of games started on a library puzzle rather than a freshly generated one
+LIBRARY_SHARE = float(os.getenv("PUZZLE_LIBRARY_SHARE", "0"))
+
+# Cumulative scores across games, ranked in SQLite and written in batches; LEADERBOARD=false disables it
+leaderboard = Leaderboard(
+    os.getenv("LEADERBOARD_PATH", "leaderboard.db"),
+    flush_interval=float(os.getenv("LEADERBOARD_FLUSH_INTERVAL", "1")),
+    on_flush=lambda rows, seconds: (metrics.LEADERBOARD_WRITES.inc(rows), metrics.LEADERBOARD_FLUSH.observe(seconds))
+) if os.getenv("LEADERBOARD", "true").lower() == "true" else None
+if leaderboard is not None:
+    # Queued points are written on a clean shutdown
+    atexit.register(leaderboard.flush)
+
+# Warm pool of pre-generated puzzles; PUZZLE_POOL_LOW_WATER=0 disables it
+puzzle_pool = PuzzlePool(
+    generate_puzzle_batch,
+    low_water=int(os.getenv("PUZZLE_POOL_LOW_WATER", "2")),
+    prewarm=[
+        (difficulty, puzzle_length, theme)
+        for difficulty in DIFFICULTY_GUIDELINES
+        for puzzle_length in LENGTH_GUIDELINES
+        for theme in PUZZLE_TYPES
+    ] if os.getenv("PUZZLE_POOL_PREWARM", "false").lower() == "true" else ()
+)
+
+def session_gauge(key):
+    """Scrape-time reading of a session store statistic (shared stores may not report it)"""
+    stats = session_store.stats()
+    return stats[key] if key in stats else {}
+
+metrics.Gauge("riddlesense_sessions", "Live game sessions", function=lambda: session_gauge("sessions"))
+metrics.Gauge("riddlesense_session_bytes", "Estimated size of live game sessions", function=lambda: session_gauge("bytes"))
+metrics.Gauge(
+    "riddlesense_puzzle_pool_ready", "Ready puzzles in the warm pool, by bucket",
+    ["difficulty", "length", "theme"], function=puzzle_pool.sizes
+)
+metrics.Gauge(
+    "riddlesense_puzzle_library_size", "Puzzles in the persistent library",
+    function=lambda: puzzle_library.stats()["puzzles"] if puzzle_library is not None else {}
+)
+metrics.Gauge(
+    "riddlesense_gemini_queue_depth", "Gemini calls queued for the outbound rate limiter, by priority",
+    ["priority"], function=upstream_scheduler.depths
+)
+metrics.Gauge(
+    "riddlesense_gemini_hedge_deadline_seconds", "Current hedge deadline per model and kind of call",
+    ["model", "kind"], function=hedger.deadlines
+)
+metrics.Gauge(
+    "riddlesense_context_cache_size", "Puzzle host prompts currently cached upstream",
+    function=lambda: len(context_cache) if context_cache is not None else {}
+)
+metrics.Gauge(
+    "riddlesense_leaderboard_players", "Players with a score on the leaderboard",
+    function=lambda: len(leaderboard) if leaderboard is not None else {}
+)
+metrics.Gauge(
+    "riddlesense_gemini_degraded", "1 while Gemini is treated as rate-limited or down, else 0",
+    function=lambda: int(upstream_health.degraded)
+)
+metrics.Counter(
+    "riddlesense_answer_cache_lookups_total", "Answer cache lookups by result (hit, similar_hit, miss)",
+    ["result"], function=lambda: {
+        ("hit",): stats["hits"] - stats["similar_hits"],
+        ("similar_hit",): stats["similar_hits"],
+        ("miss",): stats["misses"]
+    } if (stats := answer_cache.stats()) else {}
+)
+
+def request_session_id():
+    """Session ID named in the current request body, for log correlation"""
+    data = request.get_json(silent=True) if request.is_json else None
+    session_id = data.get('session_id') if isinstance(data, dict) else None
+    return str(session_id) if session_id else "-"
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.time()
+    g.route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.REQUESTS_IN_FLIGHT.inc(route=g.route)
+    # Every request binds its own IDs, so nothing leaks between requests on a thread
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    request_id_var.set(g.request_id)
+    session_id_var.set(request_session_id())
+
+@app.after_request
+def record_request(response):
+    if "request_started" in g:
+        metrics.REQUEST_LATENCY.observe(
+            time.time() - g.request_started,
+            route=g.route, method=request.method, status=response.status_code
+        )
+    if "request_id" in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@app.teardown_request
+def finish_request(exc):
+    if "route" in g:
+        metrics.REQUESTS_IN_FLIGHT.dec(route=g.route)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def session_player(data):
+    """Leaderboard identity for a game: the client's player ID if it sent one, else a new one"""
+    player_id = data.get('player_id')
+    if not isinstance(player_id, str) or not 0 < len(player_id) <= 64:
+        player_id = str(uuid.uuid4())
+    name = " ".join(str(data.get('name') or "").split())[:32]
+    return {"id": player_id, "name": name or "Anonymous"}
+
+def new_session_state(entry, difficulty):
+    """Initial state of a game session playing a generated or pooled puzzle"""
+    return {
+        "riddle": {
+            "puzzle": entry["puzzle"],
+            "solution": entry["solution"],
+            "hints": list(entry.get("hints", [])),
+            "key_facts": list(entry.get("key_facts", []))
+        },
+        "hints_used": 0,
+        "puzzle_id": entry["puzzle_id"],
+        "messages": list(entry["messages"]),
+        "facts": [],
+        "usage": dict(entry.get("usage", {"prompt": 0, "response": 0})),
+        "score": 0,
+        "game_over": False,
+        "difficulty": difficulty,
+        "start_time": time.time()
+    }
+
+@app.route('/api/start_game', methods=['POST'])
+def start_game():
+    session_id = str(uuid.uuid4())
+    session_id_var.set(session_id)
+    
+    try:
+        # Get game settings from request
+        data = request.json or {}
+        difficulty = data.get('difficulty', 'medium')
+        puzzle_length = data.get('puzzleLength', 'medium')
+        theme = data.get('theme', 'random')
         
-        # Extract the message from the API result
-        if isinstance(intro_result, dict):
-            intro_response = intro_result.get('message', '')
-        else:
-            intro_response = str(intro_result)
-        print(f"Intro response: {intro_response[:100]}...")
+        # Serve from the library or the warm pool, only generating live when neither has one
+        entry = ready_puzzle(difficulty, puzzle_length, theme)
+        if entry is None:
+            entry = generate_puzzle_entry(difficulty, puzzle_length, theme, allow_fallback=True)
         
-        game_sessions[session_id]["messages"].append({"role": "assistant", "content": intro_response})
+        # Store the game state
+        game_state = new_session_state(entry, difficulty)
+        game_state['player'] = session_player(data)
+        session_store.put(session_id, game_state)
+        record_play(game_state)
+        attach_context(game_state)
         
         return jsonify({
             "success": True,
             "session_id": session_id,
-            "puzzle": puzzle,
-            "message": intro_response
+            "player_id": game_state['player']['id'],
+            "puzzle": entry["puzzle"],
+            "message": entry["intro"]
         })
         
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error in start_game: {str(e)}\n{error_details}")
+        logger.exception("Error in start_game")
         return jsonify({
             "success": False,
             "error": f"Server error: {str(e)}"
         }), 500
 
+def finish_turn(game_state, message):
+    """Record the host's reply and apply scoring. Returns (message, game_over)."""
+    # Update the game state and score
+    game_state['messages'].append({
+        'role': 'assistant',
+        'content': message
+    })
+    conversation.record(game_state)
+    
+    # Check if the game is over
+    game_over = '[GAME_COMPLETED]' in message
+    if game_over:
+        end_game(game_state)
+    
+    # Update score ONLY if game is over AND the user solved it
+    # Do NOT update score if AI revealed the answer automatically
+    if game_over and 'auto_reveal' not in game_state and 'difficulty' in game_state:
+        game_state['score'] = solve_score(game_state)
+        record_score(game_state)
+        
+        # Remove the [GAME_COMPLETED] tag from the message
+        message = message.replace('[GAME_COMPLETED]', '')
+    
+    return message, game_over
+
+def solve_score(game_state):
+    """Points for solving the game now: base points adjusted for time spent"""
+    current_time = time.time()
+    time_spent = round((current_time - game_state.get('start_time', current_time)) / 60, 2)
+    base_points = calculate_base_points(game_state['difficulty'])
+    time_factor = calculate_time_factor(time_spent, game_state['difficulty'])
+    return base_points * time_factor
+
+def record_score(game_state):
+    """Add a solved game's points to its player's leaderboard total; only queued, never written here"""
+    player = game_state.get('player')
+    if leaderboard is not None and player is not None:
+        leaderboard.add(player['id'], player['name'], game_state['score'])
+
+def end_game(game_state):
+    """Mark the game over, reporting its token spend the first time it ends"""
+    if not game_state.get('game_over'):
+        usage = game_state.get('usage', {})
+        metrics.SESSION_TOKENS.observe(usage.get('prompt', 0) + usage.get('response', 0))
+        if not game_state.get('auto_reveal'):
+            record_solve(game_state)
+        detach_context(game_state)
+    game_state['game_over'] = True
+
+ROUTED_REPLIES = {
+    REPEAT: "Here's the puzzle again:\n\n{puzzle}",
+    GREETING: "Hello! Here's your puzzle:\n\n{puzzle}\n\nAsk me a yes-or-no question to get started.",
+    HELP: ("Ask me yes-or-no questions about the puzzle and I'll answer \"Yes\", \"No\" or "
+           "\"That's irrelevant\". When you think you know what happened, tell me your guess. "
+           "Say \"hint\" if you're stuck, or \"I give up\" if you want to see the solution."),
+    SOLUTION: "Here is the solution:\n\n{solution}",
+    HINT: "Here's a hint: {hint}"
+}
+
+NO_HINTS_LEFT = ("That was the last hint for this puzzle. Keep asking yes-or-no questions, "
+                 "or say \"I give up\" to see the solution.")
+
+def input_intent(question):
+    """The intent router's reading of a player input, or None when Gemini should answer it"""
+    return intent_router.classify(question) if intent_router is not None else None
+
+def routed_reply(game_state, question):
+    """Reply to give-up, solution and meta inputs from the stored riddle, or None for real questions.
+
+    Giving up ends the game without points, exactly like get_solution; being
+    stuck takes the next hint, like get_hint. Routed turns are not added to
+    the conversation sent to Gemini.
+    """
+    intent = input_intent(question)
+    if intent is None:
+        return None
+    metrics.ROUTED_INPUTS.inc(intent=intent)
+    riddle = game_state['riddle']
+    if intent in (GIVE_UP, SOLUTION):
+        # A game that is already over, e.g. a solved room, just shows the solution again
+        if not game_state.get('game_over'):
+            game_state['auto_reveal'] = True
+            end_game(game_state)
+        intent = SOLUTION
+    elif intent == HINT:
+        hint = take_hint(game_state)
+        return NO_HINTS_LEFT if hint is None else ROUTED_REPLIES[HINT].format(hint=hint)
+    return ROUTED_REPLIES[intent].format(puzzle=riddle['puzzle'], solution=riddle['solution'])
+
+def remember_answer(game_state, question, message):
+    """Cache plain yes/no verdicts; guesses and completions depend on more than the question"""
+    if '[GAME_COMPLETED]' not in message and VERDICT_PATTERN.match(message):
+        answer_cache.put(game_state['puzzle_id'], question, message)
+
+def overloaded_result(error):
+    """Response body for a turn whose Gemini call was shed; sent with status 503"""
+    return {
+        'success': False,
+        'error': 'The server is busy right now, please try again in a moment',
+        'retry_after': error.retry_after
+    }
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Event"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def stream_answer(session_id, question):
+    """Relay Gemini's answer as SSE while accumulating it into the session.
+
+    Emits 'data' events with {"delta": ...} chunks, then a final 'done' event
+    carrying the same body as the non-streaming endpoint. Clients should use
+    the final message, which has the completion tag handled.
+    """
+    chunks = []
+    try:
+        # Hold the session lock for the whole turn so concurrent asks don't interleave
+        with session_store.lock(session_id):
+            game_state = session_store.get(session_id)
+            if game_state is None:
+                yield sse_event({
+                    'success': False,
+                    'error': 'Invalid session ID'
+                }, event='error')
+                return
+            
+            message = routed_reply(game_state, question)
+            if message is not None:
+                session_store.put(session_id, game_state)
+                yield sse_event({'delta': message})
+                yield sse_event({
+                    'success': True,
+                    'message': message,
+                    'score': game_state.get('score', 0),
+                    'game_over': game_state.get('game_over', False)
+                }, event='done')
+                return
+            
+            # Add the user's question to the message history
+            asked = {
+                'role': 'user',
+                'content': question
+            }
+            game_state['messages'].append(asked)
+            try:
+                cached = answer_cache.get(game_state['puzzle_id'], question)
+                if cached is not None:
+                    chunks.append(cached)
+                    yield sse_event({'delta': cached})
+                else:
+                    prompt = host_prompt(game_state)
+                    system_instruction, messages = conversation.build(game_state, prompt)
+                    usage = {}
+                    try:
+                        for chunk in stream_gemini_api(messages, system_instruction, usage=usage,
+                                                       cached=cached_prefix(game_state, prompt)):
+                            chunks.append(chunk)
+                            yield sse_event({'delta': chunk})
+                    except Overloaded as e:
+                        yield sse_event(overloaded_result(e), event='error')
+                        return
+                    add_usage(game_state, usage)
+                    remember_answer(game_state, question, ''.join(chunks))
+
+                message, game_over = finish_turn(game_state, ''.join(chunks))
+            finally:
+                # A turn shed, failed or cut off before its answer was recorded never happened,
+                # so a retry doesn't send the question twice
+                if game_state['messages'][-1] is asked:
+                    game_state['messages'].pop()
+            session_store.put(session_id, game_state)
+        
+        yield sse_event({
+            'success': True,
+            'message': message,
+            'score': game_state.get('score', 0),
+            'game_over': game_over
+        }, event='done')
+        
+    except TimeoutError:
+        yield sse_event({
+            'success': False,
+            'error': 'Session is busy, please try again'
+        }, event='error')
+    except Exception as e:
+        logger.exception("Error streaming answer")
+        yield sse_event({
+            'success': False,
+            'error': 'Error processing your request'
+        }, event='error')
+
 @app.route('/api/ask', methods=['POST'])
 def ask_question():
     data = request.json
     session_id = data.get('session_id')
     question = data.get('question')
+    stream = data.get('stream') or 'text/event-stream' in request.headers.get('Accept', '')
     
     if not session_id or not question:
         return jsonify({
@@ -358,14 +1354,47 @@ def ask_question():
             'error': 'Missing required parameters'
         })
     
+    if stream:
+        if session_id not in session_store:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid session ID'
+            })
+        return Response(
+            stream_with_context(stream_answer(session_id, question)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
+    try:
+        # Hold the session lock for the whole turn so concurrent asks don't interleave
+        with session_store.lock(session_id):
+            return answer_question(session_id, question)
+    except TimeoutError:
+        return jsonify({
+            'success': False,
+            'error': 'Session is busy, please try again'
+        })
+
+def answer_question(session_id, question):
     # Get game state
-    if session_id not in game_sessions:
+    game_state = session_store.get(session_id)
+    if game_state is None:
         return jsonify({
             'success': False,
             'error': 'Invalid session ID'
         })
     
-    game_state = game_sessions[session_id]
+    # Give-up and meta requests are answered without an API call
+    message = routed_reply(game_state, question)
+    if message is not None:
+        session_store.put(session_id, game_state)
+        return jsonify({
+            'success': True,
+            'message': message,
+            'score': game_state.get('score', 0),
+            'game_over': game_state.get('game_over', False)
+        })
     
     # Add the user's question to the message history
     game_state['messages'].append({
@@ -374,41 +1403,32 @@ def ask_question():
     })
     
     try:
-        # Call API with all messages
-        api_result = call_gemini_api(game_state['messages'])
-        
-        # 处理API返回结果
-        if isinstance(api_result, dict):
-            message = api_result.get('message', 'Error processing your question')
-        else:
-            # 如果不是字典，直接使用字符串表示
-            message = str(api_result)
+        # Repeated questions are answered from the cache without an API call
+        message = answer_cache.get(game_state['puzzle_id'], question)
         
-        # Update the game state and score
-        game_state['messages'].append({
-            'role': 'assistant',
-            'content': message
-        })
-        
-        # Check if the game is over
-        game_over = '[GAME_COMPLETED]' in message
-        
-        # Update score ONLY if game is over AND the user solved it
-        # Do NOT update score if AI revealed the answer automatically
-        if game_over and 'auto_reveal' not in game_state and 'difficulty' in game_state:
-            current_time = time.time()
-            time_spent = round((current_time - game_state.get('start_time', current_time)) / 60, 2)
-            
-            # Calculate score - base points adjusted for time spent
-            base_points = calculate_base_points(game_state['difficulty'])
-            time_factor = calculate_time_factor(time_spent, game_state['difficulty'])
-            game_state['score'] = base_points * time_factor
-            
-            # Remove the [GAME_COMPLETED] tag from the message
-            message = message.replace('[GAME_COMPLETED]', '')
+        if message is None:
+            # Call API with the rules, fact digest and recent turns only
+            prompt = host_prompt(game_state)
+            system_instruction, messages = conversation.build(game_state, prompt)
+            try:
+                api_result = call_gemini_api(messages, system_instruction, cached=cached_prefix(game_state, prompt))
+            except Overloaded as e:
+                # Shed before anything was sent; the question never happened
+                game_state['messages'].pop()
+                return jsonify(overloaded_result(e)), 503, {'Retry-After': str(e.retry_after)}
             
-        # Game state is automatically updated since we're modifying the dictionary directly
-        # No need to call an update function
+            # 处理API返回结果
+            if isinstance(api_result, dict):
+                message = api_result.get('message', 'Error processing your question')
+                add_usage(game_state, api_result.get('usage'))
+                if api_result.get('success'):
+                    remember_answer(game_state, question, message)
+            else:
+                # 如果不是字典，直接使用字符串表示
+                message = str(api_result)
+        
+        message, game_over = finish_turn(game_state, message)
+        session_store.put(session_id, game_state)
         
         return jsonify({
             'success': True,
@@ -418,7 +1438,7 @@ def ask_question():
         })
         
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.exception("Error answering question")
         return jsonify({
             'success': False,
             'error': 'Error processing your request'
@@ -435,43 +1455,33 @@ def get_solution():
             'error': 'Missing session ID parameter'
         })
     
+    try:
+        with session_store.lock(session_id):
+            return reveal_solution(session_id)
+    except TimeoutError:
+        return jsonify({
+            'success': False,
+            'error': 'Session is busy, please try again'
+        })
+
+def reveal_solution(session_id):
     # Get game state
-    if session_id not in game_sessions:
+    game_state = session_store.get(session_id)
+    if game_state is None:
         return jsonify({
             'success': False,
             'error': 'Invalid session ID'
         })
-        
-    game_state = game_sessions[session_id]
     
     try:
-        # Get the solution directly from the game state
-        solution = game_state.get('solution', '')
-        
-        if not solution:
-            # If no solution is stored, ask Gemini for it
-            solution_request = {
-                'role': 'user',
-                'content': "Please tell me the complete solution to this puzzle directly."
-            }
-            
-            # Create a copy of messages and add solution request
-            messages_copy = game_state['messages'].copy()
-            messages_copy.append(solution_request)
-            
-            # Call API with all messages including solution request
-            api_result = call_gemini_api(messages_copy)
-            # 处理API返回结果
-            if isinstance(api_result, dict):
-                solution = api_result.get('message', 'Unable to get answer')
-            else:
-                # 如果不是字典，直接使用字符串表示
-                solution = str(api_result)
+        # The solution is part of the puzzle bundle; no upstream call needed
+        solution = game_state['riddle']['solution']
         
         # Mark game as over but don't award points
         # Make sure we're not trying to access difficulty if it's not available
         game_state['auto_reveal'] = True
-        game_state['game_over'] = True
+        end_game(game_state)
+        session_store.put(session_id, game_state)
         
         return jsonify({
             'success': True,
@@ -480,12 +1490,73 @@ def get_solution():
         })
         
     except Exception as e:
-        print(f"Error getting solution: {str(e)}")
+        logger.exception("Error getting solution")
         return jsonify({
             'success': False,
             'error': 'Error processing your request'
         })
 
+def take_hint(game_state):
+    """Next hint from the puzzle's ladder, or None once they are used up"""
+    hints = game_state['riddle'].get('hints', [])
+    used = game_state.get('hints_used', 0)
+    if used >= len(hints):
+        return None
+    game_state['hints_used'] = used + 1
+    metrics.HINTS_SERVED.inc()
+    return hints[used]
+
+def hint_result(game_state, hint):
+    """Response body for /api/hint"""
+    hints_left = len(game_state['riddle'].get('hints', [])) - game_state.get('hints_used', 0)
+    if hint is None:
+        return {
+            'success': False,
+            'error': 'No more hints for this puzzle',
+            'hints_left': 0
+        }
+    return {
+        'success': True,
+        'hint': hint,
+        'hint_number': game_state['hints_used'],
+        'hints_left': hints_left
+    }
+
+@app.route('/api/hint', methods=['POST'])
+def get_hint():
+    data = request.json
+    session_id = data.get('session_id')
+    
+    if not session_id:
+        return jsonify({
+            'success': False,
+            'error': 'Missing session ID parameter'
+        })
+    
+    try:
+        with session_store.lock(session_id):
+            game_state = session_store.get(session_id)
+            if game_state is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Invalid session ID'
+                })
+            
+            hint = take_hint(game_state)
+            if hint is not None:
+                session_store.put(session_id, game_state)
+            return jsonify(hint_result(game_state, hint))
+    except TimeoutError:
+        return jsonify({
+            'success': False,
+            'error': 'Session is busy, please try again'
+        })
+
+def carry_player(old_state, new_state, data):
+    """Keep the old game's leaderboard identity for a new game started without a player ID"""
+    if old_state is not None and 'player' in old_state and not data.get('player_id'):
+        new_state['player'] = dict(old_state['player'])
+
 @app.route('/api/new_game', methods=['POST'])
 def new_game():
     data = request.json
@@ -493,8 +1564,9 @@ def new_game():
     
     # Copy the score from the old session if it exists
     score = 0
-    if old_session_id and old_session_id in game_sessions:
-        score = game_sessions[old_session_id].get("score", 0)
+    old_state = session_store.get(old_session_id) if old_session_id else None
+    if old_state is not None:
+        score = old_state.get("score", 0)
     
     # Start a new game (reuse the start_game endpoint logic)
     response = start_game()
@@ -502,12 +1574,404 @@ def new_game():
     
     if response_data and response_data.get("success"):
         new_session_id = response_data.get("session_id")
-        if new_session_id in game_sessions:
-            # Transfer the score from the old session
-            game_sessions[new_session_id]["score"] = score
+        new_state = session_store.get(new_session_id)
+        if new_state is not None:
+            # Transfer the score, and the player unless the request named one
+            new_state["score"] = score
+            carry_player(old_state, new_state, data)
+            session_store.put(new_session_id, new_state)
             response_data["score"] = score
+            response_data["player_id"] = new_state['player']['id']
+        
+        # The old game has ended; free its state
+        if old_state is not None:
+            if not old_state.get('game_over'):
+                detach_context(old_state)
+            session_store.delete(old_session_id)
     
     return jsonify(response_data)
 
+LEADERBOARD_MAX_LIMIT = 100
+
+def leaderboard_result(data):
+    """Response body for /api/leaderboard: a page of top players, and the caller's standing if asked"""
+    if leaderboard is None:
+        return {'success': False, 'error': 'The leaderboard is disabled'}
+    try:
+        limit = min(max(int(data.get('limit', 10)), 0), LEADERBOARD_MAX_LIMIT)
+        offset = max(int(data.get('offset', 0)), 0)
+    except (TypeError, ValueError):
+        return {'success': False, 'error': 'Invalid limit or offset'}
+    player_id = data.get('player_id')
+    return {
+        'success': True,
+        'players': len(leaderboard),
+        'leaders': leaderboard.top(limit, offset),
+        'player': leaderboard.rank(player_id) if isinstance(player_id, str) else None
+    }
+
+@app.route('/api/leaderboard', methods=['POST'])
+def get_leaderboard():
+    return jsonify(leaderboard_result(request.json or {}))
+
+# Multiplayer rooms share one puzzle and history. Questions asked within
+# ROOM_BATCH_WINDOW of each other (or while the room's previous call is out)
+# are answered by a single Gemini call, and every answer is broadcast to the
+# room. Rooms live in the session store, but their members and batches are
+# held by the process serving them, so route each room to one worker.
+ROOM_BATCH_WINDOW = float(os.getenv("ROOM_BATCH_WINDOW", "0.2"))
+ROOM_MAX_PLAYERS = int(os.getenv("ROOM_MAX_PLAYERS", "50"))
+ROOM_HEARTBEAT = float(os.getenv("ROOM_HEARTBEAT", "15"))
+room_hub = RoomHub(
+    max_batch=int(os.getenv("ROOM_MAX_BATCH", "8")),
+    max_pending=int(os.getenv("ROOM_EVENT_BUFFER", "100"))
+)
+
+ROOM_RULES = """
+MULTIPLAYER: Several players share this game. Each question starts with the asking player's name in square
+brackets, which is not part of the question. When one message holds several numbered questions, answer every one
+of them in order, each on its own line starting with its number (e.g. "1. Yes"), following the rules above. If a
+question guesses the complete solution correctly, end only that question's answer with "[GAME_COMPLETED]".
+"""
+ROOM_UNANSWERED = "Sorry, I lost track of that question. Please ask it again."
+# Events after which a room's game is over and its streams close
+ROOM_FINAL_EVENTS = ("solved", "revealed")
+
+# Numbered answers in a reply to several questions, e.g. "2. No"
+BATCH_ANSWER_PATTERN = re.compile(r"^\s*(\d+)[.):]\s*", re.MULTILINE)
+
+def room_key(room_id):
+    # Rooms share the session store with single-player games
+    return f"room:{room_id}"
+
+def player_name(data, state=None):
+    name = " ".join(str(data.get('name') or "").split())[:32]
+    if not name:
+        name = f"Player {len(state['players']) + 1 if state else 1}"
+    return name
+
+def room_players(game_state):
+    return [{"name": player["name"], "score": player["score"]} for player in game_state['players'].values()]
+
+def room_history(game_state):
+    """Messages a member joining late sees; the opening request isn't shown"""
+    return [dict(message) for message in game_state['messages'] if message != START_MESSAGE]
+
+def room_summary(game_state):
+    return {
+        'puzzle': game_state['riddle']['puzzle'],
+        'players': room_players(game_state),
+        'messages': room_history(game_state),
+        'game_over': game_state.get('game_over', False)
+    }
+
+def create_room_state(entry, difficulty, data):
+    """(room id, player id, state) of a new room whose creator is its first player"""
+    room_id = str(uuid.uuid4())
+    player_id = str(uuid.uuid4())
+    game_state = new_session_state(entry, difficulty)
+    game_state['players'] = {player_id: {"name": player_name(data), "score": 0, "joined": time.time()}}
+    session_store.put(room_key(room_id), game_state)
+    record_play(game_state)
+    attach_context(game_state)
+    return room_id, player_id, game_state
+
+def join_room_state(room_id, data):
+    """Add a player to a room. Returns (player id, state) or an error message instead of the id."""
+    key = room_key(room_id)
+    game_state = session_store.get(key)
+    if game_state is None or 'players' not in game_state:
+        return 'Invalid room ID', None
+    if len(game_state['players']) >= ROOM_MAX_PLAYERS:
+        return 'This room is full', None
+    player_id = str(uuid.uuid4())
+    name = player_name(data, game_state)
+    game_state['players'][player_id] = {"name": name, "score": 0, "joined": time.time()}
+    session_store.put(key, game_state)
+    room_hub.publish(room_id, {"type": "joined", "data": {"player": name, "players": room_players(game_state)}})
+    return player_id, game_state
+
+def room_ask_error(room_id, player_id):
+    """Why a player can't ask in a room right now, or None"""
+    game_state = session_store.get(room_key(room_id))
+    if game_state is None or 'players' not in game_state:
+        return 'Invalid room ID'
+    if player_id not in game_state['players']:
+        return 'Invalid player ID'
+    if game_state.get('game_over'):
+        return 'This game is over'
+    return None
+
+def batch_message(questions):
+    """One user turn carrying a batch's (name, question) pairs"""
+    if len(questions) == 1:
+        name, question = questions[0]
+        return {"role": "user", "content": f"[{name}] {question}"}
+    lines = "\n".join(f"{number}. [{name}] {question}" for number, (name, question) in enumerate(questions, 1))
+    return {
+        "role": "user",
+        "content": f"{len(questions)} questions were asked at once. Answer each on its own numbered line:\n{lines}"
+    }
+
+def split_batch_answers(reply, count):
+    """Per-question answers of a reply to ``count`` numbered questions; None where one is missing"""
+    if count == 1:
+        return [reply.strip() or None]
+    answers = [None] * count
+    matches = list(BATCH_ANSWER_PATTERN.finditer(reply))
+    for match, following in zip(matches, matches[1:] + [None]):
+        index = int(match.group(1)) - 1
+        if 0 <= index < count and answers[index] is None:
+            answers[index] = reply[match.end():following.start() if following else len(reply)].strip() or None
+    return answers
+
+def plan_room_batch(game_state, tickets):
+    """(answers, asked, request) for a batch of tickets holding (player id, question).
+
+    Inputs the intent router claims, such as giving up, are left out (their
+    answer stays None) and answered locally by apply_room_batch. Repeated
+    questions are answered from the answer cache; ``asked`` indexes the rest,
+    and ``request`` is the (system instruction, messages, cached prefix) of
+    the single call that answers them, or None.
+    """
+    routed = [input_intent(ticket.item[1]) is not None for ticket in tickets]
+    answers = [None if routed[index] else answer_cache.get(game_state['puzzle_id'], ticket.item[1])
+               for index, ticket in enumerate(tickets)]
+    asked = [index for index, answer in enumerate(answers) if answer is None and not routed[index]]
+    if not asked:
+        return answers, asked, None
+    players = game_state['players']
+    questions = [(players[tickets[index].item[0]]['name'], tickets[index].item[1]) for index in asked]
+    prompt = host_prompt(game_state)
+    system_instruction, messages = conversation.build(game_state, prompt + ROOM_RULES, [batch_message(questions)])
+    metrics.ROOM_BATCH_SIZE.observe(len(asked))
+    return answers, asked, (system_instruction, messages, cached_prefix(game_state, prompt))
+
+def apply_room_batch(room_id, game_state, tickets, answers, asked, api_result):
+    """Record a batch's answers in the room and score any solve. Returns each ticket's response body.
+
+    Every answered pair joins the shared history and is broadcast to the
+    room; if the upstream call failed, its questions are dropped. Routed
+    inputs are answered here, from the state the batch is applied to.
+    """
+    if api_result is not None:
+        if api_result.get('success'):
+            for index, answer in zip(asked, split_batch_answers(api_result['message'], len(asked))):
+                answers[index] = answer or ROOM_UNANSWERED
+                if answer:
+                    remember_answer(game_state, tickets[index].item[1], answer)
+        add_usage(game_state, api_result.get('usage'))
+
+    results = []
+    for index, (ticket, answer) in enumerate(zip(tickets, answers)):
+        player_id, question = ticket.item
+        player = game_state['players'][player_id]
+        if answer is None and index not in asked:
+            results.append(room_routed_result(room_id, game_state, player, question))
+            continue
+        if answer is None:
+            results.append({'success': False, 'error': api_result.get('message', 'Error processing your question')})
+            continue
+        game_state['messages'].append({'role': 'user', 'content': f"[{player['name']}] {question}"})
+        game_state['messages'].append({'role': 'assistant', 'content': answer})
+        conversation.record(game_state)
+
+        solved = '[GAME_COMPLETED]' in answer and not game_state.get('game_over')
+        answer = answer.replace('[GAME_COMPLETED]', '').strip()
+        if solved:
+            player['score'] += solve_score(game_state)
+            game_state['winner'] = player_id
+            end_game(game_state)
+        room_hub.publish(room_id, {"type": "answer", "data": {
+            'player': player['name'], 'question': question, 'message': answer,
+            'game_over': game_state.get('game_over', False)
+        }})
+        if solved:
+            room_hub.publish(room_id, {"type": "solved", "data": {
+                'player': player['name'], 'solution': game_state['riddle']['solution'],
+                'players': room_players(game_state)
+            }})
+        results.append({
+            'success': True,
+            'message': answer,
+            'score': player['score'],
+            'game_over': game_state.get('game_over', False)
+        })
+    return results
+
+def room_routed_result(room_id, game_state, player, question):
+    """Answer a routed room input for everyone. Giving up or asking for the solution reveals it and
+    ends the game with no winner; like get_solution, a reveal is never scored."""
+    was_over = game_state.get('game_over', False)
+    message = routed_reply(game_state, question)
+    game_over = game_state.get('game_over', False)
+    room_hub.publish(room_id, {"type": "answer", "data": {
+        'player': player['name'], 'question': question, 'message': message, 'game_over': game_over
+    }})
+    if game_over and not was_over:
+        room_hub.publish(room_id, {"type": "revealed", "data": {
+            'player': player['name'], 'solution': game_state['riddle']['solution'],
+            'players': room_players(game_state)
+        }})
+    return {'success': True, 'message': message, 'score': player['score'], 'game_over': game_over}
+
+def closed_room_results(game_state, count):
+    """Responses for a batch in a room that has expired or whose game is over, else None"""
+    if game_state is None:
+        return [{'success': False, 'error': 'Invalid room ID'}] * count
+    if game_state.get('game_over'):
+        return [{'success': False, 'error': 'This game is over'}] * count
+    return None
+
+def answer_room_batch(room_id, tickets):
+    """Answer a batch of room questions with at most one Gemini call"""
+    key = room_key(room_id)
+    # Only this batch changes the room's history, so the lock isn't held during the call
+    with session_store.lock(key):
+        game_state = session_store.get(key)
+        closed = closed_room_results(game_state, len(tickets))
+        if closed is not None:
+            return closed
+        answers, asked, request = plan_room_batch(game_state, tickets)
+    api_result = None
+    if request is not None:
+        system_instruction, messages, cached = request
+        api_result = call_gemini_api(messages, system_instruction, cached=cached)
+    with session_store.lock(key):
+        game_state = session_store.get(key)
+        closed = closed_room_results(game_state, len(tickets))
+        if closed is not None:
+            return closed
+        results = apply_room_batch(room_id, game_state, tickets, answers, asked, api_result)
+        session_store.put(key, game_state)
+    return results
+
+def run_room_batch(room_id, first):
+    # A fresh leader waits a moment for more questions; a promoted one has a queue already
+    if first and ROOM_BATCH_WINDOW > 0:
+        time.sleep(ROOM_BATCH_WINDOW)
+    tickets = room_hub.take(room_id)
+    results, error = None, None
+    try:
+        results = answer_room_batch(room_id, tickets)
+    except Overloaded as e:
+        error = e
+    except Exception as e:
+        logger.exception("Error answering room questions")
+        error = e
+    finally:
+        room_hub.finish(room_id, tickets, results, error)
+
+def room_ticket_response(ticket):
+    if isinstance(ticket.error, Overloaded):
+        return jsonify(overloaded_result(ticket.error)), 503, {'Retry-After': str(ticket.error.retry_after)}
+    if ticket.error is not None:
+        return jsonify({'success': False, 'error': 'Error processing your request'}), 500
+    return jsonify(ticket.result)
+
+@app.route('/api/rooms/create', methods=['POST'])
+def create_room():
+    try:
+        data = request.json or {}
+        difficulty = data.get('difficulty', 'medium')
+        puzzle_length = data.get('puzzleLength', 'medium')
+        theme = data.get('theme', 'random')
+        
+        entry = ready_puzzle(difficulty, puzzle_length, theme)
+        if entry is None:
+            entry = generate_puzzle_entry(difficulty, puzzle_length, theme, allow_fallback=True)
+        
+        room_id, player_id, game_state = create_room_state(entry, difficulty, data)
+        return jsonify({
+            "success": True,
+            "room_id": room_id,
+            "player_id": player_id,
+            "puzzle": entry["puzzle"],
+            "message": entry["intro"],
+            "players": room_players(game_state)
+        })
+    except Exception as e:
+        logger.exception("Error in create_room")
+        return jsonify({
+            "success": False,
+            "error": f"Server error: {str(e)}"
+        }), 500
+
+@app.route('/api/rooms/join', methods=['POST'])
+def join_room():
+    data = request.json or {}
+    room_id = data.get('room_id')
+    if not room_id:
+        return jsonify({'success': False, 'error': 'Missing required parameters'})
+    try:
+        with session_store.lock(room_key(room_id)):
+            player_id, game_state = join_room_state(room_id, data)
+    except TimeoutError:
+        return jsonify({'success': False, 'error': 'Room is busy, please try again'})
+    if game_state is None:
+        return jsonify({'success': False, 'error': player_id})
+    return jsonify({'success': True, 'room_id': room_id, 'player_id': player_id, **room_summary(game_state)})
+
+@app.route('/api/rooms/ask', methods=['POST'])
+def room_ask():
+    data = request.json or {}
+    room_id = data.get('room_id')
+    player_id = data.get('player_id')
+    question = data.get('question')
+    if not room_id or not player_id or not question:
+        return jsonify({'success': False, 'error': 'Missing required parameters'})
+    error = room_ask_error(room_id, player_id)
+    if error is not None:
+        return jsonify({'success': False, 'error': error})
+    
+    ticket = room_hub.submit(room_id, (player_id, question))
+    while not ticket.done:
+        if ticket.leader:
+            run_room_batch(room_id, first=not ticket.promoted)
+        else:
+            ticket.wait()
+    return room_ticket_response(ticket)
+
+def room_event_stream(room_id, subscription, game_state):
+    """SSE feed of a room: a 'room' snapshot, then 'joined', 'answer' and 'solved' or 'revealed' events until the game ends"""
+    try:
+        yield sse_event(room_summary(game_state), event='room')
+        if game_state.get('game_over'):
+            return
+        while True:
+            events = subscription.get(ROOM_HEARTBEAT)
+            if not events:
+                # Comment line; keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+            for event in events:
+                yield sse_event(event['data'], event=event['type'])
+                if event['type'] in ROOM_FINAL_EVENTS:
+                    return
+    finally:
+        room_hub.unsubscribe(room_id, subscription)
+
+@app.route('/api/rooms/events', methods=['POST'])
+def room_events():
+    data = request.json or {}
+    room_id = data.get('room_id')
+    game_state = session_store.get(room_key(room_id)) if room_id else None
+    if game_state is None or data.get('player_id') not in game_state.get('players', {}):
+        return jsonify({'success': False, 'error': 'Invalid room or player ID'})
+    subscription = room_hub.subscribe(room_id)
+    return Response(
+        stream_with_context(room_event_stream(room_id, subscription, game_state)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+metrics.Gauge(
+    "riddlesense_rooms_active", "Rooms with members listening or questions being answered in this process",
+    function=lambda: room_hub.stats()["rooms"]
+)
+metrics.Gauge(
+    "riddlesense_room_listeners", "Room members connected to an event stream",
+    function=lambda: room_hub.stats()["listeners"]
+)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
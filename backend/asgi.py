@@ -0,0 +1,752 @@
+"""asyncio serving mode for the game API.
+
+The Flask app in app.py ties up one thread per request for the whole time it
+waits on Gemini. This module serves the same endpoints as a plain ASGI
+application with an async HTTP client, so thousands of in-flight games can
+share a handful of OS threads:
+
+    pip install httpx uvicorn
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Game logic, prompts, the puzzle pool, caches and session storage are shared
+with app.py; only the upstream calls and request handling are async here.
+Calls into the puzzle library and leaderboard, which wait on SQLite, run in
+worker threads.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+import app as game
+import metrics
+from call_scheduler import Overloaded
+from gemini_client import AsyncGeminiClient, GeminiAPIError, httpx
+from log_utils import Truncated, request_id_var, session_id_var
+from session_store import LOCK_LEASE
+
+logger = logging.getLogger("riddlesense.asgi")
+
+gemini_client = AsyncGeminiClient(
+    pool_size=game.gemini_client.pool_size,
+    connect_timeout=game.gemini_client.connect_timeout,
+    read_timeout=game.gemini_client.read_timeout,
+    max_retries=game.gemini_client.max_retries,
+    backoff_base=game.gemini_client.backoff_base,
+    backoff_max=game.gemini_client.backoff_max,
+    on_retry=game.gemini_client.on_retry
+)
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"POST, OPTIONS"),
+    (b"access-control-allow-headers", b"Content-Type, Accept, X-Request-ID")
+]
+
+
+class HTTPError(Exception):
+    def __init__(self, status, body, headers=()):
+        super().__init__(body)
+        self.status = status
+        self.body = body
+        self.headers = list(headers)
+
+
+async def close_response(response):
+    await response.aclose()
+
+
+async def post_with_prefix(model, messages, system_instruction, generation_config, cached):
+    url = f"{game.model_url(model)}?key={game.API_KEY}"
+    response = await gemini_client.post(
+        url, game.request_payload(model, messages, system_instruction, generation_config, cached)
+    )
+    if game.cache_dropped(cached, model, response):
+        await response.aclose()
+        response = await gemini_client.post(url, game.request_payload(model, messages, system_instruction, generation_config))
+    return response
+
+
+async def call_gemini_api(messages, system_instruction=None, phase="ask", generation_config=None, priority=None,
+                          cached=None):
+    priority = game.PHASE_PRIORITIES[phase] if priority is None else priority
+    await game.upstream_scheduler.acquire_async(priority)
+
+    started = time.time()
+    metrics.UPSTREAM_IN_FLIGHT.inc(phase=phase)
+    try:
+        model, response = await game.hedger.run_async(
+            phase,
+            lambda model: post_with_prefix(model, messages, system_instruction, generation_config, cached),
+            ok=lambda response: response.status_code == 200,
+            discard=close_response,
+            may_hedge=lambda: game.upstream_scheduler.try_acquire(priority)
+        )
+    except httpx.HTTPError as e:
+        logger.warning("API request failed: %s", e.__class__.__name__)
+        game.record_gemini_call(phase, "error", started)
+        return {"message": f"Error calling AI API: {e.__class__.__name__}", "success": False}
+    finally:
+        metrics.UPSTREAM_IN_FLIGHT.dec(phase=phase)
+
+    logger.debug("API response status code from %s: %s", model, response.status_code)
+
+    result = game.gemini_result(response.status_code, response.text)
+    game.record_gemini_call(phase, response.status_code, started, result.get("usage"))
+    return result
+
+
+async def open_stream(model, messages, system_instruction=None, cached=None):
+    """Async counterpart of app.open_stream; a cancelled opener closes its response"""
+    url = f"{game.model_url(model, stream=True)}?alt=sse&key={game.API_KEY}"
+    payload = game.request_payload(model, messages, system_instruction, cached=cached)
+    response = await gemini_client.post(url, payload, stream=True)
+    if game.cache_dropped(cached, model, response):
+        await response.aclose()
+        payload = game.request_payload(model, messages, system_instruction)
+        response = await gemini_client.post(url, payload, stream=True)
+    if response.status_code != 200:
+        return response, None, [], None
+    lines = response.aiter_lines()
+    try:
+        async for line in lines:
+            texts, usage = game.parse_stream_line(line)
+            if texts:
+                return response, lines, texts, usage
+    except BaseException:
+        await response.aclose()
+        raise
+    return response, lines, [], None
+
+
+async def close_stream(opened):
+    await opened[0].aclose()
+
+
+async def stream_gemini_api(messages, system_instruction=None, phase="ask", usage=None, cached=None):
+    """Async counterpart of app.stream_gemini_api"""
+    priority = game.PHASE_PRIORITIES[phase]
+    await game.upstream_scheduler.acquire_async(priority)
+
+    started = time.time()
+    status = "error"
+    call_usage = None
+    metrics.UPSTREAM_IN_FLIGHT.inc(phase=phase)
+    try:
+        try:
+            model, (response, lines, texts, call_usage) = await game.hedger.run_async(
+                phase,
+                lambda model: open_stream(model, messages, system_instruction, cached),
+                ok=lambda opened: opened[1] is not None,
+                discard=close_stream,
+                kind=f"{phase}_first_chunk",
+                may_hedge=lambda: game.upstream_scheduler.try_acquire(priority)
+            )
+        except httpx.HTTPError as e:
+            logger.warning("Streaming API request failed: %s", e.__class__.__name__)
+            raise GeminiAPIError(f"Error calling AI API: {e.__class__.__name__}")
+
+        status = response.status_code
+        try:
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", "replace")
+                logger.warning("API error response %s: %s", response.status_code, Truncated(body, 500))
+                raise GeminiAPIError(f"Error calling AI API: {response.status_code} - {body}")
+
+            for text in texts:
+                yield text
+            async for line in lines:
+                texts, line_usage = game.parse_stream_line(line)
+                call_usage = line_usage or call_usage
+                for text in texts:
+                    yield text
+        finally:
+            await response.aclose()
+    finally:
+        metrics.UPSTREAM_IN_FLIGHT.dec(phase=phase)
+        game.record_gemini_call(phase, status, started, call_usage)
+        if usage is not None and call_usage:
+            usage.update(call_usage)
+
+
+async def generate_puzzle_entry(difficulty, puzzle_length, theme, allow_fallback=False):
+    """Async counterpart of app.generate_puzzle_entry; the steps between calls use the puzzle library,
+    so they run in a worker thread"""
+    steps = game.generation_steps(difficulty, puzzle_length, theme, allow_fallback)
+    running, value = await asyncio.to_thread(game.advance, steps)
+    while running:
+        try:
+            result, error = await call_gemini_api(**value), None
+        except Overloaded as e:
+            result, error = None, e
+        running, value = await asyncio.to_thread(game.advance, steps, result, error)
+    return value
+
+
+async def store_io(call, *args):
+    """Run a session store call, off the event loop when the store does I/O"""
+    if game.session_store.blocking:
+        return await asyncio.to_thread(call, *args)
+    return call(*args)
+
+
+# session_id -> [asyncio.Lock, coroutines holding or waiting for it]
+_session_locks = {}
+
+
+@asynccontextmanager
+async def session_lock(session_id):
+    """Hold a session's lock without blocking the event loop or a thread while waiting.
+
+    Coroutines of this process queue on a per-session asyncio.Lock, so the
+    store's lock, which serializes processes, is only taken once no one here
+    holds it. Store locks may be released from another thread than the one
+    that took them.
+    """
+    entry = _session_locks.setdefault(session_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        try:
+            await asyncio.wait_for(entry[0].acquire(), LOCK_LEASE)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Session {session_id} is busy") from None
+        try:
+            lock = game.session_store.lock(session_id)
+            await store_io(lock.__enter__)
+            try:
+                yield
+            finally:
+                await store_io(lock.__exit__, None, None, None)
+        finally:
+            entry[0].release()
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _session_locks[session_id]
+
+
+async def start_game(data):
+    difficulty = data.get('difficulty', 'medium')
+    puzzle_length = data.get('puzzleLength', 'medium')
+    theme = data.get('theme', 'random')
+
+    entry = await asyncio.to_thread(game.ready_puzzle, difficulty, puzzle_length, theme)
+    if entry is None:
+        entry = await generate_puzzle_entry(difficulty, puzzle_length, theme, allow_fallback=True)
+
+    session_id = str(uuid.uuid4())
+    session_id_var.set(session_id)
+    game_state = game.new_session_state(entry, difficulty)
+    game_state['player'] = game.session_player(data)
+    await store_io(game.session_store.put, session_id, game_state)
+    await asyncio.to_thread(game.record_play, game_state)
+    game.attach_context(game_state)
+
+    return {
+        "success": True,
+        "session_id": session_id,
+        "player_id": game_state['player']['id'],
+        "puzzle": entry["puzzle"],
+        "message": entry["intro"]
+    }
+
+
+async def ask_question(data):
+    session_id = data.get('session_id')
+    question = data.get('question')
+
+    if not session_id or not question:
+        return {'success': False, 'error': 'Missing required parameters'}
+
+    if data.get('stream'):
+        if not await store_io(game.session_store.__contains__, session_id):
+            return {'success': False, 'error': 'Invalid session ID'}
+        return stream_answer(session_id, question)
+
+    try:
+        async with session_lock(session_id):
+            game_state = await store_io(game.session_store.get, session_id)
+            if game_state is None:
+                return {'success': False, 'error': 'Invalid session ID'}
+
+            message = game.routed_reply(game_state, question)
+            if message is not None:
+                await store_io(game.session_store.put, session_id, game_state)
+                return {
+                    'success': True,
+                    'message': message,
+                    'score': game_state.get('score', 0),
+                    'game_over': game_state.get('game_over', False)
+                }
+
+            game_state['messages'].append({'role': 'user', 'content': question})
+
+            message = game.answer_cache.get(game_state['puzzle_id'], question)
+            if message is None:
+                prompt = game.host_prompt(game_state)
+                system_instruction, messages = game.conversation.build(game_state, prompt)
+                try:
+                    api_result = await call_gemini_api(messages, system_instruction,
+                                                       cached=game.cached_prefix(game_state, prompt))
+                except Overloaded as e:
+                    game_state['messages'].pop()
+                    raise HTTPError(503, game.overloaded_result(e), [(b"retry-after", str(e.retry_after).encode())])
+                message = api_result.get('message', 'Error processing your question')
+                game.add_usage(game_state, api_result.get('usage'))
+                if api_result.get('success'):
+                    game.remember_answer(game_state, question, message)
+
+            message, game_over = await asyncio.to_thread(game.finish_turn, game_state, message)
+            await store_io(game.session_store.put, session_id, game_state)
+    except TimeoutError:
+        return {'success': False, 'error': 'Session is busy, please try again'}
+
+    return {
+        'success': True,
+        'message': message,
+        'score': game_state.get('score', 0),
+        'game_over': game_over
+    }
+
+
+async def stream_answer(session_id, question):
+    """Async counterpart of app.stream_answer, yielding formatted SSE events"""
+    chunks = []
+    try:
+        async with session_lock(session_id):
+            game_state = await store_io(game.session_store.get, session_id)
+            if game_state is None:
+                yield game.sse_event({'success': False, 'error': 'Invalid session ID'}, event='error')
+                return
+
+            message = game.routed_reply(game_state, question)
+            if message is not None:
+                await store_io(game.session_store.put, session_id, game_state)
+                yield game.sse_event({'delta': message})
+                yield game.sse_event({
+                    'success': True,
+                    'message': message,
+                    'score': game_state.get('score', 0),
+                    'game_over': game_state.get('game_over', False)
+                }, event='done')
+                return
+
+            asked = {'role': 'user', 'content': question}
+            game_state['messages'].append(asked)
+            try:
+                cached = game.answer_cache.get(game_state['puzzle_id'], question)
+                if cached is not None:
+                    chunks.append(cached)
+                    yield game.sse_event({'delta': cached})
+                else:
+                    prompt = game.host_prompt(game_state)
+                    system_instruction, messages = game.conversation.build(game_state, prompt)
+                    usage = {}
+                    try:
+                        async for chunk in stream_gemini_api(messages, system_instruction, usage=usage,
+                                                             cached=game.cached_prefix(game_state, prompt)):
+                            chunks.append(chunk)
+                            yield game.sse_event({'delta': chunk})
+                    except Overloaded as e:
+                        yield game.sse_event(game.overloaded_result(e), event='error')
+                        return
+                    game.add_usage(game_state, usage)
+                    game.remember_answer(game_state, question, ''.join(chunks))
+
+                message, game_over = await asyncio.to_thread(game.finish_turn, game_state, ''.join(chunks))
+            finally:
+                # As in app.stream_answer, a turn that recorded no answer leaves no question behind
+                if game_state['messages'][-1] is asked:
+                    game_state['messages'].pop()
+            await store_io(game.session_store.put, session_id, game_state)
+
+        yield game.sse_event({
+            'success': True,
+            'message': message,
+            'score': game_state.get('score', 0),
+            'game_over': game_over
+        }, event='done')
+
+    except TimeoutError:
+        yield game.sse_event({'success': False, 'error': 'Session is busy, please try again'}, event='error')
+    except Exception as e:
+        logger.exception("Error streaming answer")
+        yield game.sse_event({'success': False, 'error': 'Error processing your request'}, event='error')
+
+
+async def get_solution(data):
+    session_id = data.get('session_id')
+    if not session_id:
+        return {'success': False, 'error': 'Missing session ID parameter'}
+
+    try:
+        async with session_lock(session_id):
+            game_state = await store_io(game.session_store.get, session_id)
+            if game_state is None:
+                return {'success': False, 'error': 'Invalid session ID'}
+
+            solution = game_state['riddle']['solution']
+            game_state['auto_reveal'] = True
+            game.end_game(game_state)
+            await store_io(game.session_store.put, session_id, game_state)
+    except TimeoutError:
+        return {'success': False, 'error': 'Session is busy, please try again'}
+
+    return {'success': True, 'solution': solution, 'game_over': True}
+
+
+async def get_hint(data):
+    session_id = data.get('session_id')
+    if not session_id:
+        return {'success': False, 'error': 'Missing session ID parameter'}
+
+    try:
+        async with session_lock(session_id):
+            game_state = await store_io(game.session_store.get, session_id)
+            if game_state is None:
+                return {'success': False, 'error': 'Invalid session ID'}
+
+            hint = game.take_hint(game_state)
+            if hint is not None:
+                await store_io(game.session_store.put, session_id, game_state)
+    except TimeoutError:
+        return {'success': False, 'error': 'Session is busy, please try again'}
+
+    return game.hint_result(game_state, hint)
+
+
+async def new_game(data):
+    old_session_id = data.get('session_id')
+
+    # Loading the old session and creating the new game are independent
+    old_state, response_data = await asyncio.gather(
+        store_io(game.session_store.get, old_session_id) if old_session_id else asyncio.sleep(0),
+        start_game(data)
+    )
+
+    score = old_state.get("score", 0) if old_state else 0
+    if response_data.get("success"):
+        new_session_id = response_data["session_id"]
+        new_state = await store_io(game.session_store.get, new_session_id)
+        if new_state is not None:
+            new_state["score"] = score
+            game.carry_player(old_state, new_state, data)
+            await store_io(game.session_store.put, new_session_id, new_state)
+            response_data["score"] = score
+            response_data["player_id"] = new_state['player']['id']
+        if old_state is not None:
+            if not old_state.get('game_over'):
+                game.detach_context(old_state)
+            await store_io(game.session_store.delete, old_session_id)
+
+    return response_data
+
+
+async def get_leaderboard(data):
+    return await asyncio.to_thread(game.leaderboard_result, data)
+
+
+async def create_room(data):
+    difficulty = data.get('difficulty', 'medium')
+    puzzle_length = data.get('puzzleLength', 'medium')
+    theme = data.get('theme', 'random')
+
+    entry = await asyncio.to_thread(game.ready_puzzle, difficulty, puzzle_length, theme)
+    if entry is None:
+        entry = await generate_puzzle_entry(difficulty, puzzle_length, theme, allow_fallback=True)
+
+    room_id, player_id, game_state = await store_io(game.create_room_state, entry, difficulty, data)
+    return {
+        "success": True,
+        "room_id": room_id,
+        "player_id": player_id,
+        "puzzle": entry["puzzle"],
+        "message": entry["intro"],
+        "players": game.room_players(game_state)
+    }
+
+
+async def join_room(data):
+    room_id = data.get('room_id')
+    if not room_id:
+        return {'success': False, 'error': 'Missing required parameters'}
+    try:
+        async with session_lock(game.room_key(room_id)):
+            player_id, game_state = await store_io(game.join_room_state, room_id, data)
+    except TimeoutError:
+        return {'success': False, 'error': 'Room is busy, please try again'}
+    if game_state is None:
+        return {'success': False, 'error': player_id}
+    return {'success': True, 'room_id': room_id, 'player_id': player_id, **game.room_summary(game_state)}
+
+
+async def answer_room_batch(room_id, tickets):
+    """Async counterpart of app.answer_room_batch"""
+    key = game.room_key(room_id)
+    async with session_lock(key):
+        game_state = await store_io(game.session_store.get, key)
+        closed = game.closed_room_results(game_state, len(tickets))
+        if closed is not None:
+            return closed
+        answers, asked, request = game.plan_room_batch(game_state, tickets)
+    api_result = None
+    if request is not None:
+        system_instruction, messages, cached = request
+        api_result = await call_gemini_api(messages, system_instruction, cached=cached)
+    async with session_lock(key):
+        game_state = await store_io(game.session_store.get, key)
+        closed = game.closed_room_results(game_state, len(tickets))
+        if closed is not None:
+            return closed
+        results = await asyncio.to_thread(game.apply_room_batch, room_id, game_state, tickets, answers, asked, api_result)
+        await store_io(game.session_store.put, key, game_state)
+    return results
+
+
+async def run_room_batch(room_id, first):
+    if first and game.ROOM_BATCH_WINDOW > 0:
+        await asyncio.sleep(game.ROOM_BATCH_WINDOW)
+    tickets = game.room_hub.take(room_id)
+    results, error = None, None
+    try:
+        results = await answer_room_batch(room_id, tickets)
+    except Overloaded as e:
+        error = e
+    except BaseException as e:
+        # Including cancellation, so the batch's other askers aren't left waiting
+        if not isinstance(e, asyncio.CancelledError):
+            logger.exception("Error answering room questions")
+        error = e
+        raise
+    finally:
+        game.room_hub.finish(room_id, tickets, results, error)
+
+
+async def room_ask(data):
+    room_id = data.get('room_id')
+    player_id = data.get('player_id')
+    question = data.get('question')
+    if not room_id or not player_id or not question:
+        return {'success': False, 'error': 'Missing required parameters'}
+    error = await store_io(game.room_ask_error, room_id, player_id)
+    if error is not None:
+        return {'success': False, 'error': error}
+
+    ticket = game.room_hub.submit(room_id, (player_id, question), asyncio.get_running_loop())
+    try:
+        while not ticket.done:
+            if ticket.leader:
+                await run_room_batch(room_id, first=not ticket.promoted)
+            else:
+                await ticket.wait_async()
+    except asyncio.CancelledError:
+        if not ticket.done:
+            game.room_hub.abandon(room_id, ticket)
+        raise
+
+    if isinstance(ticket.error, Overloaded):
+        raise HTTPError(503, game.overloaded_result(ticket.error), [(b"retry-after", str(ticket.error.retry_after).encode())])
+    if ticket.error is not None:
+        raise HTTPError(500, {'success': False, 'error': 'Error processing your request'})
+    return ticket.result
+
+
+async def room_event_stream(room_id, subscription, game_state):
+    """Async counterpart of app.room_event_stream"""
+    try:
+        yield game.sse_event(game.room_summary(game_state), event='room')
+        if game_state.get('game_over'):
+            return
+        while True:
+            events = await subscription.get_async(game.ROOM_HEARTBEAT)
+            if not events:
+                yield ": keepalive\n\n"
+            for event in events:
+                yield game.sse_event(event['data'], event=event['type'])
+                if event['type'] in game.ROOM_FINAL_EVENTS:
+                    return
+    finally:
+        game.room_hub.unsubscribe(room_id, subscription)
+
+
+async def room_events(data):
+    room_id = data.get('room_id')
+    game_state = await store_io(game.session_store.get, game.room_key(room_id)) if room_id else None
+    if game_state is None or data.get('player_id') not in game_state.get('players', {}):
+        return {'success': False, 'error': 'Invalid room or player ID'}
+    subscription = game.room_hub.subscribe(room_id, asyncio.get_running_loop())
+    return room_event_stream(room_id, subscription, game_state)
+
+
+ROUTES = {
+    '/api/start_game': start_game,
+    '/api/ask': ask_question,
+    '/api/get_solution': get_solution,
+    '/api/hint': get_hint,
+    '/api/new_game': new_game,
+    '/api/leaderboard': get_leaderboard,
+    '/api/rooms/create': create_room,
+    '/api/rooms/join': join_room,
+    '/api/rooms/ask': room_ask,
+    '/api/rooms/events': room_events
+}
+
+
+async def read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    if not body:
+        return {}
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise HTTPError(400, {'success': False, 'error': 'Invalid JSON body'})
+
+
+def response_headers():
+    return [(b"x-request-id", request_id_var.get().encode())] + CORS_HEADERS
+
+
+async def send_json(send, status, data, headers=()):
+    body = json.dumps(data).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+                   + list(headers) + response_headers()
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def send_event_stream(send, events, receive=None):
+    """Send an async generator of SSE chunks.
+
+    With ``receive``, a client hanging up closes the generator at once rather
+    than whenever it next yields.
+    """
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no")
+        ] + response_headers()
+    })
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive)) if receive is not None else None
+    try:
+        if disconnected is None:
+            async for event in events:
+                await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+        while disconnected is not None:
+            following = asyncio.ensure_future(events.__anext__())
+            await asyncio.wait({following, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not following.done():
+                following.cancel()
+                await asyncio.gather(following, return_exceptions=True)
+                return
+            try:
+                event = following.result()
+            except StopAsyncIteration:
+                break
+            await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+    finally:
+        if disconnected is not None:
+            disconnected.cancel()
+        await events.aclose()
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await gemini_client.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    if scope["method"] == "OPTIONS":
+        await send({"type": "http.response.start", "status": 204, "headers": CORS_HEADERS})
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    if scope["path"] == "/metrics":
+        body = metrics.render().encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", metrics.CONTENT_TYPE.encode())]
+        })
+        await send({"type": "http.response.body", "body": body})
+        return
+
+    handler = ROUTES.get(scope["path"])
+    if handler is None:
+        await send_json(send, 404, {'success': False, 'error': 'Not found'})
+        return
+    if scope["method"] != "POST":
+        await send_json(send, 405, {'success': False, 'error': 'Method not allowed'})
+        return
+
+    # Each ASGI request runs in its own task, so these bindings don't leak
+    request_id = dict(scope["headers"]).get(b"x-request-id")
+    request_id_var.set(request_id.decode("latin-1") if request_id else uuid.uuid4().hex)
+
+    route = scope["path"]
+    started = time.time()
+    status = 500
+    metrics.REQUESTS_IN_FLIGHT.inc(route=route)
+    try:
+        status = await handle(handler, scope, receive, send)
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec(route=route)
+        metrics.REQUEST_LATENCY.observe(time.time() - started, route=route, method="POST", status=status)
+
+
+async def handle(handler, scope, receive, send):
+    """Run a route handler and send its response. Returns the HTTP status sent."""
+
+    try:
+        data = await read_json(receive)
+        if isinstance(data, dict) and data.get('session_id'):
+            session_id_var.set(str(data['session_id']))
+        if scope["path"] == '/api/ask':
+            headers = dict(scope["headers"])
+            if b"text/event-stream" in headers.get(b"accept", b""):
+                data["stream"] = True
+        result = await handler(data)
+    except HTTPError as e:
+        await send_json(send, e.status, e.body, e.headers)
+        return e.status
+    except Exception as e:
+        logger.exception("Error handling %s", scope['path'])
+        await send_json(send, 500, {'success': False, 'error': f"Server error: {str(e)}"})
+        return 500
+
+    if isinstance(result, dict):
+        await send_json(send, 200, result)
+    else:
+        # A room's event stream only ends with its game, so watch for the client leaving
+        await send_event_stream(send, result, receive if scope["path"] == '/api/rooms/events' else None)
+    return 200
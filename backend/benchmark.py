@@ -0,0 +1,333 @@
+"""Load test for the game API against the mock Gemini server.
+
+Each simulated player runs a whole game: start_game, a number of questions,
+a hint, get_solution and new_game. Players run at a fixed concurrency. The report
+shows throughput, p50/p95/p99 latency per endpoint, and the server's memory
+growth per session:
+
+    python benchmark.py --server flask --sessions 200 --concurrency 20
+    python benchmark.py --server asgi --stream --latency 1.0 --distribution lognormal
+    python benchmark.py --server none --url http://localhost:5000 --pid 12345
+
+With ``--server flask`` or ``--server asgi`` the backend is started in a
+subprocess and pointed at an in-process mock_gemini server, so no API key or
+network access is needed. With ``--server none`` an already running backend
+is measured as-is; pass ``--pid`` to include its memory.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import mock_gemini
+from puzzle_themes import PUZZLE_TYPES
+
+QUESTIONS = [
+    "Is anyone dead?",
+    "Did it happen at night?",
+    "Was the weather important?",
+    "Is there more than one person involved?",
+    "Was it an accident?",
+    "Did money play a role?",
+    "Is the location important?",
+    "Did someone lie?",
+    "Was an animal involved?",
+    "Did it happen a long time ago?"
+]
+DIFFICULTIES = ["easy", "medium", "hard"]
+LENGTHS = ["short", "medium", "long"]
+THEMES = list(PUZZLE_TYPES)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_bytes(pid):
+    """Resident set size of a process, or None where /proc isn't available"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # Nearest-rank
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def scrape_metric(url, name):
+    """Sum of all series of a metric on the backend's /metrics page, or None"""
+    try:
+        text = requests.get(f"{url}/metrics", timeout=5).text
+    except requests.RequestException:
+        return None
+    values = [float(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+              if line.startswith(name) and line[len(name)] in " {"]
+    return sum(values) if values else None
+
+
+class Recorder:
+    """Thread-safe latency and failure samples per endpoint"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.failures = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok, request=True):
+        with self._lock:
+            if request:
+                self.requests += 1
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.failures[endpoint] = self.failures.get(endpoint, 0) + 1
+
+    def summary(self, elapsed):
+        rows = {}
+        for endpoint, values in self.latencies.items():
+            rows[endpoint] = {
+                "requests": len(values),
+                "failures": self.failures.get(endpoint, 0),
+                "throughput": len(values) / elapsed if elapsed else 0.0,
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": max(values)
+            }
+        return rows
+
+
+class Player:
+    """Plays one game against the backend, recording each call"""
+
+    def __init__(self, url, http, recorder, questions, stream):
+        self.url = url
+        self.http = http
+        self.recorder = recorder
+        self.questions = questions
+        self.stream = stream
+
+    def call(self, endpoint, payload):
+        started = time.perf_counter()
+        try:
+            response = self.http.post(f"{self.url}{endpoint}", json=payload, timeout=300)
+            data = response.json()
+            ok = response.status_code == 200 and data.get("success", False)
+        except (requests.RequestException, ValueError):
+            data, ok = {}, False
+        self.recorder.record(endpoint, time.perf_counter() - started, ok)
+        return data
+
+    def ask_streaming(self, session_id, question):
+        started = time.perf_counter()
+        first_token = None
+        ok = False
+        try:
+            with self.http.post(f"{self.url}/api/ask", json={"session_id": session_id, "question": question},
+                                headers={"Accept": "text/event-stream"}, stream=True, timeout=300) as response:
+                event = None
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                    elif line.startswith("data:"):
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                        if event == "done":
+                            ok = True
+                        event = None
+        except requests.RequestException:
+            pass
+        elapsed = time.perf_counter() - started
+        self.recorder.record("/api/ask (stream)", elapsed, ok)
+        self.recorder.record("/api/ask (first event)", first_token if first_token is not None else elapsed, ok,
+                             request=False)
+
+    def play(self):
+        settings = {
+            "difficulty": random.choice(DIFFICULTIES),
+            "puzzleLength": random.choice(LENGTHS),
+            "theme": random.choice(THEMES)
+        }
+        session_id = self.call("/api/start_game", settings).get("session_id")
+        if not session_id:
+            return
+        for question in random.sample(QUESTIONS, min(self.questions, len(QUESTIONS))):
+            if self.stream:
+                self.ask_streaming(session_id, question)
+            else:
+                self.call("/api/ask", {"session_id": session_id, "question": question})
+        self.call("/api/hint", {"session_id": session_id})
+        self.call("/api/get_solution", {"session_id": session_id})
+        self.call("/api/new_game", dict(settings, session_id=session_id))
+
+
+def start_backend(kind, port, gemini_url, data_dir):
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_BASE_URL": gemini_url,
+        "GEMINI_API_KEY": env.get("GEMINI_API_KEY") or "mock",
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+        # Mock puzzles and scores must not reach the real databases, which serve them to players
+        "PUZZLE_LIBRARY_PATH": os.path.join(data_dir, "puzzles.db"),
+        "LEADERBOARD_PATH": os.path.join(data_dir, "leaderboard.db"),
+        "SESSION_SQLITE_PATH": os.path.join(data_dir, "sessions.db")
+    })
+    if env.get("SESSION_JOURNAL"):
+        env["SESSION_JOURNAL"] = os.path.join(data_dir, "sessions.journal")
+    if kind == "flask":
+        command = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port), "--with-threads"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port), "--log-level", "warning"]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+
+
+def wait_until_ready(url, process=None, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Backend exited with status {process.returncode}")
+        try:
+            if requests.get(f"{url}/metrics", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Backend at {url} did not become ready within {timeout}s")
+
+
+def run(args):
+    mock = process = data_dir = None
+    url = args.url.rstrip("/")
+    pid = args.pid
+    try:
+        if args.server != "none":
+            mock = mock_gemini.make_server(config=mock_gemini.config_from_args(args))
+            threading.Thread(target=mock.serve_forever, daemon=True).start()
+            port = free_port()
+            url = f"http://127.0.0.1:{port}"
+            data_dir = tempfile.TemporaryDirectory(prefix="riddlesense-benchmark-")
+            process = start_backend(args.server, port, f"http://127.0.0.1:{mock.server_port}/v1beta", data_dir.name)
+            pid = process.pid
+        wait_until_ready(url, process)
+
+        http = requests.Session()
+        http.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=args.concurrency))
+
+        # One warm-up game so imports, pools and caches don't count as growth
+        Player(url, http, Recorder(), 1, args.stream).play()
+        rss_before = rss_bytes(pid) if pid else None
+        sessions_before = scrape_metric(url, "riddlesense_sessions") or 0
+
+        recorder = Recorder()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            games = [executor.submit(Player(url, http, recorder, args.questions, args.stream).play)
+                     for _ in range(args.sessions)]
+            for game in games:
+                game.result()
+        elapsed = time.perf_counter() - started
+
+        rss_after = rss_bytes(pid) if pid else None
+        sessions_after = scrape_metric(url, "riddlesense_sessions")
+        session_bytes = scrape_metric(url, "riddlesense_session_bytes")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        if data_dir is not None:
+            data_dir.cleanup()
+        if mock is not None:
+            mock.shutdown()
+
+    live_sessions = (sessions_after or 0) - sessions_before
+    report = {
+        "server": args.server,
+        "sessions": args.sessions,
+        "concurrency": args.concurrency,
+        "questions": args.questions,
+        "stream": args.stream,
+        "elapsed": elapsed,
+        "throughput": recorder.requests / elapsed,
+        "endpoints": recorder.summary(elapsed),
+        "rss_before": rss_before,
+        "rss_after": rss_after,
+        "live_sessions": sessions_after,
+        "session_bytes": session_bytes,
+        "rss_per_session": ((rss_after - rss_before) / live_sessions
+                            if rss_before is not None and rss_after is not None and live_sessions > 0 else None)
+    }
+    return report
+
+
+def format_bytes(value):
+    if value is None:
+        return "n/a"
+    for unit in ("B", "KiB", "MiB"):
+        if abs(value) < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} GiB"
+
+
+def print_report(report):
+    print(f"\n{report['sessions']} games, concurrency {report['concurrency']}, "
+          f"{report['questions']} questions each, {report['elapsed']:.1f}s")
+    print(f"Throughput: {report['throughput']:.1f} req/s\n")
+    print(f"{'endpoint':<26}{'reqs':>7}{'fail':>6}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for endpoint, row in sorted(report["endpoints"].items()):
+        print(f"{endpoint:<26}{row['requests']:>7}{row['failures']:>6}{row['throughput']:>8.1f}"
+              f"{row['p50'] * 1000:>7.0f}ms{row['p95'] * 1000:>7.0f}ms{row['p99'] * 1000:>7.0f}ms"
+              f"{row['max'] * 1000:>7.0f}ms")
+    print(f"\nServer RSS: {format_bytes(report['rss_before'])} -> {format_bytes(report['rss_after'])}")
+    print(f"Live sessions: {report['live_sessions'] if report['live_sessions'] is not None else 'n/a'}, "
+          f"estimated session state {format_bytes(report['session_bytes'])}")
+    print(f"RSS growth per session: {format_bytes(report['rss_per_session'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--server", choices=["flask", "asgi", "none"], default="flask",
+                        help="backend to start against the mock, or 'none' to use --url")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="backend URL when --server none")
+    parser.add_argument("--pid", type=int, help="backend process to measure when --server none")
+    parser.add_argument("--sessions", type=int, default=100, help="games to play")
+    parser.add_argument("--concurrency", type=int, default=10, help="games played at once")
+    parser.add_argument("--questions", type=int, default=5, help="questions per game")
+    parser.add_argument("--stream", action="store_true", help="ask over server-sent events")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    mock_gemini.add_arguments(parser)
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
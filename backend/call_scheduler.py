@@ -0,0 +1,193 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+# Priority classes of outbound calls, most urgent first
+ASK = 0
+INTRO = 1
+GENERATION = 2
+PREFETCH = 3
+PRIORITY_NAMES = {ASK: "ask", INTRO: "intro", GENERATION: "generation", PREFETCH: "prefetch"}
+
+# Longest a coroutine sleeps before re-checking its place in the queue
+ASYNC_POLL_INTERVAL = 0.01
+
+
+class Overloaded(Exception):
+    """Raised when a call is shed instead of queued. ``retry_after`` is a hint in seconds."""
+
+    def __init__(self, priority, reason, retry_after):
+        super().__init__(f"Upstream call shed ({PRIORITY_NAMES[priority]}: {reason})")
+        self.priority = priority
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CallScheduler:
+    """Admits outbound calls at a token-bucket rate, most urgent class first.
+
+    The bucket refills at ``rate`` calls per second up to ``burst``. A call
+    takes a token when one is free and no more urgent (or earlier, same-class)
+    call is waiting; otherwise it queues. Prefetch calls additionally leave
+    ``prefetch_reserve`` of the burst for interactive work. Each class queues
+    at most ``max_queue`` calls. A call whose turn can't come within
+    ``max_wait`` seconds at the current backlog is shed at once with
+    Overloaded, and one still waiting after ``max_wait`` is shed then, so
+    callers fail fast instead of timing out.
+
+    Threads and coroutines share one scheduler: ``acquire`` blocks a thread,
+    ``acquire_async`` only suspends a coroutine. With ``rate`` 0 every call is
+    admitted at once.
+    """
+
+    def __init__(self, rate=0.0, burst=10, max_queue=100, max_wait=10.0, prefetch_reserve=0.5,
+                 on_admit=None, on_shed=None):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.prefetch_reserve = prefetch_reserve
+        # on_admit(priority, seconds waited) and on_shed(priority, reason) feed metrics
+        self.on_admit = on_admit
+        self.on_shed = on_shed
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        # Heap of [priority, sequence] tickets; the head is next in line
+        self._queue = []
+        self._queued = {priority: 0 for priority in PRIORITY_NAMES}
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def acquire(self, priority):
+        """Block until a call of ``priority`` may go out. Raises Overloaded if it is shed."""
+        if not self.enabled:
+            return
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        with self._cond:
+            ticket = self._enqueue(priority)
+            while True:
+                now = time.monotonic()
+                delay = self._admit(ticket, now)
+                if delay is None:
+                    break
+                if now >= deadline:
+                    self._shed(ticket, "timeout")
+                self._cond.wait(min(delay, deadline - now))
+        self._admitted(priority, started)
+
+    async def acquire_async(self, priority):
+        """Wait without blocking the event loop until a call of ``priority`` may go out"""
+        if not self.enabled:
+            return
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        with self._cond:
+            ticket = self._enqueue(priority)
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    delay = self._admit(ticket, now)
+                    if delay is None:
+                        break
+                    if now >= deadline:
+                        self._shed(ticket, "timeout")
+                await asyncio.sleep(min(delay, ASYNC_POLL_INTERVAL, deadline - now))
+        except asyncio.CancelledError:
+            # A cancelled waiter gives up its place in line
+            with self._cond:
+                self._remove(ticket)
+                self._cond.notify_all()
+            raise
+        self._admitted(priority, started)
+
+    def try_acquire(self, priority):
+        """Take a token for an optional call only if one is free now and no call is waiting.
+
+        Never queues or sheds; returns whether the call may go out.
+        """
+        if not self.enabled:
+            return True
+        with self._cond:
+            self._refill(time.monotonic())
+            if self._queue or self._tokens < 1:
+                return False
+            self._tokens -= 1
+        self._admitted(priority, time.monotonic())
+        return True
+
+    def depths(self):
+        """Queued calls per priority class"""
+        with self._cond:
+            return {(PRIORITY_NAMES[priority],): count for priority, count in self._queued.items()}
+
+    def _enqueue(self, priority):
+        reason = None
+        if self._queued[priority] >= self.max_queue:
+            reason = "queue_full"
+        else:
+            # Calls queued ahead of this one each need a token first
+            ahead = sum(count for queued, count in self._queued.items() if queued <= priority)
+            self._refill(time.monotonic())
+            if (ahead + 1 - self._tokens) / self.rate > self.max_wait:
+                reason = "backlog"
+        if reason is not None:
+            if self.on_shed is not None:
+                self.on_shed(priority, reason)
+            raise Overloaded(priority, reason, self._retry_after())
+        ticket = [priority, next(self._sequence)]
+        heapq.heappush(self._queue, ticket)
+        self._queued[priority] += 1
+        return ticket
+
+    def _admit(self, ticket, now):
+        """Hand ``ticket`` a token if it is first in line; else seconds until it is worth checking again"""
+        self._refill(now)
+        needed = 1.0
+        if ticket[0] == PREFETCH:
+            needed = max(1.0, min(self.burst, 1.0 + self.prefetch_reserve * self.burst))
+        if self._tokens < needed:
+            return (needed - self._tokens) / self.rate
+        if self._queue[0] is not ticket:
+            # A token is free but someone more urgent goes first
+            return ASYNC_POLL_INTERVAL
+        self._tokens -= 1
+        self._remove(ticket)
+        self._cond.notify_all()
+        return None
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _shed(self, ticket, reason):
+        self._remove(ticket)
+        self._cond.notify_all()
+        if self.on_shed is not None:
+            self.on_shed(ticket[0], reason)
+        raise Overloaded(ticket[0], reason, self._retry_after())
+
+    def _remove(self, ticket):
+        for index, queued in enumerate(self._queue):
+            if queued is ticket:
+                self._queue[index] = self._queue[-1]
+                self._queue.pop()
+                heapq.heapify(self._queue)
+                self._queued[ticket[0]] -= 1
+                return
+
+    def _retry_after(self):
+        # Time for the bucket to work through everything already queued
+        return max(1, round(len(self._queue) / self.rate))
+
+    def _admitted(self, priority, started):
+        if self.on_admit is not None:
+            self.on_admit(priority, time.monotonic() - started)
@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# app.py opens its databases when imported; keep the tests' out of the source tree
+DATA_DIR = tempfile.mkdtemp(prefix="riddlesense-tests-")
+os.environ.setdefault("PUZZLE_LIBRARY_PATH", os.path.join(DATA_DIR, "puzzles.db"))
+os.environ.setdefault("LEADERBOARD_PATH", os.path.join(DATA_DIR, "leaderboard.db"))
+os.environ.setdefault("PUZZLE_POOL_LOW_WATER", "0")
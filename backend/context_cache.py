@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class CachedPrefix:
+    """Upstream handle for a cached prompt prefix; ``name`` is None while registering it failed"""
+
+    __slots__ = ("key", "prefix", "model", "name", "expires")
+
+    def __init__(self, key, prefix, model, name, expires):
+        self.key = key
+        self.prefix = prefix
+        self.model = model
+        self.name = name
+        self.expires = expires
+
+
+class ContextCache:
+    """Upstream cached-content handles for the static prefix of each puzzle's calls.
+
+    The first call for a key sends its full prompt and registers the prefix
+    in the background with ``register(prefix, ttl)``, which returns (model,
+    handle name); later calls for the same model send only the handle. A
+    handle lives for ``ttl`` seconds (the session TTL) and is refreshed by
+    registering again shortly before it runs out. Sessions ``attach`` to a
+    key when they start and ``detach`` when they end; when the last one
+    ends, the handle is dropped with ``release(name)``. Sessions that expire
+    or are evicted never end, so a background sweep every ``margin``
+    seconds also releases keys nothing has attached to or asked about for
+    ``ttl`` seconds (the session TTL is idle time, so their sessions are
+    gone). Counts are kept per process. A failed registration isn't retried
+    for ``retry_delay`` seconds.
+    """
+
+    def __init__(self, register, release, ttl=3600, margin=60, retry_delay=300, on_event=None):
+        self.register = register
+        self.release = release
+        self.ttl = ttl
+        # Handles this close to expiry are treated as gone
+        self.margin = min(margin, ttl / 2)
+        self.retry_delay = retry_delay
+        # on_event(event) with hit, miss, registered, failed or released
+        self.on_event = on_event
+
+        self._entries = {}
+        # key -> [sessions attached, time of the last attach or lookup]
+        self._sessions = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="context-cache")
+        self._sweeper = None
+
+    def get(self, key, prefix):
+        """Live handle for ``key``'s ``prefix``, or None, starting a registration if there is none"""
+        now = time.monotonic()
+        with self._lock:
+            sessions = self._sessions.get(key)
+            if sessions is not None:
+                sessions[1] = now
+            entry = self._entries.get(key)
+            if entry is not None and (entry.expires - self.margin <= now or entry.prefix != prefix):
+                del self._entries[key]
+                entry = None
+            if entry is None and key not in self._pending:
+                self._pending.add(key)
+                self._executor.submit(self._register, key, prefix)
+        if entry is not None and entry.name is not None:
+            self._event("hit")
+            return entry
+        self._event("miss")
+        return None
+
+    def invalidate(self, cached):
+        """Forget a handle the upstream no longer knows"""
+        with self._lock:
+            if self._entries.get(cached.key) is cached:
+                del self._entries[cached.key]
+
+    def attach(self, key):
+        now = time.monotonic()
+        with self._lock:
+            sessions = self._sessions.setdefault(key, [0, now])
+            sessions[0] += 1
+            sessions[1] = now
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._run, name="context-cache-sweeper", daemon=True)
+                self._sweeper.start()
+
+    def detach(self, key):
+        with self._lock:
+            sessions = self._sessions.get(key)
+            if sessions is None:
+                return
+            sessions[0] -= 1
+            if sessions[0] > 0:
+                return
+            del self._sessions[key]
+            entry = self._entries.pop(key, None)
+        if entry is not None and entry.name is not None:
+            self._executor.submit(self._release, entry.name)
+
+    def __len__(self):
+        with self._lock:
+            return sum(entry.name is not None for entry in self._entries.values())
+
+    def _register(self, key, prefix):
+        try:
+            model, name = self.register(prefix, self.ttl)
+        except Exception as e:
+            logger.warning("Could not cache prompt prefix: %s", e)
+            model, name = None, None
+        now = time.monotonic()
+        with self._lock:
+            self._pending.discard(key)
+            if name is None:
+                self._entries[key] = CachedPrefix(key, prefix, None, None, now + self.retry_delay + self.margin)
+            else:
+                self._entries[key] = CachedPrefix(key, prefix, model, name, now + self.ttl)
+        self._event("registered" if name is not None else "failed")
+
+    def _release(self, name):
+        try:
+            self.release(name)
+        except Exception as e:
+            # The handle still expires with its TTL
+            logger.warning("Could not release cached prompt prefix %s: %s", name, e)
+            return
+        self._event("released")
+
+    def _run(self):
+        while True:
+            time.sleep(self.margin)
+            self.sweep()
+
+    def sweep(self, now=None):
+        """Release keys idle for longer than the TTL and forget expired handles; returns the handles released"""
+        now = time.monotonic() if now is None else now
+        released = []
+        with self._lock:
+            for key, (_, used) in list(self._sessions.items()):
+                if now - used > self.ttl:
+                    del self._sessions[key]
+                    entry = self._entries.pop(key, None)
+                    if entry is not None and entry.name is not None:
+                        released.append(entry.name)
+            for key, entry in list(self._entries.items()):
+                if entry.expires <= now:
+                    del self._entries[key]
+        for name in released:
+            self._executor.submit(self._release, name)
+        return released
+
+    def _event(self, event):
+        if self.on_event is not None:
+            self.on_event(event)
@@ -0,0 +1,68 @@
+import re
+
+# Leading verdict in a host reply, e.g. "Yes.", "No, but...", "That's irrelevant..."
+VERDICT_PATTERN = re.compile(r"^\W*(yes|no|that'?s irrelevant|irrelevant)\b", re.IGNORECASE)
+
+
+class ConversationContext:
+    """Builds a bounded Gemini context for a game session.
+
+    Each call sends the host rules as the system instruction, a compact digest
+    of yes/no facts established in turns that have scrolled out of the window,
+    and only the most recent ``window`` messages. Older messages are dropped
+    from the session as well, so both the payload and the stored state stay
+    bounded however long a player keeps asking.
+    """
+
+    def __init__(self, window=12, max_facts=40, max_fact_length=160):
+        self.window = window
+        self.max_facts = max_facts
+        self.max_fact_length = max_fact_length
+
+    def build(self, game_state, system_instruction, extra_messages=()):
+        """Return (system_instruction, messages) for the next upstream call"""
+        messages = game_state['messages'] + list(extra_messages)
+        start = max(0, len(messages) - self.window)
+        # Gemini expects the conversation to open with a user turn
+        while start < len(messages) and messages[start]['role'] != 'user':
+            start += 1
+
+        # Fact indexes count every message ever exchanged, including dropped ones
+        first_sent = game_state.get('message_offset', 0) + start
+        facts = [fact['text'] for fact in game_state.get('facts', []) if fact['index'] < first_sent]
+        if facts:
+            digest = "\n".join(f"- {fact}" for fact in facts)
+            system_instruction += (
+                "\nFACTS ALREADY ESTABLISHED IN EARLIER TURNS (stay consistent with these):\n"
+                f"{digest}\n"
+            )
+
+        return system_instruction, messages[start:]
+
+    def record(self, game_state):
+        """Digest the last question/answer pair and drop messages outside the window"""
+        messages = game_state['messages']
+        if len(messages) >= 2 and messages[-2]['role'] == 'user':
+            self._record_fact(game_state)
+
+        dropped = len(messages) - self.window
+        if dropped > 0:
+            del messages[:dropped]
+            game_state['message_offset'] = game_state.get('message_offset', 0) + dropped
+
+    def _record_fact(self, game_state):
+        messages = game_state['messages']
+
+        match = VERDICT_PATTERN.match(messages[-1]['content'])
+        if not match:
+            return
+
+        verdict = match.group(1).lower()
+        verdict = {"yes": "Yes", "no": "No"}.get(verdict, "Irrelevant")
+        question = " ".join(messages[-2]['content'].split())[:self.max_fact_length]
+
+        facts = game_state.setdefault('facts', [])
+        index = game_state.get('message_offset', 0) + len(messages) - 2
+        facts.append({"index": index, "text": f"{verdict}: {question}"})
+        if len(facts) > self.max_facts:
+            del facts[:len(facts) - self.max_facts]
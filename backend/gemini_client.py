@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # Only needed by the asyncio serving mode (asgi.py)
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class GeminiAPIError(Exception):
+    """Raised when an upstream Gemini call fails in a way the caller must handle."""
+
+
+class UpstreamHealth:
+    """Whether Gemini is currently rate-limited or down, judged from final call outcomes.
+
+    Call ``record`` with each call's HTTP status, or "error" when no response
+    arrived. A 429, a 5xx or an error (all seen only after the client's own
+    retries) marks the upstream degraded for ``cooldown`` seconds; any
+    successful call clears it.
+    """
+
+    def __init__(self, cooldown=30.0):
+        self.cooldown = cooldown
+        self._degraded_until = 0.0
+
+    def record(self, status):
+        if status == 200:
+            self._degraded_until = 0.0
+        elif status == "error" or status == 429 or (isinstance(status, int) and status >= 500):
+            self._degraded_until = time.time() + self.cooldown
+
+    @property
+    def degraded(self):
+        return time.time() < self._degraded_until
+
+
+class GeminiClient:
+    """Shared, thread-safe HTTP client for the Gemini API.
+
+    Connections are pooled and kept alive across calls, every request has
+    separate connect and read timeouts, and 429/5xx responses (and connection
+    errors) are retried with jittered exponential backoff that honours the
+    server's Retry-After header.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=5.0, read_timeout=60.0,
+                 max_retries=3, backoff_base=0.5, backoff_max=20.0,
+                 retry_statuses=RETRY_STATUSES, on_retry=None):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = frozenset(retry_statuses)
+        # on_retry(reason) is called before each retry with the status code or exception name
+        self.on_retry = on_retry
+
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Created lazily so that forked workers don't share sockets with the parent
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def post(self, url, payload, stream=False):
+        """POST ``payload`` as JSON, retrying transient failures.
+
+        Returns the last response (which may still be an error status once
+        retries are exhausted). Raises requests.RequestException if the final
+        attempt could not connect or timed out.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(
+                    url,
+                    json=payload,
+                    headers={'Content-Type': 'application/json'},
+                    timeout=(self.connect_timeout, self.read_timeout),
+                    stream=stream
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                reason = e.__class__.__name__
+                logger.warning("Gemini request failed (%s), retry %d/%d in %.2fs", reason, attempt + 1, self.max_retries, delay)
+            else:
+                if response.status_code not in self.retry_statuses or attempt >= self.max_retries:
+                    return response
+                retry_after = self._retry_after(response)
+                if retry_after is not None and retry_after > self.backoff_max:
+                    # The server wants us to wait longer than we're willing to block a request for
+                    return response
+                delay = max(retry_after or 0, self._backoff(attempt))
+                reason = str(response.status_code)
+                logger.warning("Gemini returned %s, retry %d/%d in %.2fs", reason, attempt + 1, self.max_retries, delay)
+                response.close()
+
+            if self.on_retry is not None:
+                self.on_retry(reason)
+            time.sleep(delay)
+            attempt += 1
+
+    def delete(self, url):
+        """DELETE ``url`` once; raises requests.RequestException on failure or an error status"""
+        response = self.session.delete(url, timeout=(self.connect_timeout, self.read_timeout))
+        with response:
+            response.raise_for_status()
+
+    def _backoff(self, attempt):
+        # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def _retry_after(response):
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class AsyncGeminiClient(GeminiClient):
+    """asyncio counterpart of GeminiClient, built on httpx.
+
+    Shares the same pool size, timeouts and retry policy. Waiting on the
+    upstream only suspends a coroutine, so many in-flight calls can share a
+    single OS thread.
+    """
+
+    def __init__(self, **kwargs):
+        if httpx is None:
+            raise RuntimeError("The asyncio serving mode requires the 'httpx' package (pip install httpx)")
+        super().__init__(**kwargs)
+        self._client = None
+
+    @property
+    def client(self):
+        # httpx clients are bound to the event loop they are first used on
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def post(self, url, payload, stream=False):
+        """POST ``payload`` as JSON, retrying transient failures.
+
+        Returns the last httpx.Response. With ``stream`` the body is not read
+        and the caller must ``aclose()`` the response. Raises httpx.HTTPError
+        if the final attempt could not connect or timed out.
+        """
+        attempt = 0
+        while True:
+            try:
+                request = self.client.build_request(
+                    "POST", url, json=payload, headers={'Content-Type': 'application/json'}
+                )
+                response = await self.client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                reason = e.__class__.__name__
+                logger.warning("Gemini request failed (%s), retry %d/%d in %.2fs", reason, attempt + 1, self.max_retries, delay)
+            else:
+                if response.status_code not in self.retry_statuses or attempt >= self.max_retries:
+                    return response
+                retry_after = self._retry_after(response)
+                if retry_after is not None and retry_after > self.backoff_max:
+                    return response
+                delay = max(retry_after or 0, self._backoff(attempt))
+                reason = str(response.status_code)
+                logger.warning("Gemini returned %s, retry %d/%d in %.2fs", reason, attempt + 1, self.max_retries, delay)
+                await response.aclose()
+
+            if self.on_retry is not None:
+                self.on_retry(reason)
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -0,0 +1,205 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class LatencyTracker:
+    """Sliding window of recent successful call latencies, per series (e.g. model and call kind)"""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, series, seconds):
+        with self._lock:
+            samples = self._samples.get(series)
+            if samples is None:
+                samples = self._samples[series] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def series(self):
+        with self._lock:
+            return list(self._samples)
+
+    def percentile(self, series, pct, min_samples=1):
+        """Nearest-rank percentile of the window, or None with fewer than ``min_samples`` samples"""
+        with self._lock:
+            samples = sorted(self._samples.get(series, ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[max(0, math.ceil(pct / 100 * len(samples)) - 1)]
+
+
+class Hedger:
+    """Hedged upstream calls across a list of models.
+
+    A call goes to the primary (first) model. If it hasn't produced a usable
+    result by the hedge deadline, a second call goes to the next model (or
+    the primary again when only one is configured) and the first usable
+    result wins. The deadline is the ``percentile`` of the primary's recent
+    latencies, once ``min_samples`` have been seen, and ``initial_delay``
+    before that; it never drops below ``min_delay``.
+
+    ``call(model)`` makes one call and returns its result, ``ok(result)``
+    says whether it is usable, and ``discard(result)`` releases a losing
+    one. A losing coroutine is cancelled outright; a losing thread can't be
+    interrupted mid-request, so its result is discarded when it arrives.
+    ``may_hedge()`` is asked before a hedge is sent, e.g. to respect a rate
+    limit. ``percentile`` 0 disables hedging.
+    """
+
+    def __init__(self, models, percentile=95, initial_delay=2.0, min_delay=0.1, min_samples=20,
+                 window=200, phases=("ask",), max_workers=32, on_hedge=None, on_latency=None):
+        self.models = list(models)
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.phases = frozenset(phases)
+        self.tracker = LatencyTracker(window)
+        # on_hedge(outcome) with outcome primary, hedge, skipped or failed; on_latency(model, kind, seconds)
+        self.on_hedge = on_hedge
+        self.on_latency = on_latency
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini-hedge")
+
+    @property
+    def primary(self):
+        return self.models[0]
+
+    def applies(self, phase):
+        return self.percentile > 0 and phase in self.phases
+
+    def backup(self, model):
+        """Model a hedge for ``model`` goes to"""
+        index = self.models.index(model)
+        return self.models[(index + 1) % len(self.models)]
+
+    def deadline(self, model, kind):
+        """Seconds to wait on a ``kind`` of call to ``model`` before hedging"""
+        tracked = self.tracker.percentile((model, kind), self.percentile, self.min_samples)
+        return max(self.min_delay, self.initial_delay if tracked is None else tracked)
+
+    def deadlines(self):
+        """Current hedge deadline per model and kind of call seen so far, for metrics"""
+        return {(model, kind): self.deadline(model, kind) for model, kind in self.tracker.series()}
+
+    def _timed(self, model, kind, call, ok):
+        started = time.monotonic()
+        result = call(model)
+        if ok(result):
+            self._observe(model, kind, time.monotonic() - started)
+        return result
+
+    def _observe(self, model, kind, seconds):
+        self.tracker.observe((model, kind), seconds)
+        if self.on_latency is not None:
+            self.on_latency(model, kind, seconds)
+
+    def _hedged(self, outcome):
+        if self.on_hedge is not None:
+            self.on_hedge(outcome)
+
+    def run(self, phase, call, ok, discard, kind=None, may_hedge=lambda: True):
+        """Make a call, hedging it for ``phase`` when allowed. Returns (model, result).
+
+        Latencies are tracked per model and ``kind`` of call (the phase by
+        default), since e.g. time to first chunk and time to a full response
+        need different deadlines. When neither call is usable, the one that
+        finished last is returned (or its exception raised), just as an
+        unhedged call would.
+        """
+        model = self.primary
+        kind = kind or phase
+        if not self.applies(phase):
+            return model, self._timed(model, kind, call, ok)
+
+        primary = self._executor.submit(self._timed, model, kind, call, ok)
+        calls = {primary: model}
+        returned = None
+        try:
+            done, _ = wait([primary], timeout=self.deadline(model, kind))
+            if done or not may_hedge():
+                if not done:
+                    self._hedged("skipped")
+                result = primary.result()
+                returned = primary
+                return model, result
+
+            backup_model = self.backup(model)
+            calls[self._executor.submit(self._timed, backup_model, kind, call, ok)] = backup_model
+            pending = set(calls)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    returned = future
+                    if future.exception() is None and ok(future.result()):
+                        self._hedged("primary" if future is primary else "hedge")
+                        return calls[future], future.result()
+            self._hedged("failed")
+            return calls[returned], returned.result()
+        finally:
+            for future in calls:
+                if future is not returned and not future.cancel():
+                    future.add_done_callback(lambda loser: self._discard(loser, discard))
+
+    @staticmethod
+    def _discard(future, discard):
+        if not future.cancelled() and future.exception() is None:
+            discard(future.result())
+
+    async def run_async(self, phase, call, ok, discard, kind=None, may_hedge=lambda: True):
+        """asyncio counterpart of ``run``; ``call`` and ``discard`` are coroutine functions.
+
+        The losing call is cancelled, so ``call`` must release anything it
+        holds when that happens.
+        """
+        model = self.primary
+        kind = kind or phase
+        if not self.applies(phase):
+            return model, await self._timed_async(model, kind, call, ok)
+
+        primary = asyncio.ensure_future(self._timed_async(model, kind, call, ok))
+        calls = {primary: model}
+        returned = None
+        try:
+            done, _ = await asyncio.wait([primary], timeout=self.deadline(model, kind))
+            if done or not may_hedge():
+                if not done:
+                    self._hedged("skipped")
+                result = await primary
+                returned = primary
+                return model, result
+
+            backup_model = self.backup(model)
+            calls[asyncio.ensure_future(self._timed_async(backup_model, kind, call, ok))] = backup_model
+            pending = set(calls)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    returned = task
+                    if task.exception() is None and ok(task.result()):
+                        self._hedged("primary" if task is primary else "hedge")
+                        return calls[task], task.result()
+            self._hedged("failed")
+            return calls[returned], returned.result()
+        finally:
+            for task in calls:
+                if task is returned:
+                    continue
+                if task.done():
+                    if not task.cancelled() and task.exception() is None:
+                        await discard(task.result())
+                else:
+                    task.cancel()
+
+    async def _timed_async(self, model, kind, call, ok):
+        started = time.monotonic()
+        result = await call(model)
+        if ok(result):
+            self._observe(model, kind, time.monotonic() - started)
+        return result
@@ -0,0 +1,185 @@
+import math
+import re
+from collections import Counter
+
+GIVE_UP = "give_up"
+SOLUTION = "solution"
+HINT = "hint"
+REPEAT = "repeat"
+GREETING = "greeting"
+HELP = "help"
+QUESTION = "question"
+
+# High-precision rules, checked first. Each must match the whole input.
+RULES = [
+    (GIVE_UP, re.compile(
+        r"^(ok(ay)?\s+|fine\s+|alright\s+)?(i\s+)?(give\s+up|surrender)(\s+already|\s+now)?$")),
+    (SOLUTION, re.compile(
+        r"^(please\s+|just\s+|ok(ay)?\s+)*((can|could|would|will)\s+you\s+)?(please\s+)?"
+        r"(tell|show|give|reveal)(\s+me)?(\s+the)?\s+(answer|solution)(\s+please|\s+now|\s+already)?$"
+        r"|^what(\s+is|'?s)\s+the\s+(answer|solution)$"
+        r"|^(reveal|show)\s+(it|the\s+answer|the\s+solution)$")),
+    (HINT, re.compile(
+        r"^(ok(ay)?\s+)?(i\s+am\s+|i'm\s+|im\s+)?(stuck|lost)(\s+now|\s+again)?$"
+        r"|^(i\s+)?(can'?t|cannot)\s+(solve|figure\s+out|figure)(\s+(it|this))?(\s+out)?$"
+        r"|^((can|could|may)\s+i\s+(have|get)\s+|(can|could)\s+you\s+give\s+me\s+|give\s+me\s+|i\s+need\s+)?"
+        r"(a\s+|another\s+|one\s+more\s+)?(hint|clue)(\s+please)?$"
+        r"|^any\s+(hints|clues)$")),
+    (REPEAT, re.compile(
+        r"^(please\s+|can\s+you\s+|could\s+you\s+)*(repeat|restate|say\s+again|show\s+me\s+again|read)"
+        r"(\s+the)?(\s+(puzzle|riddle|question|story))?(\s+again)?(\s+please)?$"
+        r"|^what\s+(was|is)\s+the\s+(puzzle|riddle|story)( again)?$")),
+    (GREETING, re.compile(
+        r"^(hi|hello|hey|hiya|yo|howdy|greetings|good\s+(morning|afternoon|evening))(\s+there)?$")),
+    (HELP, re.compile(
+        r"^(help|rules|instructions|how\s+do\s+(i|you)\s+play|how\s+does\s+this\s+work"
+        r"|what\s+(can|should|do)\s+i\s+(ask|do|type)|what\s+are\s+the\s+rules)(\s+please)?$")),
+]
+
+# Inputs that are questions about the story, or guesses, however meta they look
+AUXILIARIES = {
+    "is", "was", "are", "were", "did", "does", "do", "has", "had", "have",
+    "can", "could", "would", "will", "should", "might", "must"
+}
+# Matched against the raw input, whose punctuation tokenizing drops
+GUESS_PATTERN = re.compile(
+    r"\b(answer|solution)\s*(is\b|was\b|[:=\-])"
+    r"|^\s*(i\s+)?(think|know|guess|bet|believe|reckon|suspect)\b"
+    r"|^\s*(maybe|perhaps|probably|surely)\b"
+)
+
+# Ending the game is only ever read from an explicit give-up or reveal request
+REVEAL_PATTERN = re.compile(
+    r"\b(give\s+up|giving\s+up|surrender|tell|show|reveal|spoil|explain)\b"
+    r"|\bwhat('?s|\s+is|\s+was)\s+the\s+(answer|solution)\b"
+    r"|^(the\s+)?(answer|solution)\s+please$"
+)
+
+# Tiny labelled corpus for the bag-of-words fallback. Questions and guesses
+# dominate on purpose, so the model only claims inputs that are clearly meta.
+TRAINING = {
+    GIVE_UP: [
+        "i give up", "i surrender", "ok i give up", "giving up", "i am stuck give up", "i give up now",
+        "fine i give up", "i give up just tell me", "enough i give up", "ok i surrender", "i'm giving up",
+        "i'll give up", "i have to give up", "i give up show me"
+    ],
+    HINT: [
+        "i'm stuck", "stuck", "i am stuck", "this is too hard", "too hard for me", "i have no idea",
+        "no idea at all", "i can't figure it out", "i can't do this", "i'm out of ideas", "out of ideas",
+        "no clue", "i have no clue", "hint", "a hint please", "give me a hint", "can i have a hint",
+        "i need a hint", "another hint", "any clues", "help me i'm stuck", "i'm lost", "nudge me"
+    ],
+    SOLUTION: [
+        "tell me the answer", "tell me the solution", "what's the answer", "what is the solution",
+        "show the answer", "reveal the solution", "just tell me", "just tell me what happened",
+        "tell me what happened", "what really happened", "give me the answer", "spoil it",
+        "show me the solution please", "i want the answer", "i want to know the answer",
+        "reveal it", "explain the solution", "what was the solution", "answer please", "solution please"
+    ],
+    REPEAT: [
+        "repeat the puzzle", "repeat please", "say that again", "what was the puzzle",
+        "show the puzzle again", "read the riddle again", "remind me of the puzzle", "remind me the story",
+        "what was the question again", "can you repeat", "repeat the riddle", "one more time",
+        "i forgot the puzzle", "puzzle again", "repeat the story", "what's the riddle"
+    ],
+    GREETING: [
+        "hi", "hello", "hey", "hey there", "hello there", "hi there", "good morning", "good evening",
+        "howdy", "yo", "hiya", "greetings", "hello hello", "hi again", "hey hey"
+    ],
+    HELP: [
+        "help", "how do i play", "how does this work", "what do i do", "what should i ask",
+        "rules", "explain the rules", "what are the rules", "instructions", "i don't understand the game",
+        "how to play", "what am i supposed to do", "help me", "what can i ask", "how does the game work"
+    ],
+    QUESTION: [
+        "is he dead", "was it an accident", "did she know him", "is the weather important",
+        "did it happen at night", "was anyone else there", "is money involved", "did he die",
+        "was it murder", "is the location important", "did someone lie", "was an animal involved",
+        "the man was a cyclist", "he was poisoned", "she was a diver", "the answer is that he drowned",
+        "the solution is the ship crashed", "he forgot to turn the light on", "they were twins",
+        "because the ship hit the rocks", "it was a game", "the lighthouse caused a crash",
+        "he knew the answer", "did he tell the truth", "did she give up", "did he quit his job",
+        "was he stuck in the room", "does the help arrive", "did anyone say hello", "was the puzzle a letter",
+        "he read the letter", "she repeated the story", "someone revealed the secret",
+        "the keeper was asleep", "the shoes were too high", "a knife was thrown", "it happened in a circus",
+        "was it raining", "is it about family", "are there two people", "were they married",
+        "the story involves a storm", "hello was the last word he said", "the help never came",
+        "the rules of the game were broken", "he had no idea", "she was out of ideas",
+        "tell me more about the ship", "tell me about the keeper", "what happened to the man",
+        "what happened next", "what happened to her shoes", "what did he do", "why did she die",
+        "who killed him", "how did he die", "where did it happen", "what time was it", "tell me about the room"
+    ]
+}
+
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+def features(tokens):
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+class NaiveBayes:
+    """Multinomial naive Bayes over unigrams and bigrams with add-one smoothing"""
+
+    def __init__(self, examples):
+        self.counts = {label: Counter() for label in examples}
+        self.totals = {}
+        total_examples = sum(len(texts) for texts in examples.values())
+        self.priors = {label: math.log(len(texts) / total_examples) for label, texts in examples.items()}
+        for label, texts in examples.items():
+            for text in texts:
+                self.counts[label].update(features(tokenize(text)))
+            self.totals[label] = sum(self.counts[label].values())
+        self.vocabulary = len(set().union(*self.counts.values()))
+
+    def predict(self, tokens):
+        """(label, posterior probability) for a tokenized input"""
+        scores = {}
+        for label, counts in self.counts.items():
+            denominator = self.totals[label] + self.vocabulary
+            scores[label] = self.priors[label] + sum(
+                math.log((counts[feature] + 1) / denominator) for feature in features(tokens)
+            )
+        best = max(scores, key=scores.get)
+        norm = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / norm
+
+
+class IntentRouter:
+    """Classifies player input that needs no model reasoning.
+
+    Rules match common phrasings exactly; anything else short enough is
+    scored by a small bag-of-words model, which must be at least
+    ``min_confidence`` sure before an input is taken away from the LLM.
+    Returns one of GIVE_UP, SOLUTION, HINT, REPEAT, GREETING or HELP, or
+    None for real questions and guesses. GIVE_UP and SOLUTION end the game,
+    so they also need an explicit give-up or reveal phrase; a player who is
+    merely stuck gets HINT.
+    """
+
+    def __init__(self, min_confidence=0.9, max_tokens=10):
+        self.min_confidence = min_confidence
+        self.max_tokens = max_tokens
+        self.model = NaiveBayes(TRAINING)
+
+    def classify(self, text):
+        normalized = " ".join(tokenize(text))
+        for intent, pattern in RULES:
+            if pattern.match(normalized):
+                return intent
+
+        tokens = normalized.split()
+        if not tokens or len(tokens) > self.max_tokens or GUESS_PATTERN.search(text.lower()):
+            return None
+        # "Did he give up?" is about the story; "Can you repeat?" is about the game
+        if tokens[0] in AUXILIARIES and (len(tokens) < 2 or tokens[1] != "you"):
+            return None
+
+        intent, confidence = self.model.predict(tokens)
+        if intent == QUESTION or confidence < self.min_confidence:
+            return None
+        if intent in (GIVE_UP, SOLUTION) and not REVEAL_PATTERN.search(normalized):
+            return None
+        return intent
@@ -0,0 +1,276 @@
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Scores are counted in whole-point buckets 0 .. BUCKETS - 1; higher scores share the last one
+BUCKET_BITS = 40
+BUCKETS = 1 << BUCKET_BITS
+
+
+def bucket(score):
+    return min(max(int(math.floor(score)), 0), BUCKETS - 1)
+
+
+def bucket_ceiling(key):
+    """Scores in bucket ``key`` are below this; the last bucket takes everything beyond"""
+    return math.inf if key == BUCKETS - 1 else key + 1
+
+
+def prefix_nodes(key):
+    """Tree nodes whose counts add up to the players in buckets 0 .. key"""
+    nodes = []
+    index = key + 1
+    while index > 0:
+        nodes.append(index)
+        index &= index - 1
+    return nodes
+
+
+def update_nodes(key):
+    """Tree nodes that count the players in bucket ``key``"""
+    nodes = []
+    index = key + 1
+    while index <= BUCKETS:
+        nodes.append(index)
+        index += index & -index
+    return nodes
+
+
+class Leaderboard:
+    """Cumulative score per player in SQLite, with rank queries that stay cheap at any size.
+
+    Besides the scores table, ``score_buckets`` holds a Fenwick tree over
+    whole-point score buckets: node i counts the players in a fixed range of
+    buckets, so the players above a score are found by adding up about
+    BUCKET_BITS nodes and scanning the score's own bucket. A player's rank
+    is one more than the number of players with a higher score, so players
+    on the same score share a rank. ``top`` finds the bucket holding the
+    first entry of a page the same way, so deep pages don't skip rows one
+    by one.
+
+    ``add`` only queues the points; a background writer adds queued points
+    to both tables every ``flush_interval`` seconds in one transaction, so
+    finishing a game never waits on disk. Points not yet written are lost
+    if the process dies, and show in ``top`` once written; ``rank`` already
+    counts the player's own. Processes sharing the file see each other's
+    points as soon as they are written.
+    """
+
+    def __init__(self, path, flush_interval=1.0, on_flush=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        # on_flush(rows, seconds) after each batch is written
+        self.on_flush = on_flush
+
+        # player id -> [points, name, games] not yet written
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._worker = None
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS scores (
+                player_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                score REAL NOT NULL,
+                games INTEGER NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS scores_rank ON scores (score DESC, player_id)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS score_buckets (
+                node INTEGER PRIMARY KEY,
+                players INTEGER NOT NULL
+            )
+        """)
+        self._build_tree(conn)
+
+    def _conn(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _build_tree(self, conn):
+        """Count the players of a scores table written before score_buckets existed"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM score_buckets LIMIT 1").fetchone() is None:
+                counts = Counter()
+                for (score,) in conn.execute("SELECT score FROM scores"):
+                    for node in update_nodes(bucket(score)):
+                        counts[node] += 1
+                conn.executemany("INSERT INTO score_buckets (node, players) VALUES (?, ?)", counts.items())
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def start(self):
+        """Start the writer (idempotent)."""
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name="leaderboard-writer", daemon=True)
+            self._worker.start()
+
+    def __len__(self):
+        return self._count_through(self._conn(), BUCKETS - 1)
+
+    def add(self, player_id, name, points):
+        """Credit ``player_id`` with a solved game worth ``points``"""
+        with self._lock:
+            pending = self._pending.setdefault(player_id, [0.0, name, 0])
+            pending[0] += points
+            pending[1] = name
+            pending[2] += 1
+        self.start()
+
+    def top(self, count, offset=0):
+        """Players in places ``offset + 1`` to ``offset + count``, best first"""
+        self.start()
+        conn = self._conn()
+        total = self._count_through(conn, BUCKETS - 1)
+        if count <= 0 or offset >= total:
+            return []
+        # The bucket holding the entry at ``offset``, and how many entries rank above that bucket
+        key = self._select(conn, total - offset)
+        above = total - self._count_through(conn, key)
+        rows = conn.execute(
+            "SELECT name, score, games FROM scores WHERE score < ? ORDER BY score DESC, player_id LIMIT ? OFFSET ?",
+            (bucket_ceiling(key), count, offset - above)
+        ).fetchall()
+
+        entries = []
+        for place, (name, score, games) in enumerate(rows, offset + 1):
+            if not entries:
+                rank = self._above(conn, score) + 1
+            elif score == entries[-1]["score"]:
+                rank = entries[-1]["rank"]
+            else:
+                rank = place
+            entries.append(self._entry(rank, name, score, games))
+        return entries
+
+    def rank(self, player_id):
+        """``player_id``'s standing, or None if they haven't scored yet"""
+        self.start()
+        conn = self._conn()
+        # Points a flush has taken off the queue are in the table once it is done
+        with self._flush_lock:
+            row = conn.execute("SELECT name, score, games FROM scores WHERE player_id = ?", (player_id,)).fetchone()
+            with self._lock:
+                pending = self._pending.get(player_id)
+                pending = list(pending) if pending is not None else None
+        if row is None and pending is None:
+            return None
+        name, score, games = row or (pending[1], 0.0, 0)
+        if pending is not None:
+            name, score, games = pending[1] or name, score + pending[0], games + pending[2]
+        return self._entry(self._above(conn, score) + 1, name, score, games)
+
+    def _above(self, conn, score):
+        """Players with a higher score than ``score``"""
+        key = bucket(score)
+        higher_buckets = self._count_through(conn, BUCKETS - 1) - self._count_through(conn, key)
+        same_bucket = conn.execute(
+            "SELECT COUNT(*) FROM scores WHERE score > ? AND score < ?", (score, bucket_ceiling(key))
+        ).fetchone()[0]
+        return higher_buckets + same_bucket
+
+    @staticmethod
+    def _count_through(conn, key):
+        """Players in buckets 0 .. key"""
+        nodes = prefix_nodes(key)
+        return conn.execute(
+            f"SELECT COALESCE(SUM(players), 0) FROM score_buckets WHERE node IN ({','.join('?' * len(nodes))})",
+            nodes
+        ).fetchone()[0]
+
+    @staticmethod
+    def _select(conn, position):
+        """Lowest bucket through which ``position`` players (counted from the lowest score) are reached"""
+        index = 0
+        step = BUCKETS
+        while step:
+            node = index + step
+            if node <= BUCKETS:
+                row = conn.execute("SELECT players FROM score_buckets WHERE node = ?", (node,)).fetchone()
+                players = row[0] if row else 0
+                if players < position:
+                    index = node
+                    position -= players
+            step >>= 1
+        return index
+
+    def flush(self):
+        """Write queued points now; returns the number of players written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            started = time.monotonic()
+            now = time.time()
+            rows = [(player_id, name, points, games, now) for player_id, (points, name, games) in pending.items()]
+            conn = self._conn()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # Move each player to the bucket of their new total
+                    counts = Counter()
+                    for player_id, _, points, _, _ in rows:
+                        row = conn.execute("SELECT score FROM scores WHERE player_id = ?", (player_id,)).fetchone()
+                        if row is not None:
+                            for node in update_nodes(bucket(row[0])):
+                                counts[node] -= 1
+                        for node in update_nodes(bucket((row[0] if row else 0.0) + points)):
+                            counts[node] += 1
+                    conn.executemany("""
+                        INSERT INTO scores (player_id, name, score, games, updated) VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (player_id) DO UPDATE SET
+                            name = excluded.name,
+                            score = score + excluded.score,
+                            games = games + excluded.games,
+                            updated = excluded.updated
+                    """, rows)
+                    conn.executemany("""
+                        INSERT INTO score_buckets (node, players) VALUES (?, ?)
+                        ON CONFLICT (node) DO UPDATE SET players = players + excluded.players
+                    """, [(node, change) for node, change in counts.items() if change])
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error:
+                logger.exception("Could not write %d leaderboard scores; retrying", len(rows))
+                with self._lock:
+                    for player_id, (points, name, games) in pending.items():
+                        queued = self._pending.setdefault(player_id, [0.0, name, 0])
+                        queued[0] += points
+                        queued[2] += games
+                return 0
+            if self.on_flush is not None:
+                self.on_flush(len(rows), time.monotonic() - started)
+            return len(rows)
+
+    @staticmethod
+    def _entry(rank, name, score, games):
+        return {"rank": rank, "name": name, "score": score, "games": games}
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
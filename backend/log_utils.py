@@ -0,0 +1,105 @@
+"""Structured, leveled logging for the backend.
+
+Log lines are tagged with the current request and session IDs, which are
+carried in context variables so they follow a request into streaming
+generators and asyncio tasks alike. Expensive arguments such as request
+payloads are wrapped in ``LazyJSON`` so they are only serialized when the
+line is actually emitted, and payload dumps can be sampled.
+
+Configured from the environment:
+    LOG_LEVEL                 DEBUG, INFO (default), WARNING, ...
+    LOG_FORMAT                text (default) or json
+    LOG_PAYLOAD_SAMPLE_RATE   fraction of DEBUG payload dumps to emit (default 1.0)
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+session_id_var = contextvars.ContextVar("session_id", default="-")
+
+PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))
+
+
+class LazyJSON:
+    """Defers json.dumps of ``value`` (truncated to ``limit`` chars) until formatted"""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit=300):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = json.dumps(self.value, ensure_ascii=False)
+        if self.limit and len(text) > self.limit:
+            return text[:self.limit] + "..."
+        return text
+
+
+class Truncated:
+    """Defers truncating a long string until formatted"""
+
+    __slots__ = ("text", "limit")
+
+    def __init__(self, text, limit=100):
+        self.text = text
+        self.limit = limit
+
+    def __str__(self):
+        text = str(self.text)
+        return text if len(text) <= self.limit else text[:self.limit] + "..."
+
+
+def log_payload(logger, message, value, limit=300):
+    """Emit a DEBUG payload dump, subject to LOG_PAYLOAD_SAMPLE_RATE"""
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < PAYLOAD_SAMPLE_RATE:
+        logger.debug(message, LazyJSON(value, limit))
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        record.session_id = session_id_var.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "session_id": getattr(record, "session_id", "-"),
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging(level=None, fmt=None):
+    """Install the root handler once; safe to call from every entry point"""
+    root = logging.getLogger()
+    if any(getattr(handler, "_riddlesense", False) for handler in root.handlers):
+        return
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler._riddlesense = True
+    handler.addFilter(ContextFilter())
+    if (fmt or os.getenv("LOG_FORMAT", "text")).lower() == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        formatter = logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s [req=%(request_id)s session=%(session_id)s] %(message)s"
+        )
+        formatter.converter = time.gmtime
+        handler.setFormatter(formatter)
+
+    root.addHandler(handler)
+    root.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
@@ -0,0 +1,272 @@
+"""Minimal in-process metrics served in the Prometheus text format.
+
+Counters, gauges and histograms are thread-safe and support labels. The
+metrics the game records are defined at the bottom of this module;
+``render()`` produces the body for the /metrics endpoint.
+"""
+import logging
+import math
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans cache hits (sub-millisecond) to slow generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # function() -> number, or {label values tuple: number}, read at scrape time
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _collect(self):
+        try:
+            values = self.function()
+        except Exception as e:
+            logger.warning("Error collecting metric %s: %s", self.name, e)
+            values = {}
+        if not isinstance(values, dict):
+            values = {(): values}
+        with self._lock:
+            self._values = {tuple(map(str, key)): value for key, value in values.items()}
+
+    def render(self):
+        if self.function is not None:
+            self._collect()
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # [per-bucket counts..., sum, count]
+                series = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# HTTP layer
+REQUEST_LATENCY = Histogram(
+    "riddlesense_http_request_duration_seconds",
+    "Time to produce a response, by route, method and status",
+    ["route", "method", "status"]
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "riddlesense_http_requests_in_flight",
+    "Requests currently being handled, by route",
+    ["route"]
+)
+
+# Upstream Gemini calls
+UPSTREAM_LATENCY = Histogram(
+    "riddlesense_gemini_call_duration_seconds",
+    "Gemini call latency including retries, by phase (generation, intro, ask, cache)",
+    ["phase"]
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "riddlesense_gemini_calls_in_flight",
+    "Gemini calls currently waiting on the upstream, by phase",
+    ["phase"]
+)
+UPSTREAM_RESPONSES = Counter(
+    "riddlesense_gemini_responses_total",
+    "Final Gemini call outcomes by phase and HTTP status ('error' when no response was received)",
+    ["phase", "status"]
+)
+UPSTREAM_RETRIES = Counter(
+    "riddlesense_gemini_retries_total",
+    "Gemini attempts that were retried, by HTTP status or exception type",
+    ["reason"]
+)
+UPSTREAM_QUEUE_WAIT = Histogram(
+    "riddlesense_gemini_queue_wait_seconds",
+    "Time Gemini calls waited for the outbound rate limiter, by priority (ask, intro, generation, prefetch)",
+    ["priority"]
+)
+UPSTREAM_SHED = Counter(
+    "riddlesense_gemini_shed_total",
+    "Gemini calls shed by the outbound scheduler instead of sent, by priority and reason "
+    "(queue_full, backlog, timeout)",
+    ["priority", "reason"]
+)
+UPSTREAM_HEDGES = Counter(
+    "riddlesense_gemini_hedges_total",
+    "Gemini calls that outlived their hedge deadline, by outcome: primary or hedge (which call won), "
+    "skipped (no rate-limit token to spare for a hedge) or failed (neither call succeeded)",
+    ["outcome"]
+)
+MODEL_LATENCY = Histogram(
+    "riddlesense_gemini_model_latency_seconds",
+    "Latency of successful Gemini calls per model, by kind (the phase, or <phase>_first_chunk for streams)",
+    ["model", "kind"]
+)
+CONTEXT_CACHE = Counter(
+    "riddlesense_context_cache_total",
+    "Cached host prompt events: hit (sent by handle), miss (sent in full), registered, failed, released",
+    ["event"]
+)
+ROOM_BATCH_SIZE = Histogram(
+    "riddlesense_room_batch_questions",
+    "Room questions answered by one Gemini call",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16)
+)
+SESSION_JOURNAL_COMPACTION = Histogram(
+    "riddlesense_session_journal_compaction_seconds",
+    "Time to fold closed session journal segments into a new snapshot"
+)
+LEADERBOARD_WRITES = Counter(
+    "riddlesense_leaderboard_writes_total",
+    "Player scores written to the leaderboard database"
+)
+LEADERBOARD_FLUSH = Histogram(
+    "riddlesense_leaderboard_flush_seconds",
+    "Time to write one batch of queued leaderboard scores"
+)
+UPSTREAM_TOKENS = Counter(
+    "riddlesense_gemini_tokens_total",
+    "Tokens reported in Gemini usageMetadata, by phase and kind (prompt, response, cached)",
+    ["phase", "kind"]
+)
+PROMPT_TOKENS = Histogram(
+    "riddlesense_gemini_prompt_tokens",
+    "Prompt size of each Gemini call in tokens, by phase",
+    ["phase"],
+    buckets=TOKEN_BUCKETS
+)
+PUZZLE_GENERATIONS = Counter(
+    "riddlesense_puzzle_generations_total",
+    "Generated puzzles by outcome: valid, invalid (failed validation), duplicate (too similar to an "
+    "issued puzzle), error (the upstream call failed) or shed (the outbound scheduler was overloaded)",
+    ["outcome"]
+)
+PUZZLE_SIMILARITY = Histogram(
+    "riddlesense_puzzle_similarity",
+    "Estimated Jaccard similarity of each generated puzzle to the closest one already issued",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+)
+FALLBACK_PUZZLES = Counter(
+    "riddlesense_fallback_puzzles_total",
+    "Games started on the built-in fallback puzzle because no generated or library puzzle was available"
+)
+LIBRARY_PUZZLES = Counter(
+    "riddlesense_library_puzzles_total",
+    "Games started on a puzzle from the persistent library, by reason: mix (PUZZLE_LIBRARY_SHARE), "
+    "outage (Gemini rate-limited or down) or fallback (generation failed)",
+    ["reason"]
+)
+ROUTED_INPUTS = Counter(
+    "riddlesense_routed_inputs_total",
+    "Player inputs answered locally by the intent router instead of Gemini, by intent",
+    ["intent"]
+)
+HINTS_SERVED = Counter(
+    "riddlesense_hints_served_total",
+    "Hints served from puzzle bundles"
+)
+SESSION_TOKENS = Histogram(
+    "riddlesense_session_tokens",
+    "Total prompt and response tokens spent on a game, observed when it ends",
+    buckets=TOKEN_BUCKETS + (64000, 128000)
+)
@@ -0,0 +1,115 @@
+import hashlib
+import random
+import re
+import threading
+from collections import OrderedDict
+
+# Mersenne prime modulus for the universal hash family
+PRIME = (1 << 61) - 1
+
+
+def shingles(text, size=3):
+    """Word ``size``-grams of a normalized text"""
+    tokens = re.findall(r"[a-z0-9']+", text.lower())
+    if len(tokens) <= size:
+        return {" ".join(tokens)}
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def _hash(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big") % PRIME
+
+
+class MinHashIndex:
+    """Near-duplicate index over texts, using MinHash signatures and LSH banding.
+
+    A text's signature keeps, for each of ``bands * rows`` hash functions, the
+    minimum hash over its word shingles; the fraction of equal positions in two
+    signatures estimates the Jaccard similarity of their shingle sets. Banding
+    finds candidate matches without comparing against every stored text. With
+    the default 16 bands of 4 rows, pairs around 0.5 similarity or above are
+    found with high probability. Holds at most ``max_entries`` texts, dropping
+    the oldest first.
+    """
+
+    def __init__(self, threshold=0.5, bands=16, rows=4, shingle_size=3, max_entries=10000, seed=1):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+
+        rng = random.Random(seed)
+        self._coefficients = [(rng.randrange(1, PRIME), rng.randrange(0, PRIME)) for _ in range(bands * rows)]
+        # key -> signature, oldest first
+        self._signatures = OrderedDict()
+        # One table per band: band values -> keys sharing them
+        self._tables = [{} for _ in range(bands)]
+        self._lock = threading.Lock()
+
+    def signature(self, text):
+        hashes = [_hash(shingle) for shingle in shingles(text, self.shingle_size)]
+        return tuple(min((a * h + b) % PRIME for h in hashes) for a, b in self._coefficients)
+
+    def _bands(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows] for i in range(self.bands)]
+
+    def _most_similar(self, signature):
+        candidates = set()
+        for table, band in zip(self._tables, self._bands(signature)):
+            candidates.update(table.get(band, ()))
+        best_key, best = None, 0.0
+        for key in candidates:
+            other = self._signatures[key]
+            similarity = sum(x == y for x, y in zip(signature, other)) / len(signature)
+            if similarity > best:
+                best_key, best = key, similarity
+        return best_key, best
+
+    def most_similar(self, text):
+        """(key, estimated Jaccard similarity) of the closest stored text, or (None, 0.0)"""
+        signature = self.signature(text)
+        with self._lock:
+            return self._most_similar(signature)
+
+    def add_if_novel(self, key, text):
+        """Store ``text`` unless a stored text is at least ``threshold`` similar.
+
+        Returns (added, similarity to the closest stored text). Checking and
+        adding is atomic, so concurrent near-duplicates can't both get in.
+        """
+        signature = self.signature(text)
+        with self._lock:
+            if key in self._signatures:
+                return False, 1.0
+            _, similarity = self._most_similar(signature)
+            if similarity >= self.threshold:
+                return False, similarity
+            self._store(key, signature)
+            return True, similarity
+
+    def add(self, key, signature):
+        """Store a signature admitted earlier, e.g. by another process, without checking it"""
+        with self._lock:
+            if key not in self._signatures:
+                self._store(key, signature)
+
+    def _store(self, key, signature):
+        self._signatures[key] = signature
+        for table, band in zip(self._tables, self._bands(signature)):
+            table.setdefault(band, set()).add(key)
+        while len(self._signatures) > self.max_entries:
+            self._remove(next(iter(self._signatures)))
+
+    def _remove(self, key):
+        signature = self._signatures.pop(key)
+        for table, band in zip(self._tables, self._bands(signature)):
+            keys = table.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del table[band]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._signatures)
@@ -0,0 +1,401 @@
+"""Local stand-in for the Gemini generateContent API.
+
+Serves ``:generateContent`` and ``:streamGenerateContent`` (``alt=sse``) for
+any model with canned puzzle bundles and answers, and ``cachedContents``
+for context caching, plus a
+configurable latency distribution and error rate, so the backend can be
+exercised and benchmarked offline:
+
+    python mock_gemini.py --port 8765 --latency 0.8 --jitter 0.3 --error-rate 0.02
+    GEMINI_BASE_URL=http://127.0.0.1:8765/v1beta python -m flask run
+
+The API key is ignored.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PUZZLES = [
+    {
+        "puzzle": "A lighthouse keeper turns off the lamp one night and goes to bed. The next morning "
+                  "he is arrested. Why?",
+        "solution": "A ship ran aground on the rocks in the dark because the lighthouse was off. The keeper "
+                    "had been distracted by a letter telling him he was being replaced, and forgot "
+                    "that the automatic timer had been removed that week.",
+        "hints": [
+            "Think about what a lighthouse is for.",
+            "Something happened out at sea that night.",
+            "The keeper usually didn't need to stay awake for the lamp."
+        ],
+        "key_facts": [
+            "A ship crashed because the lighthouse was dark.",
+            "The keeper was distracted by news of being replaced.",
+            "The automatic timer had been removed that week."
+        ]
+    },
+    {
+        "puzzle": "A woman buys a new pair of shoes, wears them to work and dies. What happened?",
+        "solution": "She was a circus knife-thrower's assistant. The new shoes had higher heels, so she "
+                    "stood taller than usual and the knife that normally passed over her head struck her.",
+        "hints": [
+            "Her job was unusual and dangerous.",
+            "Her height mattered at work.",
+            "Someone at work threw things near her."
+        ],
+        "key_facts": [
+            "She worked as a knife-thrower's assistant.",
+            "The new shoes made her taller.",
+            "A thrown knife hit her."
+        ]
+    },
+    {
+        "puzzle": "A chess player wins every game at a tournament without making a single move. How?",
+        "solution": "She was the tournament's arbiter's daughter playing against herself in a simultaneous "
+                    "exhibition where every opponent forfeited because a storm closed the roads.",
+        "hints": [
+            "She never touched a piece.",
+            "Her opponents never arrived.",
+            "The weather played a part."
+        ],
+        "key_facts": [
+            "Every opponent forfeited.",
+            "A storm closed the roads.",
+            "Forfeits count as wins."
+        ]
+    }
+]
+
+# Building blocks for synthetic puzzles, so generated puzzles vary like a real model's
+ROLES = ["baker", "pilot", "violinist", "beekeeper", "lifeguard", "librarian", "astronomer", "tailor",
+         "ferry captain", "jeweller", "mountain guide", "radio host", "glassblower", "zookeeper", "locksmith"]
+PLACES = ["harbour", "opera house", "night market", "observatory", "ice rink", "vineyard", "train station",
+          "lighthouse", "museum vault", "desert camp", "orchard", "bell tower", "ferry terminal", "circus tent"]
+OBJECTS = ["a silver key", "an empty birdcage", "three umbrellas", "a cracked mirror", "a stopped clock",
+           "a red balloon", "a wet envelope", "two left gloves", "a broken compass", "a jar of honey"]
+OUTCOMES = ["the whole town thanked them", "they were fired", "the police arrived", "a stranger wept",
+            "every light in the street went out", "a wedding was cancelled", "the river was closed",
+            "a prize was returned", "the mayor resigned", "nobody could leave"]
+CAUSES = ["had mixed up two identical deliveries", "was secretly signalling a friend across the water",
+          "was covering for a sleeping colleague", "had misread a note written in the dark",
+          "was testing a rumour they had overheard", "was keeping a promise made years ago",
+          "had swapped places with a twin", "was hiding a surprise for a retirement party",
+          "had followed instructions meant for someone else", "was tracking a thief without telling anyone"]
+PUZZLE_TEMPLATES = [
+    "A {role} leaves {object} at the {place}. The next morning {outcome}. What happened?",
+    "Every evening a {role} checks {object} near the {place}. One night they don't, and {outcome}. Why?",
+    "At the {place}, a {role} refuses to touch {object}. Hours later {outcome}. Explain.",
+]
+
+INTRO = ("Welcome to the puzzle! Here it is:\n\n{puzzle}\n\n"
+         "Ask me yes/no questions to uncover what happened.")
+ANSWERS = [
+    "Yes.",
+    "No.",
+    "That's irrelevant to the puzzle.",
+    "Yes, and that's an important detail.",
+    "No, think about the setting instead."
+]
+COMPLETED = "Yes, you've got it! {solution} [GAME_COMPLETED]"
+
+PATH_PATTERN = re.compile(r"/models/[^/:]+:(generateContent|streamGenerateContent)$")
+CACHE_PATTERN = re.compile(r"/(cachedContents(?:/[^/]+)?)$")
+
+
+class MockConfig:
+    def __init__(self, latency=0.5, jitter=0.2, distribution="normal", error_rate=0.0,
+                 error_status=503, complete_rate=0.0, invalid_rate=0.0, duplicate_rate=0.0,
+                 chunk_size=12, chunk_delay=0.02):
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.complete_rate = complete_rate
+        self.invalid_rate = invalid_rate
+        self.duplicate_rate = duplicate_rate
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+
+    def delay(self):
+        """Seconds to wait before the first byte of a response"""
+        if self.distribution == "fixed":
+            return self.latency
+        if self.distribution == "uniform":
+            return max(0.0, random.uniform(self.latency - self.jitter, self.latency + self.jitter))
+        if self.distribution == "lognormal" and self.latency > 0:
+            # Long right tail like a real model; ``jitter`` is sigma of the log
+            return random.lognormvariate(0, self.jitter) * self.latency
+        return max(0.0, random.gauss(self.latency, self.jitter))
+
+
+def last_user_text(payload):
+    for content in reversed(payload.get("contents", [])):
+        if content.get("role", "user") == "user":
+            return "".join(part.get("text", "") for part in content.get("parts", []))
+    return ""
+
+
+def synthetic_puzzle():
+    slots = {
+        "role": random.choice(ROLES),
+        "place": random.choice(PLACES),
+        "object": random.choice(OBJECTS),
+        "outcome": random.choice(OUTCOMES)
+    }
+    cause = random.choice(CAUSES)
+    return {
+        "puzzle": random.choice(PUZZLE_TEMPLATES).format(**slots),
+        "solution": f"The {slots['role']} {cause}, and {slots['object']} was the only clue left at the "
+                    f"{slots['place']}; that is why {slots['outcome']}.",
+        "hints": [
+            f"Think about what a {slots['role']} does every day.",
+            f"{slots['object'][0].upper()}{slots['object'][1:]} was a message, not an accident.",
+            f"Ask why the {slots['role']} was at the {slots['place']} at all."
+        ],
+        "key_facts": [
+            f"The {slots['role']} {cause}.",
+            f"{slots['object'][0].upper()}{slots['object'][1:]} was left on purpose.",
+            f"Because of it, {slots['outcome']}."
+        ]
+    }
+
+
+def generated_puzzle(config, with_intro):
+    """One generated puzzle: a canned one (a likely repeat) at duplicate_rate, else a synthetic one"""
+    if random.random() < config.duplicate_rate:
+        puzzle = dict(random.choice(PUZZLES))
+    else:
+        puzzle = synthetic_puzzle()
+    if with_intro:
+        puzzle["intro"] = INTRO.format(puzzle=puzzle["puzzle"])
+    return puzzle
+
+
+def from_host_rules(payload, field, default):
+    """Recover the puzzle or solution from the host rules the backend sends"""
+    system = "".join(part.get("text", "") for part in payload.get("systemInstruction", {}).get("parts", []))
+    match = re.search(rf'{field}: "(.*?)"\n', system, re.DOTALL)
+    return match.group(1) if match else default
+
+
+def reply_for(payload, config):
+    """Canned model reply matching the phase of the request"""
+    text = last_user_text(payload)
+    batch = re.match(r"Create (\d+) different lateral thinking puzzles", text)
+    if batch or text.startswith("Create a lateral thinking puzzle"):
+        schema = payload.get("generationConfig", {}).get("responseSchema", {})
+        properties = schema.get("properties", {})
+        if batch:
+            with_intro = "intro" in properties.get("puzzles", {}).get("items", {}).get("properties", {})
+            reply = {"puzzles": [generated_puzzle(config, with_intro) for _ in range(int(batch.group(1)))]}
+        else:
+            reply = generated_puzzle(config, "intro" in properties)
+        if random.random() < config.invalid_rate:
+            # Truncated output, as when a reply hits the token limit
+            return json.dumps(reply)[:40]
+        return json.dumps(reply)
+    if text.startswith("Let's start the game"):
+        return INTRO.format(puzzle=from_host_rules(payload, "The puzzle is", PUZZLES[0]["puzzle"]))
+    solution = from_host_rules(payload, "The hidden solution is", PUZZLES[0]["solution"])
+    batch = re.match(r"(\d+) questions were asked at once", text)
+    if batch:
+        # A multiplayer room's batch: one numbered answer per question
+        return "\n".join(f"{number}. {answer_for(solution, config)}" for number in range(1, int(batch.group(1)) + 1))
+    return answer_for(solution, config)
+
+
+def answer_for(solution, config):
+    if random.random() < config.complete_rate:
+        return COMPLETED.format(solution=solution)
+    return random.choice(ANSWERS)
+
+
+def usage_for(payload, reply):
+    # Roughly four characters per token
+    prompt = len(json.dumps(payload)) // 4
+    response = len(reply) // 4
+    return {"promptTokenCount": prompt, "candidatesTokenCount": response, "totalTokenCount": prompt + response}
+
+
+def candidate(text):
+    return {"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}
+
+
+def error_body(status, message, reason):
+    return {"error": {"code": status, "message": message, "status": reason}}
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = MockConfig()
+    # cachedContents/<id> -> (cached request parts, expiry)
+    cached_contents = {}
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        match = PATH_PATTERN.search(path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        cache_match = CACHE_PATTERN.search(path)
+        if match is None and (cache_match is None or cache_match.group(1) != "cachedContents"):
+            self.send_json(404, error_body(404, "Not found", "NOT_FOUND"))
+            return
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self.send_json(400, error_body(400, "Invalid JSON", "INVALID_ARGUMENT"))
+            return
+        if match is None:
+            self.create_cached_content(payload)
+            return
+        cached_tokens = None
+        if payload.get("cachedContent"):
+            payload, cached_tokens = self.with_cached_content(payload)
+            if payload is None:
+                self.send_json(404, error_body(404, "CachedContent not found", "NOT_FOUND"))
+                return
+
+        time.sleep(self.config.delay())
+        if random.random() < self.config.error_rate:
+            status = self.config.error_status
+            self.send_json(status, {"error": {"code": status, "message": "Mock upstream error", "status": "UNAVAILABLE"}})
+            return
+
+        reply = reply_for(payload, self.config)
+        usage = usage_for(payload, reply)
+        if cached_tokens is not None:
+            # Counted in the prompt like the real API, and reported separately
+            usage["cachedContentTokenCount"] = cached_tokens
+        if match.group(1) == "streamGenerateContent":
+            self.send_stream(reply, usage)
+        else:
+            self.send_json(200, {"candidates": [candidate(reply)], "usageMetadata": usage})
+
+    def do_DELETE(self):
+        match = CACHE_PATTERN.search(self.path.split("?", 1)[0])
+        if match is None or self.cached_contents.pop(match.group(1), None) is None:
+            self.send_json(404, error_body(404, "Not found", "NOT_FOUND"))
+            return
+        self.send_json(200, {})
+
+    def create_cached_content(self, payload):
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        ttl = float(str(payload.get("ttl", "3600s")).rstrip("s"))
+        cached = {"systemInstruction": payload.get("systemInstruction", {}), "contents": payload.get("contents", [])}
+        self.cached_contents[name] = (cached, time.time() + ttl)
+        tokens = len(json.dumps(cached)) // 4
+        self.send_json(200, {"name": name, "model": payload.get("model"), "usageMetadata": {"totalTokenCount": tokens}})
+
+    def with_cached_content(self, payload):
+        """(request with its cached content filled back in, cached tokens), or (None, 0) if unknown or expired"""
+        name = payload["cachedContent"]
+        cached, expires = self.cached_contents.get(name, (None, 0))
+        if cached is None or expires < time.time():
+            self.cached_contents.pop(name, None)
+            return None, 0
+        merged = dict(payload, systemInstruction=cached["systemInstruction"],
+                      contents=cached["contents"] + payload.get("contents", []))
+        del merged["cachedContent"]
+        return merged, len(json.dumps(cached)) // 4
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, reply, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        size = self.config.chunk_size
+        chunks = [reply[i:i + size] for i in range(0, len(reply), size)] or [""]
+        for i, chunk in enumerate(chunks):
+            event = {"candidates": [candidate(chunk)]}
+            if i == len(chunks) - 1:
+                event["usageMetadata"] = usage
+            self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+            self.wfile.flush()
+            if i < len(chunks) - 1:
+                time.sleep(self.config.chunk_delay)
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockGeminiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog of 5 resets connections under load tests
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-response are routine when a load test stops
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_server(host="127.0.0.1", port=0, config=None):
+    """Build a mock server; port 0 picks a free port (see ``server.server_port``)"""
+    handler = type("ConfiguredMockGeminiHandler", (MockGeminiHandler,),
+                   {"config": config or MockConfig(), "cached_contents": {}})
+    return MockGeminiServer((host, port), handler)
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.5, help="mean seconds before responding")
+    parser.add_argument("--jitter", type=float, default=0.2,
+                        help="spread: stddev (normal), half-width (uniform) or log sigma (lognormal)")
+    parser.add_argument("--distribution", choices=["fixed", "normal", "uniform", "lognormal"], default="normal")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--complete-rate", type=float, default=0.0,
+                        help="fraction of questions answered as a correct solve")
+    parser.add_argument("--invalid-rate", type=float, default=0.0,
+                        help="fraction of puzzle generations that return malformed JSON")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0,
+                        help="fraction of generated puzzles drawn from a tiny canned set, so they repeat")
+    parser.add_argument("--chunk-size", type=int, default=12, help="characters per streamed chunk")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="seconds between streamed chunks")
+
+
+def config_from_args(args):
+    return MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        distribution=args.distribution,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        complete_rate=args.complete_rate,
+        invalid_rate=args.invalid_rate,
+        duplicate_rate=args.duplicate_rate,
+        chunk_size=args.chunk_size,
+        chunk_delay=args.chunk_delay
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, config_from_args(args))
+    print(f"Mock Gemini API listening on http://{args.host}:{server.server_port}/v1beta", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
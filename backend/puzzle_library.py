@@ -0,0 +1,169 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+
+
+def signature_text(puzzle, solution):
+    """The text a puzzle's near-duplicate signature is computed from"""
+    return f"{puzzle}\n{solution}"
+
+
+class PuzzleLibrary:
+    """Persistent library of every generated puzzle, backed by SQLite in WAL mode.
+
+    Puzzles are keyed by their fingerprint and filed under the (difficulty,
+    length, theme) bucket they were generated for. Each one carries its play
+    count, solve count and solve rate, updated as games start and end. The
+    library outlives sessions and restarts, so games can be started from it
+    without an upstream call, and every process on one host can share it.
+
+    Given a MinHashIndex, each puzzle's signature is stored with it, and
+    ``sync_index`` loads the signatures of puzzles filed since the last sync,
+    by this process or any other, so near-duplicates are caught across
+    restarts and workers without rehashing the library.
+    """
+
+    def __init__(self, path, candidates=20, index=None):
+        self.path = path
+        # Least-played puzzles to choose from at random, so replays rotate
+        self.candidates = candidates
+        self.index = index
+
+        self._local = threading.local()
+        # Last row loaded into the index
+        self._synced = 0
+        self._sync_lock = threading.Lock()
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS puzzles (
+                id TEXT PRIMARY KEY,
+                difficulty TEXT NOT NULL,
+                length TEXT NOT NULL,
+                theme TEXT NOT NULL,
+                puzzle TEXT NOT NULL,
+                solution TEXT NOT NULL,
+                intro TEXT NOT NULL,
+                hints TEXT NOT NULL,
+                key_facts TEXT NOT NULL,
+                created REAL NOT NULL,
+                plays INTEGER NOT NULL DEFAULT 0,
+                solves INTEGER NOT NULL DEFAULT 0,
+                solve_rate REAL,
+                signature TEXT
+            )
+        """)
+        if "signature" not in {row[1] for row in conn.execute("PRAGMA table_info(puzzles)")}:
+            conn.execute("ALTER TABLE puzzles ADD COLUMN signature TEXT")
+        # Serves exact-bucket lookups least-played first, and difficulty-only lookups by prefix
+        conn.execute("CREATE INDEX IF NOT EXISTS puzzles_bucket ON puzzles (difficulty, length, theme, plays)")
+        conn.execute("CREATE INDEX IF NOT EXISTS puzzles_theme ON puzzles (theme, plays)")
+        conn.execute("CREATE INDEX IF NOT EXISTS puzzles_plays ON puzzles (plays)")
+
+    def _conn(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, key, entries):
+        """File puzzle entries under ``key``; puzzles already in the library are left as they are"""
+        difficulty, length, theme = key
+        now = time.time()
+        rows = [
+            (entry["puzzle_id"], difficulty, length, theme, entry["puzzle"], entry["solution"], entry["intro"],
+             json.dumps(entry.get("hints", [])), json.dumps(entry.get("key_facts", [])), now,
+             self._signature(entry["puzzle"], entry["solution"]))
+            for entry in entries
+        ]
+        conn = self._conn()
+        with conn:
+            conn.executemany("""
+                INSERT OR IGNORE INTO puzzles
+                    (id, difficulty, length, theme, puzzle, solution, intro, hints, key_facts, created, signature)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+
+    def _signature(self, puzzle, solution):
+        if self.index is None:
+            return None
+        return json.dumps(self.index.signature(signature_text(puzzle, solution)))
+
+    def sync_index(self):
+        """Load puzzles filed since the last sync into the index; returns how many were loaded.
+
+        The first sync loads the newest ``index.max_entries`` puzzles. Puzzles
+        stored without a signature get one computed and saved here, once.
+        """
+        if self.index is None:
+            return 0
+        with self._sync_lock:
+            conn = self._conn()
+            rows = conn.execute("""
+                SELECT rowid, id, puzzle, solution, signature FROM
+                    (SELECT rowid, * FROM puzzles WHERE rowid > ? ORDER BY rowid DESC LIMIT ?)
+                ORDER BY rowid
+            """, (self._synced, self.index.max_entries)).fetchall()
+            missing = []
+            for rowid, puzzle_id, puzzle, solution, signature in rows:
+                if signature is None:
+                    signature = self._signature(puzzle, solution)
+                    missing.append((signature, puzzle_id))
+                self.index.add(puzzle_id, tuple(json.loads(signature)))
+                self._synced = rowid
+            if missing:
+                with conn:
+                    conn.executemany("UPDATE puzzles SET signature = ? WHERE id = ?", missing)
+            return len(rows)
+
+    def pick(self, key, relaxed=False):
+        """A puzzle bundle for ``key``, chosen among its least-played puzzles, or None.
+
+        With ``relaxed`` an empty bucket falls back to any puzzle of the same
+        difficulty, then of the same theme, then to any puzzle at all.
+        """
+        difficulty, length, theme = key
+        queries = [("difficulty = ? AND length = ? AND theme = ?", (difficulty, length, theme))]
+        if relaxed:
+            queries += [("difficulty = ?", (difficulty,)), ("theme = ?", (theme,)), ("1", ())]
+
+        conn = self._conn()
+        for where, params in queries:
+            rows = conn.execute(f"""
+                SELECT puzzle, solution, intro, hints, key_facts FROM puzzles
+                WHERE {where} ORDER BY plays LIMIT ?
+            """, params + (self.candidates,)).fetchall()
+            if rows:
+                puzzle, solution, intro, hints, key_facts = random.choice(rows)
+                return {
+                    "puzzle": puzzle,
+                    "solution": solution,
+                    "intro": intro,
+                    "hints": json.loads(hints),
+                    "key_facts": json.loads(key_facts)
+                }
+        return None
+
+    def record_play(self, puzzle_id):
+        self._conn().execute("""
+            UPDATE puzzles SET plays = plays + 1, solve_rate = CAST(solves AS REAL) / (plays + 1)
+            WHERE id = ?
+        """, (puzzle_id,))
+
+    def record_solve(self, puzzle_id):
+        self._conn().execute("""
+            UPDATE puzzles SET solves = solves + 1, solve_rate = CAST(solves + 1 AS REAL) / MAX(plays, 1)
+            WHERE id = ?
+        """, (puzzle_id,))
+
+    def stats(self):
+        count, plays, solves = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(plays), 0), COALESCE(SUM(solves), 0) FROM puzzles"
+        ).fetchone()
+        return {"puzzles": count, "plays": plays, "solves": solves}
@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PuzzlePool:
+    """Warm pool of ready-to-play puzzles, bucketed by (difficulty, length, theme).
+
+    A background worker keeps every tracked bucket topped up to ``low_water``
+    entries so that starting a game is a constant-time pop. Buckets are tracked
+    once they are requested (or up front via ``prewarm``). Each refill may
+    produce a batch of entries, so a bucket can briefly exceed ``low_water``.
+    """
+
+    def __init__(self, generate, low_water=2, prewarm=(), retry_delay=5, max_retry_delay=300):
+        # generate(difficulty, puzzle_length, theme) -> list of entries, empty on failure
+        self.generate = generate
+        self.low_water = low_water
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._buckets = {key: [] for key in prewarm}
+        self._cond = threading.Condition()
+        self._worker = None
+
+    @property
+    def enabled(self):
+        return self.low_water > 0
+
+    def start(self):
+        """Start the refill worker (idempotent)."""
+        if not self.enabled:
+            return
+        with self._cond:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name="puzzle-pool-refill", daemon=True)
+            self._worker.start()
+
+    def pop(self, key):
+        """Take a ready puzzle for ``key``, or None if the bucket is empty."""
+        if not self.enabled:
+            return None
+        self.start()
+        with self._cond:
+            bucket = self._buckets.setdefault(key, [])
+            entry = bucket.pop(0) if bucket else None
+            self._cond.notify()
+        return entry
+
+    def sizes(self):
+        with self._cond:
+            return {key: len(bucket) for key, bucket in self._buckets.items()}
+
+    def _next_key(self):
+        # Refill the emptiest bucket first so no combination starves
+        candidates = [(len(bucket), key) for key, bucket in self._buckets.items() if len(bucket) < self.low_water]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda item: item[0])[1]
+
+    def _run(self):
+        delay = self.retry_delay
+        while True:
+            with self._cond:
+                key = self._next_key()
+                while key is None:
+                    self._cond.wait()
+                    key = self._next_key()
+
+            try:
+                entries = self.generate(*key)
+            except Exception:
+                logger.exception("Puzzle pool: error generating puzzles for %s", key)
+                entries = []
+
+            if not entries:
+                # Upstream is failing; back off instead of hammering the API
+                logger.warning("Puzzle pool: generation failed for %s, retrying in %ss", key, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+
+            delay = self.retry_delay
+            with self._cond:
+                bucket = self._buckets.setdefault(key, [])
+                bucket.extend(entries)
+                size = len(bucket)
+            logger.info("Puzzle pool: refilled %s (%d/%d)", key, size, self.low_water)
@@ -0,0 +1,17 @@
+# Map theme to puzzle type; the valid themes are its keys
+PUZZLE_TYPES = {
+    "random": [
+        "murder mystery",
+        "strange occurrence",
+        "unexplained phenomenon",
+        "bizarre situation",
+        "unexpected outcome",
+        "mysterious disappearance",
+        "unusual death",
+        "surprising discovery"
+    ],
+    "mystery": ["murder mystery", "mysterious disappearance", "unsolved crime"],
+    "adventure": ["wilderness survival", "expedition gone wrong", "lost explorer"],
+    "scifi": ["alien encounter", "time paradox", "futuristic technology malfunction"],
+    "historical": ["historical event", "ancient mystery", "historical figure's secret"]
+}
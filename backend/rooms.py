@@ -0,0 +1,190 @@
+import asyncio
+import threading
+from collections import deque
+
+
+class Subscription:
+    """A room member's queue of events, readable from a thread or a coroutine.
+
+    Holds at most ``max_pending`` undelivered events; a listener that falls
+    further behind loses the oldest ones rather than growing without bound.
+    """
+
+    def __init__(self, max_pending=100, loop=None):
+        self._events = deque(maxlen=max_pending)
+        self._cond = threading.Condition()
+        self._loop = loop
+        self._wakeup = asyncio.Event() if loop is not None else None
+        self.dropped = 0
+
+    def put(self, event):
+        with self._cond:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(event)
+            self._cond.notify()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def get(self, timeout=None):
+        """Pending events, oldest first, waiting up to ``timeout`` seconds; [] if none arrived"""
+        with self._cond:
+            if not self._events:
+                self._cond.wait(timeout)
+            return self._drain()
+
+    async def get_async(self, timeout=None):
+        self._wakeup.clear()
+        with self._cond:
+            if self._events:
+                return self._drain()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._cond:
+            return self._drain()
+
+    def _drain(self):
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+
+class Ticket:
+    """A question waiting for its room's next batch.
+
+    ``wait`` returns once the ticket is answered (``done``) or its holder has
+    been made the room's ``leader`` and must run the next batch.
+    """
+
+    def __init__(self, item, loop=None):
+        self.item = item
+        self.leader = False
+        self.promoted = False
+        self.done = False
+        self.result = None
+        self.error = None
+        self._event = threading.Event()
+        self._loop = loop
+        self._future = loop.create_future() if loop is not None else None
+
+    def wait(self):
+        self._event.wait()
+        self._event.clear()
+
+    async def wait_async(self):
+        await self._future
+        self._future = self._loop.create_future()
+
+    def _wake(self):
+        self._event.set()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+
+class RoomHub:
+    """In-process fan-out and question batching for multiplayer rooms.
+
+    Members ``subscribe`` to a room and receive every event ``publish``-ed
+    to it. Questions are ``submit``-ted as tickets; the first one in an idle
+    room makes its holder the leader, who ``take``-s up to ``max_batch``
+    waiting tickets, answers them with one upstream call and ``finish``-es
+    them. Questions arriving meanwhile queue up, and the holder of the
+    oldest one leads the next batch, so a room never has more than one call
+    in flight and no thread sits idle per room. Rooms with no members and
+    no questions take no memory.
+    """
+
+    def __init__(self, max_batch=8, max_pending=100):
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._subscribers = {}
+        # room -> tickets not yet taken into a batch, oldest first
+        self._queues = {}
+        # Rooms with a batch being collected or answered
+        self._busy = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, room, loop=None):
+        subscription = Subscription(self.max_pending, loop)
+        with self._lock:
+            self._subscribers.setdefault(room, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, room, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(room)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[room]
+
+    def publish(self, room, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(room, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def submit(self, room, item, loop=None):
+        """Queue a question; the returned ticket is already ``leader`` if the room was idle"""
+        ticket = Ticket(item, loop)
+        with self._lock:
+            self._queues.setdefault(room, deque()).append(ticket)
+            if room not in self._busy:
+                self._busy.add(room)
+                ticket.leader = True
+        return ticket
+
+    def take(self, room):
+        """Waiting tickets for the leader's batch, oldest first"""
+        with self._lock:
+            queue = self._queues.get(room, deque())
+            batch = [queue.popleft() for _ in range(min(self.max_batch, len(queue)))]
+            if not queue:
+                self._queues.pop(room, None)
+            return batch
+
+    def finish(self, room, tickets, results=None, error=None):
+        """Settle a batch's tickets and hand leadership to the oldest waiting ticket, if any"""
+        for index, ticket in enumerate(tickets):
+            ticket.done = True
+            ticket.result = results[index] if results is not None else None
+            ticket.error = error
+            ticket._wake()
+        self._handoff(room)
+
+    def abandon(self, room, ticket):
+        """Withdraw a ticket whose holder stopped waiting, passing on leadership it held"""
+        with self._lock:
+            queue = self._queues.get(room)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    self._queues.pop(room, None)
+            if not ticket.leader or ticket.done:
+                return
+        self._handoff(room)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rooms": len(set(self._subscribers) | self._busy),
+                "listeners": sum(len(subscribers) for subscribers in self._subscribers.values()),
+                "queued": sum(len(queue) for queue in self._queues.values())
+            }
+
+    def _handoff(self, room):
+        with self._lock:
+            queue = self._queues.get(room)
+            if not queue:
+                self._busy.discard(room)
+                return
+            successor = queue[0]
+            successor.leader = True
+            successor.promoted = True
+        successor._wake()
@@ -0,0 +1,337 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Record types: a full state, the changes since the last record, a removal
+PUT = b"P"
+DELTA = b"D"
+DELETE = b"X"
+
+# Lists that only grow at the end and are trimmed from the front (the message
+# window and the fact digest); their records carry just the new items
+APPEND_KEYS = frozenset(("messages", "facts"))
+
+
+def encode(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+def apply_delta(state, delta):
+    """Apply a DELTA record's changes to a decoded state"""
+    for key, (items, keep) in delta.get("a", {}).items():
+        values = state.get(key, []) + items
+        state[key] = values[len(values) - keep:]
+    state.update(delta.get("u", {}))
+    for key in delta.get("r", ()):
+        state.pop(key, None)
+
+
+class EncodedState:
+    """A session restored from the journal and not used since: its last full record and the deltas after it"""
+
+    __slots__ = ("records", "size")
+
+    def __init__(self, record):
+        self.records = [record]
+        self.size = len(record)
+
+    def add(self, record):
+        self.records.append(record)
+        self.size += len(record)
+
+    def decode(self):
+        state = json.loads(self.records[0])
+        for record in self.records[1:]:
+            try:
+                delta = json.loads(record)
+            except ValueError:
+                # Only the last record can be cut short by a crash
+                break
+            apply_delta(state, delta)
+        return state
+
+    def encode(self):
+        return self.records[0] if len(self.records) == 1 else encode(self.decode()).encode()
+
+
+class _Cursor:
+    """What the journal last wrote for a live session"""
+
+    __slots__ = ("hashes", "tails")
+
+    def __init__(self):
+        # key -> hash of its encoded value
+        self.hashes = {}
+        # append key -> (last item journaled, list length), compared by identity
+        self.tails = {}
+
+
+class SessionJournal:
+    """Append-only journal of session writes, compacted into a snapshot, for warm restarts.
+
+    Each ``put`` appends one line to the current segment file: the full
+    state the first time a session is written, and afterwards only what
+    changed, i.e. new items of the message and fact windows and any other
+    field whose value differs. Deletes are journaled too. Lines go straight
+    to the OS, so a crash or redeploy of the process loses nothing; a power
+    failure can lose what the OS hadn't written out yet.
+
+    Once a segment reaches ``segment_bytes`` a new one is started. When the
+    closed segments add up to half the snapshot's size (so the snapshot
+    isn't rewritten for every segment), a background thread folds them into
+    it, dropping deleted sessions and those idle for longer than ``ttl``.
+
+    ``load`` reads the snapshot and replays the segments written since.
+    States are handed back still encoded, so a restart only splits lines
+    and each session is decoded when it is first used.
+
+    Segments are only created on the first write, so a process that merely
+    loads the journal (like the Flask reloader's parent) leaves it as it is.
+    """
+
+    def __init__(self, path, ttl=3600, segment_bytes=32 * 1024 * 1024, on_compact=None):
+        self.path = path
+        self.ttl = ttl
+        self.segment_bytes = segment_bytes
+        # on_compact(sessions, seconds) after each snapshot is written
+        self.on_compact = on_compact
+
+        self._cursors = {}
+        self._file = None
+        self._seq = 0
+        self._written = 0
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._compact_requested = threading.Event()
+        self._worker = None
+
+    @property
+    def snapshot_path(self):
+        return f"{self.path}.snapshot"
+
+    def load(self):
+        """Live sessions as {session_id: [EncodedState, last write time]}, least recently written first"""
+        sessions = {}
+        seq = self._read_snapshot(sessions)
+        for number, segment in self._segments():
+            if number > seq:
+                self._replay(segment, sessions)
+        cutoff = time.time() - self.ttl
+        live = [(session_id, item) for session_id, item in sessions.items() if item[1] >= cutoff]
+        live.sort(key=lambda entry: entry[1][1])
+        return dict(live)
+
+    def put(self, session_id, state):
+        with self._lock:
+            cursor = self._cursors.get(session_id)
+            if cursor is None:
+                cursor = self._cursors[session_id] = _Cursor()
+                record = PUT, self._full(state, cursor)
+            else:
+                record = DELTA, self._delta(state, cursor)
+            self._append(record[0], session_id, record[1])
+
+    def delete(self, session_id):
+        with self._lock:
+            self._cursors.pop(session_id, None)
+            self._append(DELETE, session_id, "")
+
+    def _full(self, state, cursor):
+        fields = []
+        for key, value in state.items():
+            encoded = encode(value)
+            fields.append(f"{encode(key)}:{encoded}")
+            if key in APPEND_KEYS and isinstance(value, list):
+                cursor.tails[key] = (value[-1] if value else None, len(value))
+            else:
+                cursor.hashes[key] = hash(encoded)
+        return "{" + ",".join(fields) + "}"
+
+    def _delta(self, state, cursor):
+        appended = {}
+        updated = []
+        for key, value in state.items():
+            if key in cursor.tails and isinstance(value, list):
+                items = self._appended(value, *cursor.tails[key])
+                if items is not None:
+                    if items or len(value) != cursor.tails[key][1]:
+                        appended[key] = [items, len(value)]
+                    cursor.tails[key] = (value[-1] if value else None, len(value))
+                    continue
+                # Rewritten rather than appended to; journal it whole from now on
+                del cursor.tails[key]
+            encoded = encode(value)
+            if cursor.hashes.get(key) != hash(encoded):
+                cursor.hashes[key] = hash(encoded)
+                updated.append(f"{encode(key)}:{encoded}")
+        removed = [key for key in (*cursor.hashes, *cursor.tails) if key not in state]
+        for key in removed:
+            cursor.hashes.pop(key, None)
+            cursor.tails.pop(key, None)
+
+        fields = []
+        if appended:
+            fields.append(f'"a":{encode(appended)}')
+        if updated:
+            fields.append('"u":{' + ",".join(updated) + "}")
+        if removed:
+            fields.append(f'"r":{encode(removed)}')
+        return "{" + ",".join(fields) + "}"
+
+    @staticmethod
+    def _appended(values, tail, length):
+        """Items added after ``tail``, or None if the list was changed some other way"""
+        if tail is None:
+            return list(values) if length == 0 else None
+        for index in range(len(values) - 1, -1, -1):
+            if values[index] is tail:
+                return values[index + 1:]
+        return None
+
+    def _append(self, kind, session_id, payload):
+        line = b"\t".join((kind, session_id.encode(), b"%.3f" % time.time(), payload.encode())) + b"\n"
+        if self._file is None:
+            self._open_segment()
+        self._file.write(line)
+        self._written += len(line)
+        if self._written >= self.segment_bytes:
+            self._file.close()
+            self._file = None
+            self._request_compaction()
+
+    def _open_segment(self):
+        seq = max([number for number, _ in self._segments()] + [self._snapshot_seq(), self._seq])
+        while True:
+            seq += 1
+            try:
+                # Unbuffered, so each record reaches the OS as it is written
+                self._file = open(f"{self.path}.{seq:08d}", "xb", buffering=0)
+                break
+            except FileExistsError:
+                continue
+        self._seq = seq
+        self._written = 0
+        if any(number < seq for number, _ in self._segments()):
+            # Segments left by an earlier run
+            self._request_compaction()
+
+    def _segments(self):
+        """(sequence number, path) of every segment on disk, oldest first"""
+        directory, name = os.path.split(self.path)
+        pattern = re.compile(re.escape(name) + r"\.(\d{8})$")
+        segments = []
+        for entry in os.listdir(directory or "."):
+            match = pattern.match(entry)
+            if match:
+                segments.append((int(match.group(1)), os.path.join(directory, entry)))
+        return sorted(segments)
+
+    def _snapshot_seq(self):
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                return int(f.readline().split(b"\t")[1])
+        except (OSError, IndexError, ValueError):
+            return 0
+
+    def _read_snapshot(self, sessions):
+        """Fill ``sessions`` from the snapshot; returns the last segment folded into it"""
+        try:
+            f = open(self.snapshot_path, "rb")
+        except FileNotFoundError:
+            return 0
+        with f:
+            seq = int(f.readline().split(b"\t")[1])
+            for line in f:
+                session_id, written, state = line.rstrip(b"\n").split(b"\t", 2)
+                sessions[session_id.decode()] = [EncodedState(state), float(written)]
+        return seq
+
+    @staticmethod
+    def _replay(path, sessions):
+        with open(path, "rb") as f:
+            for line in f:
+                parts = line.rstrip(b"\n").split(b"\t", 3)
+                if len(parts) != 4:
+                    # A record cut short by a crash
+                    continue
+                kind, session_id, written, payload = parts
+                session_id = session_id.decode()
+                if kind == PUT:
+                    sessions[session_id] = [EncodedState(payload), float(written)]
+                elif kind == DELETE:
+                    sessions.pop(session_id, None)
+                elif kind == DELTA and session_id in sessions:
+                    item = sessions[session_id]
+                    item[0].add(payload)
+                    item[1] = float(written)
+
+    def _request_compaction(self):
+        self._compact_requested.set()
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="session-journal-compactor", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            self._compact_requested.wait()
+            self._compact_requested.clear()
+            try:
+                self.compact()
+            except Exception:
+                logger.exception("Session journal compaction failed")
+
+    def compact(self):
+        """Fold the closed segments into a new snapshot once they are worth it"""
+        with self._compact_lock:
+            started = time.monotonic()
+            # Listed together with the open segment, so one opened meanwhile isn't taken as closed
+            with self._lock:
+                if self._file is not None:
+                    closed = [(number, path) for number, path in self._segments() if number < self._seq]
+                else:
+                    closed = [(number, path) for number, path in self._segments() if number <= self._seq]
+            sessions = {}
+            seq = self._read_snapshot(sessions)
+            if not any(number > seq for number, _ in closed):
+                return
+            try:
+                snapshot_bytes = os.path.getsize(self.snapshot_path)
+            except OSError:
+                snapshot_bytes = 0
+            if sum(os.path.getsize(path) for _, path in closed) < snapshot_bytes / 2:
+                return
+            for number, path in closed:
+                if number > seq:
+                    self._replay(path, sessions)
+            last = closed[-1][0]
+
+            cutoff = time.time() - self.ttl
+            kept = 0
+            temporary = f"{self.snapshot_path}.tmp"
+            with open(temporary, "wb") as f:
+                f.write(b"#\t%d\n" % last)
+                for session_id, (state, written) in sessions.items():
+                    if written < cutoff:
+                        continue
+                    try:
+                        encoded = state.encode()
+                    except ValueError:
+                        logger.warning("Dropping session %s: its journal records are damaged", session_id)
+                        continue
+                    f.write(b"\t".join((session_id.encode(), b"%.3f" % written, encoded)) + b"\n")
+                    kept += 1
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self.snapshot_path)
+            for _, path in closed:
+                os.remove(path)
+
+            seconds = time.monotonic() - started
+            logger.info("Compacted the session journal: %d sessions in %.2fs", kept, seconds)
+            if self.on_compact is not None:
+                self.on_compact(kept, seconds)
@@ -0,0 +1,395 @@
+import gc
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from session_journal import EncodedState, SessionJournal
+
+try:
+    import redis
+except ImportError:  # Only needed for SESSION_BACKEND=redis
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Rough per-object overhead used when estimating a session's footprint
+MESSAGE_OVERHEAD = 200
+SESSION_OVERHEAD = 1000
+
+# Per-session locks are leases so that a crashed worker can't wedge a session.
+# The lease must outlast the slowest upstream call made while holding it.
+LOCK_LEASE = 180
+LOCK_POLL_INTERVAL = 0.02
+
+
+def dumps(state):
+    return json.dumps(state, separators=(',', ':'), ensure_ascii=False)
+
+
+def loads(data):
+    return json.loads(data)
+
+
+def estimate_size(state):
+    """Approximate memory footprint of a session state in bytes"""
+    size = SESSION_OVERHEAD
+    for message in state.get('messages', []):
+        size += MESSAGE_OVERHEAD + len(message.get('content', ''))
+    for fact in state.get('facts', []):
+        size += MESSAGE_OVERHEAD + len(fact.get('text', ''))
+    for player in state.get('players', {}).values():
+        size += MESSAGE_OVERHEAD + len(player.get('name', ''))
+    for value in state.get('riddle', {}).values():
+        if isinstance(value, str):
+            size += len(value)
+        elif isinstance(value, list):
+            size += sum(MESSAGE_OVERHEAD + len(item) for item in value)
+    return size
+
+
+class SessionStore:
+    """Interface for game session storage.
+
+    ``get`` returns the session state (or None when it doesn't exist or has
+    expired). Callers must ``put`` the state back after changing it, since
+    stores are not required to hand out live objects.
+    """
+
+    # Whether calls wait on disk or the network, so async callers should run them in a thread
+    blocking = True
+
+    def get(self, session_id):
+        raise NotImplementedError
+
+    def put(self, session_id, state):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def lock(self, session_id, timeout=LOCK_LEASE):
+        """Context manager serializing read-modify-write cycles on one session.
+
+        Raises TimeoutError if the lock can't be acquired within ``timeout``.
+        The lock may be released by another thread than the one that took it.
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """Store statistics such as 'sessions' and 'bytes', where cheaply available"""
+        return {}
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+
+class MemorySessionStore(SessionStore):
+    """In-process session store with idle-TTL expiry and LRU eviction.
+
+    Sessions idle for longer than ``ttl`` seconds expire, and the least
+    recently used sessions are evicted once there are more than
+    ``max_sessions`` or their estimated total size exceeds ``max_bytes``.
+
+    With a ``journal`` every write and removal is also journaled, and the
+    sessions it holds are restored on startup. Restored states stay encoded
+    until first used.
+    """
+
+    blocking = False
+
+    def __init__(self, ttl=3600, max_sessions=10000, max_bytes=256 * 1024 * 1024, journal=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.journal = journal
+
+        # session_id -> [state, size, last_access], oldest access first
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # session_id -> [lock, threads holding or waiting for it]; dropped once unused
+        self._session_locks = {}
+        if journal is not None:
+            self._restore()
+
+    def _restore(self):
+        started = time.monotonic()
+        # Collections triggered by allocating every session cost more than the reading
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            for session_id, (state, written) in self.journal.load().items():
+                # Sized by their encoded length until decoded
+                self._sessions[session_id] = [state, state.size, written]
+                self._bytes += state.size
+        finally:
+            if collecting:
+                gc.enable()
+        if self._sessions:
+            logger.info("Restored %d sessions from the journal in %.2fs",
+                        len(self._sessions), time.monotonic() - started)
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            item = self._sessions.get(session_id)
+            if item is None:
+                return None
+            if now - item[2] > self.ttl:
+                self._remove(session_id)
+                return None
+            item[2] = now
+            self._sessions.move_to_end(session_id)
+            if isinstance(item[0], EncodedState):
+                # Restored from the journal and not used since
+                try:
+                    item[0] = item[0].decode()
+                except ValueError:
+                    logger.warning("Dropping session %s: its journal records are damaged", session_id)
+                    self._remove(session_id)
+                    return None
+                size = estimate_size(item[0])
+                self._bytes += size - item[1]
+                item[1] = size
+            return item[0]
+
+    def put(self, session_id, state):
+        now = time.time()
+        size = estimate_size(state)
+        with self._lock:
+            item = self._sessions.get(session_id)
+            if item is not None:
+                self._bytes -= item[1]
+            self._sessions[session_id] = [state, size, now]
+            self._sessions.move_to_end(session_id)
+            self._bytes += size
+            if self.journal is not None:
+                self.journal.put(session_id, state)
+            self._evict(now)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._remove(session_id)
+
+    @contextmanager
+    def lock(self, session_id, timeout=LOCK_LEASE):
+        with self._lock:
+            entry = self._session_locks.setdefault(session_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            if not entry[0].acquire(timeout=timeout):
+                raise TimeoutError(f"Session {session_id} is busy")
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._session_locks[session_id]
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "bytes": self._bytes}
+
+    def _evict(self, now):
+        # Expired sessions sit at the front since the dict is ordered by last access
+        # The session that was just written is never evicted
+        while len(self._sessions) > 1:
+            session_id, item = next(iter(self._sessions.items()))
+            over_capacity = len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+            if not over_capacity and now - item[2] <= self.ttl:
+                break
+            self._remove(session_id)
+
+    def _remove(self, session_id):
+        item = self._sessions.pop(session_id, None)
+        if item is not None:
+            self._bytes -= item[1]
+            if self.journal is not None:
+                self.journal.delete(session_id)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Session store shared by every process on one host, backed by SQLite in WAL mode.
+
+    States are serialized as compact JSON. Sessions expire ``ttl`` seconds
+    after their last write; expired rows are purged periodically.
+    """
+
+    def __init__(self, path, ttl=3600, purge_interval=60):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+
+        self._local = threading.local()
+        self._last_purge = 0
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS session_locks (
+                id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires REAL NOT NULL
+            )
+        """)
+
+    def _conn(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        row = self._conn().execute(
+            "SELECT data FROM sessions WHERE id = ? AND updated >= ?",
+            (session_id, time.time() - self.ttl)
+        ).fetchone()
+        return loads(row[0]) if row else None
+
+    def put(self, session_id, state):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (id, data, updated) VALUES (?, ?, ?)",
+            (session_id, dumps(state), now)
+        )
+        if now - self._last_purge > self.purge_interval:
+            self._last_purge = now
+            conn.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+
+    def delete(self, session_id):
+        self._conn().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    @contextmanager
+    def lock(self, session_id, timeout=LOCK_LEASE):
+        conn = self._conn()
+        owner = uuid.uuid4().hex
+        deadline = time.time() + timeout
+        while True:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM session_locks WHERE id = ? AND expires < ?", (session_id, now))
+                acquired = conn.execute(
+                    "INSERT OR IGNORE INTO session_locks (id, owner, expires) VALUES (?, ?, ?)",
+                    (session_id, owner, now + LOCK_LEASE)
+                ).rowcount == 1
+            finally:
+                conn.execute("COMMIT")
+            if acquired:
+                break
+            if now > deadline:
+                raise TimeoutError(f"Session {session_id} is busy")
+            time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            # Released through the current thread's connection, which need not be the acquiring one
+            self._conn().execute("DELETE FROM session_locks WHERE id = ? AND owner = ?", (session_id, owner))
+
+    def stats(self):
+        row = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions WHERE updated >= ?",
+            (time.time() - self.ttl,)
+        ).fetchone()
+        return {"sessions": row[0], "bytes": row[1]}
+
+
+class RedisSessionStore(SessionStore):
+    """Session store shared across hosts via any Redis-protocol server.
+
+    Each session is one key holding compact JSON with an idle TTL that is
+    refreshed on every write. Per-session locks are SET NX leases released
+    with a WATCH/MULTI compare-and-delete, so servers without Lua scripting
+    work too.
+    """
+
+    def __init__(self, url=None, ttl=3600, prefix="riddlesense:session:", client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("SESSION_BACKEND=redis requires the 'redis' package (pip install redis)")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, session_id):
+        return f"{self.prefix}{session_id}"
+
+    def get(self, session_id):
+        data = self.client.get(self._key(session_id))
+        return loads(data) if data is not None else None
+
+    def put(self, session_id, state):
+        self.client.set(self._key(session_id), dumps(state), ex=int(self.ttl))
+
+    def delete(self, session_id):
+        self.client.delete(self._key(session_id))
+
+    @contextmanager
+    def lock(self, session_id, timeout=LOCK_LEASE):
+        key = f"{self._key(session_id)}:lock"
+        owner = uuid.uuid4().hex
+        deadline = time.time() + timeout
+        while not self.client.set(key, owner, nx=True, px=int(LOCK_LEASE * 1000)):
+            if time.time() > deadline:
+                raise TimeoutError(f"Session {session_id} is busy")
+            time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            self._release(key, owner)
+
+    def _release(self, key, owner):
+        # Only delete the lock if our lease hasn't expired and been taken over
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) == owner.encode():
+                    pipe.multi()
+                    pipe.delete(key)
+                    pipe.execute()
+                else:
+                    pipe.unwatch()
+            except Exception as e:
+                # The key changed under WATCH, so the lease was already taken over. Matched by
+                # name: an injected client needn't come from the redis package, which may be absent.
+                if type(e).__name__ != "WatchError":
+                    raise
+
+
+def create_session_store(backend="memory", ttl=3600, max_sessions=10000, max_bytes=256 * 1024 * 1024,
+                         sqlite_path="sessions.db", redis_url="redis://localhost:6379/0", journal_path=None,
+                         journal_segment_bytes=32 * 1024 * 1024, on_journal_compact=None):
+    """Build the session store selected by SESSION_BACKEND"""
+    if backend == "memory":
+        # The shared backends persist sessions already; only the in-process one needs a journal
+        journal = SessionJournal(
+            os.path.abspath(journal_path), ttl=ttl, segment_bytes=journal_segment_bytes, on_compact=on_journal_compact
+        ) if journal_path else None
+        return MemorySessionStore(ttl=ttl, max_sessions=max_sessions, max_bytes=max_bytes, journal=journal)
+    if backend == "sqlite":
+        return SQLiteSessionStore(os.path.abspath(sqlite_path), ttl=ttl)
+    if backend == "redis":
+        return RedisSessionStore(redis_url, ttl=ttl)
+    raise ValueError(f"Unknown session backend: {backend}")
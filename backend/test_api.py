@@ -7,7 +7,8 @@ from dotenv import load_dotenv
 load_dotenv()
 
 API_KEY = os.getenv("GEMINI_API_KEY", "")
-BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+BASE_URL = f"{GEMINI_BASE_URL}/models/gemini-2.0-flash:generateContent"
 
 def test_gemini_api():
     """Test function to make a simple call to the Gemini API"""
@@ -0,0 +1,64 @@
+import threading
+import time
+
+from context_cache import ContextCache
+
+
+def cache(ttl=100):
+    released = []
+    released_event = threading.Event()
+
+    def register(prefix, ttl):
+        return "model", f"cachedContents/{prefix}"
+
+    def release(name):
+        released.append(name)
+        released_event.set()
+
+    return ContextCache(register, release, ttl=ttl), released, released_event
+
+
+def registered_handle(context, key, prefix):
+    context.get(key, prefix)
+    for _ in range(100):
+        entry = context.get(key, prefix)
+        if entry is not None:
+            return entry
+        time.sleep(0.01)
+    raise AssertionError("prefix was never registered")
+
+
+def test_last_detach_releases_the_handle():
+    context, released, released_event = cache()
+    context.attach("puzzle")
+    context.attach("puzzle")
+    registered_handle(context, "puzzle", "rules")
+    context.detach("puzzle")
+    assert released == []
+    context.detach("puzzle")
+    assert released_event.wait(1)
+    assert released == ["cachedContents/rules"]
+    assert len(context) == 0
+
+
+def test_sessions_that_never_end_are_released_once_idle():
+    context, released, released_event = cache(ttl=100)
+    context.attach("idle")
+    context.attach("busy")
+    registered_handle(context, "idle", "idle rules")
+    registered_handle(context, "busy", "busy rules")
+
+    # Still within the TTL: nothing goes
+    assert context.sweep() == []
+    # Nothing has attached to or asked about "idle" for longer than the TTL
+    context._sessions["idle"][1] -= 101
+    context.get("busy", "busy rules")
+    assert context.sweep() == ["cachedContents/idle rules"]
+    assert released_event.wait(1)
+    assert released == ["cachedContents/idle rules"]
+    assert context.get("busy", "busy rules") is not None
+
+    # The expired sessions no longer hold the key
+    context.attach("idle")
+    context.detach("idle")
+    assert "idle" not in context._sessions
@@ -0,0 +1,67 @@
+import app
+from call_scheduler import Overloaded
+from minhash import MinHashIndex
+from puzzle_library import PuzzleLibrary, signature_text
+
+KEY = ("easy", "short", "random")
+
+
+def shed():
+    return Overloaded(app.GENERATION, "queue full", 1.0)
+
+
+def test_steps_yield_the_generation_call():
+    steps = app.generation_steps("easy", "short", "random")
+    running, request = app.advance(steps)
+    assert running
+    assert request["phase"] == "generation" and request["priority"] == app.GENERATION
+    assert [message["role"] for message in request["messages"]] == ["user"]
+
+
+def test_a_shed_generation_falls_back_only_when_allowed():
+    steps = app.generation_steps("easy", "short", "random")
+    app.advance(steps)
+    assert app.advance(steps, error=shed()) == (False, None)
+
+    steps = app.generation_steps("easy", "short", "random", allow_fallback=True)
+    app.advance(steps)
+    running, entry = app.advance(steps, error=shed())
+    assert not running
+    assert entry["puzzle"] and entry["intro"]
+
+
+def library_puzzle(puzzle_id, puzzle, solution):
+    return {"puzzle_id": puzzle_id, "puzzle": puzzle, "solution": solution, "intro": "Welcome"}
+
+
+def test_stored_puzzles_are_checked_by_other_workers_and_after_restarts(tmp_path):
+    path = str(tmp_path / "puzzles.db")
+    solution = "He was the lighthouse keeper and had switched off the light, so a ship ran aground."
+    first = PuzzleLibrary(path, index=MinHashIndex())
+    first.add(KEY, [library_puzzle("a", "A man turns off a light and goes to bed. The next morning he is in tears.", solution)])
+
+    index = MinHashIndex()
+    second = PuzzleLibrary(path, index=index)
+    assert second.sync_index() == 1
+    added, _ = index.add_if_novel("b", signature_text(
+        "A man turns off a light and goes to bed. The next morning he is crying.", solution))
+    assert not added
+
+    # Filed by the first worker while the second is running
+    first.add(KEY, [library_puzzle("c", "Two men order the same drink; one dies and the other lives.",
+                                   "The poison was in the ice, which melted in the slow drinker's glass.")])
+    assert second.sync_index() == 1 and second.sync_index() == 0
+    added, _ = index.add_if_novel("d", signature_text(
+        "Two men order the same drink; one dies and the other one lives.",
+        "The poison was in the ice, which melted in the slow drinker's glass."))
+    assert not added
+
+
+def test_puzzles_stored_without_a_signature_get_one(tmp_path):
+    path = str(tmp_path / "puzzles.db")
+    PuzzleLibrary(path).add(KEY, [library_puzzle("a", "A woman shoots her husband, then they go out to dinner.",
+                                                 "She is a photographer.")])
+
+    library = PuzzleLibrary(path, index=MinHashIndex())
+    assert library.sync_index() == 1
+    assert library._conn().execute("SELECT signature FROM puzzles").fetchone()[0] is not None
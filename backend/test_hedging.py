@@ -0,0 +1,76 @@
+import threading
+import time
+
+from hedging import Hedger
+
+
+def hedger(**kwargs):
+    outcomes = []
+    kwargs.setdefault("initial_delay", 0.05)
+    kwargs.setdefault("min_delay", 0.01)
+    return Hedger(["primary", "backup"], on_hedge=outcomes.append, **kwargs), outcomes
+
+
+def test_fast_primary_is_not_hedged():
+    hedged, outcomes = hedger()
+    calls = []
+
+    def call(model):
+        calls.append(model)
+        return "reply"
+
+    assert hedged.run("ask", call, ok=bool, discard=lambda result: None) == ("primary", "reply")
+    time.sleep(0.1)
+    assert outcomes == [] and calls == ["primary"]
+
+
+def test_hedge_cuts_a_slow_primary_short():
+    hedged, outcomes = hedger(initial_delay=0.05)
+    discarded = []
+    primary_done = threading.Event()
+
+    def call(model):
+        if model == "primary":
+            time.sleep(1.0)
+            primary_done.set()
+            return "primary reply"
+        time.sleep(0.05)
+        return "backup reply"
+
+    started = time.monotonic()
+    assert hedged.run("ask", call, ok=bool, discard=discarded.append) == ("backup", "backup reply")
+    # The hedge deadline plus the hedge's own time, not the primary's second
+    assert time.monotonic() - started < 0.5
+    assert outcomes == ["hedge"]
+    # The losing primary finishes in its thread and is released then
+    assert primary_done.wait(2)
+    time.sleep(0.05)
+    assert discarded == ["primary reply"]
+
+
+def test_hedge_replaces_a_failed_primary():
+    hedged, outcomes = hedger()
+
+    def call(model):
+        if model == "primary":
+            time.sleep(0.1)
+            raise ConnectionError("reset")
+        time.sleep(0.1)
+        return "backup reply"
+
+    assert hedged.run("ask", call, ok=bool, discard=lambda result: None) == ("backup", "backup reply")
+    assert outcomes == ["hedge"]
+
+
+def test_no_hedge_when_the_rate_limiter_says_no():
+    hedged, outcomes = hedger()
+    calls = []
+
+    def call(model):
+        calls.append(model)
+        time.sleep(0.1)
+        return "reply"
+
+    assert hedged.run("ask", call, ok=bool, discard=lambda result: None, may_hedge=lambda: False) == \
+        ("primary", "reply")
+    assert calls == ["primary"] and outcomes == ["skipped"]
@@ -0,0 +1,71 @@
+import pytest
+
+from intent_router import GIVE_UP, GREETING, HELP, HINT, REPEAT, SOLUTION, IntentRouter
+
+router = IntentRouter()
+
+
+@pytest.mark.parametrize("text", [
+    "I give up", "i give up!", "ok I give up already", "I surrender", "giving up", "I give up just tell me",
+])
+def test_explicit_give_up(text):
+    assert router.classify(text) == GIVE_UP
+
+
+@pytest.mark.parametrize("text", [
+    "Tell me the answer", "what's the answer?", "reveal it", "show me the solution please", "just tell me",
+])
+def test_explicit_reveal(text):
+    assert router.classify(text) == SOLUTION
+
+
+@pytest.mark.parametrize("text", [
+    "I'm stuck", "i am stuck", "stuck", "I can't figure it out", "this is too hard",
+    "hint please", "can i have a hint", "give me a hint", "any clues?",
+])
+def test_stuck_players_get_a_hint(text):
+    assert router.classify(text) == HINT
+
+
+@pytest.mark.parametrize("text", [
+    # Not explicit enough to end the game
+    "I quit", "quit", "i'm done", "forget it", "what really happened", "i want the answer",
+    # Guesses, however they are punctuated
+    "answer: he drowned", "Answer - the twins", "the solution = twins", "the answer is that he drowned",
+    "I think he was a diver", "I know! he was poisoned", "maybe he drowned",
+    # Questions about the story that use meta words
+    "did he give up", "did he quit his job", "was he stuck in the room", "he had no idea",
+    "she was out of ideas", "is it a hint", "the clue is the ice",
+])
+def test_questions_and_guesses_go_to_the_model(text):
+    assert router.classify(text) is None
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("repeat the puzzle", REPEAT), ("hello", GREETING), ("how do i play", HELP),
+])
+def test_meta_requests(text, intent):
+    assert router.classify(text) == intent
+
+
+def new_game():
+    import app
+    return app, {
+        "riddle": {"puzzle": "A man walks into a bar", "solution": "He had hiccups", "hints": ["Think water"]},
+        "messages": [],
+    }
+
+
+def test_stuck_takes_the_next_hint_without_ending_the_game():
+    app, game_state = new_game()
+    assert app.routed_reply(game_state, "I'm stuck") == "Here's a hint: Think water"
+    assert game_state["hints_used"] == 1
+    assert not game_state.get("game_over")
+    assert app.routed_reply(game_state, "hint please") == app.NO_HINTS_LEFT
+    assert not game_state.get("game_over")
+
+
+def test_give_up_reveals_without_scoring():
+    app, game_state = new_game()
+    assert "He had hiccups" in app.routed_reply(game_state, "I give up")
+    assert game_state["game_over"] and game_state["auto_reveal"]
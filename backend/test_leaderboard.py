@@ -0,0 +1,87 @@
+import random
+
+from leaderboard import Leaderboard
+
+
+def test_ranks_come_from_the_database(tmp_path):
+    board = Leaderboard(str(tmp_path / "leaderboard.db"))
+    for player_id, points in [("ann", 300), ("bob", 100), ("cy", 200), ("dee", 200)]:
+        board.add(player_id, player_id.title(), points)
+    board.flush()
+
+    assert [(entry["rank"], entry["name"]) for entry in board.top(10)] == [(1, "Ann"), (2, "Cy"), (2, "Dee"), (4, "Bob")]
+    # Players on the same score share a rank, whichever page they land on
+    assert board.top(2, offset=2) == [
+        {"rank": 2, "name": "Dee", "score": 200, "games": 1},
+        {"rank": 4, "name": "Bob", "score": 100, "games": 1},
+    ]
+    assert board.rank("dee")["rank"] == 2
+    assert board.rank("bob") == {"rank": 4, "name": "Bob", "score": 100, "games": 1}
+    assert board.rank("nobody") is None
+    assert len(board) == 4
+
+
+def test_rank_counts_points_not_yet_written(tmp_path):
+    board = Leaderboard(str(tmp_path / "leaderboard.db"))
+    board.add("ann", "Ann", 300)
+    board.add("bob", "Bob", 100)
+    board.flush()
+
+    board.add("bob", "Bob", 250)
+    board.add("new", "Newcomer", 50)
+    assert board.rank("bob") == {"rank": 1, "name": "Bob", "score": 350, "games": 2}
+    assert board.rank("new") == {"rank": 3, "name": "Newcomer", "score": 50, "games": 1}
+    # The top players only change once the points are written
+    assert board.top(1)[0]["name"] == "Ann"
+    board.flush()
+    assert board.top(1)[0]["name"] == "Bob"
+
+
+def test_workers_sharing_the_file_see_each_others_scores(tmp_path):
+    path = str(tmp_path / "leaderboard.db")
+    first, second = Leaderboard(path), Leaderboard(path)
+    first.add("ann", "Ann", 100)
+    first.flush()
+    second.add("ann", "Ann", 100)
+    second.add("bob", "Bob", 150)
+    second.flush()
+    assert first.rank("ann") == {"rank": 1, "name": "Ann", "score": 200, "games": 2}
+    assert [entry["name"] for entry in first.top(5)] == ["Ann", "Bob"]
+
+
+def test_ranks_and_pages_match_a_full_sort(tmp_path):
+    path = str(tmp_path / "leaderboard.db")
+    board = Leaderboard(path)
+    rng = random.Random(7)
+    for round_ in range(3):
+        for index in range(300):
+            # Fractional, tied and very large totals all land in the right bucket
+            points = rng.choice([rng.uniform(0, 500), 150.0, 150.5, 2.0 ** 45])
+            board.add(f"player-{rng.randrange(400)}", f"P{index}", points)
+        board.flush()
+
+    # A board opened on the same file, as another worker would
+    board = Leaderboard(path)
+    scores = dict(board._conn().execute("SELECT player_id, score FROM scores"))
+    ordered = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    assert len(board) == len(ordered)
+    for player_id, score in rng.sample(ordered, 50):
+        assert board.rank(player_id)["rank"] == 1 + sum(other > score for other in scores.values())
+    for offset in (0, 1, 37, len(ordered) - 5, len(ordered)):
+        page = board.top(10, offset)
+        assert [entry["score"] for entry in page] == [score for _, score in ordered[offset:offset + 10]]
+        for entry in page:
+            assert entry["rank"] == 1 + sum(other > entry["score"] for other in scores.values())
+
+
+def test_tree_is_built_for_an_existing_table(tmp_path):
+    path = str(tmp_path / "leaderboard.db")
+    board = Leaderboard(path)
+    board.add("ann", "Ann", 300)
+    board.add("bob", "Bob", 100)
+    board.flush()
+    board._conn().execute("DELETE FROM score_buckets")
+
+    board = Leaderboard(path)
+    assert len(board) == 2
+    assert board.rank("bob")["rank"] == 2
@@ -0,0 +1,92 @@
+import uuid
+
+import app
+from rooms import Ticket
+
+ENTRY = {
+    "puzzle_id": "test-room-puzzle",
+    "puzzle": "A man asks a bartender for water; the bartender points a gun at him. The man thanks him.",
+    "solution": "The man had hiccups and the scare cured them.",
+    "hints": ["Think about why he wanted water"],
+    "messages": [],
+}
+
+
+def new_room(*names):
+    room_id = str(uuid.uuid4())
+    game_state = app.new_session_state(ENTRY, "medium")
+    game_state["players"] = {name: {"name": name, "score": 0, "joined": 0} for name in names}
+    return room_id, game_state
+
+
+def run_batch(room_id, game_state, questions, reply):
+    """Plan and apply one batch as the room leader would, with ``reply`` as Gemini's answer"""
+    tickets = [Ticket(question) for question in questions]
+    answers, asked, request = app.plan_room_batch(game_state, tickets)
+    api_result = None
+    if request is not None:
+        api_result = {"success": True, "message": reply(len(asked)), "usage": {}}
+    return asked, app.apply_room_batch(room_id, game_state, tickets, answers, asked, api_result)
+
+
+def events(subscription):
+    return [(event["type"], event["data"]) for event in subscription.get(0)]
+
+
+def test_correct_guess_scores_and_wins():
+    room_id, game_state = new_room("ann", "bob")
+    subscription = app.room_hub.subscribe(room_id)
+    try:
+        asked, results = run_batch(room_id, game_state, [("ann", "Did he have hiccups?")],
+                                   lambda count: "Yes! He had hiccups. [GAME_COMPLETED]")
+        assert asked == [0]
+        assert results[0]["game_over"] and results[0]["score"] > 0
+        assert game_state["winner"] == "ann"
+        assert [kind for kind, _ in events(subscription)] == ["answer", "solved"]
+    finally:
+        app.room_hub.unsubscribe(room_id, subscription)
+
+
+def test_giving_up_reveals_without_scoring():
+    room_id, game_state = new_room("ann", "bob")
+    subscription = app.room_hub.subscribe(room_id)
+    try:
+        asked, results = run_batch(room_id, game_state, [("ann", "Was he thirsty?"), ("bob", "I give up")],
+                                   lambda count: "No")
+        # The give-up never reaches Gemini
+        assert asked == [0]
+        assert results[0] == {"success": True, "message": "No", "score": 0, "game_over": False}
+        assert ENTRY["solution"] in results[1]["message"]
+        assert results[1]["game_over"] and results[1]["score"] == 0
+        assert game_state["auto_reveal"] and "winner" not in game_state
+        assert all(player["score"] == 0 for player in game_state["players"].values())
+        kinds = [kind for kind, _ in events(subscription)]
+        assert kinds == ["answer", "answer", "revealed"]
+    finally:
+        app.room_hub.unsubscribe(room_id, subscription)
+
+
+def test_reveal_in_the_same_batch_as_a_solve_scores_once():
+    room_id, game_state = new_room("ann", "bob")
+    subscription = app.room_hub.subscribe(room_id)
+    try:
+        _, results = run_batch(room_id, game_state, [("ann", "The bartender scared away his hiccups"),
+                                                     ("bob", "tell me the answer")],
+                               lambda count: "Yes, exactly! [GAME_COMPLETED]")
+        assert game_state["winner"] == "ann"
+        assert results[0]["score"] > 0
+        assert results[1]["score"] == 0 and results[1]["game_over"]
+        assert ENTRY["solution"] in results[1]["message"]
+        # The room stays solved rather than revealed
+        assert not game_state.get("auto_reveal")
+        assert [kind for kind, _ in events(subscription)] == ["answer", "solved", "answer"]
+    finally:
+        app.room_hub.unsubscribe(room_id, subscription)
+
+
+def test_a_stuck_player_gets_a_hint_and_the_game_goes_on():
+    room_id, game_state = new_room("ann")
+    asked, results = run_batch(room_id, game_state, [("ann", "I'm stuck")], lambda count: "unused")
+    assert asked == []
+    assert results[0]["message"] == "Here's a hint: Think about why he wanted water"
+    assert not results[0]["game_over"] and not game_state["game_over"]
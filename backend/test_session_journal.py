@@ -0,0 +1,122 @@
+import os
+import time
+
+from session_journal import SessionJournal
+from session_store import MemorySessionStore
+
+
+def session(turns):
+    return {
+        "riddle": {"puzzle": "A man walks into a bar", "solution": "He had hiccups"},
+        "messages": [{"role": "user", "content": f"question {turn}"} for turn in range(turns)],
+        "facts": [],
+        "question_count": turns,
+    }
+
+
+def restored(path, **kwargs):
+    """Sessions a fresh process would restore from the journal at ``path``"""
+    journal = SessionJournal(path, **kwargs)
+    return {session_id: state.decode() for session_id, (state, _) in journal.load().items()}
+
+
+def segments(path):
+    directory, name = os.path.split(path)
+    return sorted(entry for entry in os.listdir(directory) if entry.startswith(name + ".0"))
+
+
+def test_restore_replays_puts_deltas_and_deletes(tmp_path):
+    path = str(tmp_path / "sessions.journal")
+    store = MemorySessionStore(journal=SessionJournal(path))
+    for turns in range(1, 6):
+        store.put("a", session(turns))
+    store.put("b", session(1))
+    store.put("c", session(2))
+    store.delete("c")
+
+    state = store.get("b")
+    state["question_count"] = 9
+    del state["facts"]
+    store.put("b", state)
+
+    sessions = restored(path)
+    assert sessions == {"a": session(5), "b": state}
+
+    # The store decodes restored sessions on first use
+    store = MemorySessionStore(journal=SessionJournal(path))
+    assert store.get("a") == session(5)
+    assert store.get("c") is None
+
+
+def test_message_window_trimmed_from_the_front(tmp_path):
+    path = str(tmp_path / "sessions.journal")
+    store = MemorySessionStore(journal=SessionJournal(path))
+    state = session(3)
+    for turn in range(3, 10):
+        state["messages"] = state["messages"][-3:] + [{"role": "user", "content": f"question {turn}"}]
+        store.put("a", state)
+    assert restored(path)["a"]["messages"] == state["messages"]
+
+
+def test_compaction_folds_closed_segments_into_the_snapshot(tmp_path):
+    path = str(tmp_path / "sessions.journal")
+    journal = SessionJournal(path, segment_bytes=2048)
+    journal._request_compaction = lambda: None
+    for index in range(40):
+        journal.put(f"session-{index}", session(index % 5))
+    for index in range(0, 40, 4):
+        journal.delete(f"session-{index}")
+    before = restored(path)
+    assert len(segments(path)) > 2
+
+    compacted = []
+    journal.on_compact = lambda sessions, seconds: compacted.append(sessions)
+    journal.compact()
+
+    # The deletes after the last closed segment are still in the open one
+    assert len(compacted) == 1 and compacted[0] >= len(before)
+    assert os.path.exists(journal.snapshot_path)
+    # Only the segment still being written is left
+    assert segments(path) == [os.path.basename(f"{path}.{journal._seq:08d}")]
+    assert restored(path) == before
+
+    # Writes after compaction land on top of the snapshot
+    journal.put("session-1", session(7))
+    journal.delete("session-2")
+    before["session-1"] = session(7)
+    del before["session-2"]
+    assert restored(path) == before
+
+
+def test_compaction_keeps_a_segment_opened_after_the_last_one_closed(tmp_path):
+    path = str(tmp_path / "sessions.journal")
+    journal = SessionJournal(path, segment_bytes=1024)
+    journal._request_compaction = lambda: None
+    while journal._file is not None or not segments(path):
+        journal.put(f"session-{journal._written}", session(3))
+    # Between segments nothing is open here, and one started since by another
+    # process is still being written
+    with open(f"{path}.{journal._seq + 1:08d}", "xb") as f:
+        f.write(b"P\tother\t%.3f\t{}\n" % time.time())
+
+    journal.compact()
+    assert segments(path) == [os.path.basename(f"{path}.{journal._seq + 1:08d}")]
+    assert "other" in restored(path)
+
+
+def test_compaction_drops_idle_sessions(tmp_path):
+    path = str(tmp_path / "sessions.journal")
+    journal = SessionJournal(path, ttl=60, segment_bytes=512)
+    journal._request_compaction = lambda: None
+    journal.put("idle", session(1))
+    with open(f"{path}.{journal._seq:08d}", "rb") as f:
+        record = f.read()
+    # Rewrite the record as if it had been written two minutes ago
+    kind, session_id, written, payload = record.split(b"\t", 3)
+    with open(f"{path}.{journal._seq:08d}", "wb") as f:
+        f.write(b"\t".join((kind, session_id, b"%.3f" % (float(written) - 120), payload)))
+    while journal._file is not None:
+        journal.put("live", session(4))
+
+    journal.compact()
+    assert set(restored(path)) == {"live"}
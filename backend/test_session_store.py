@@ -0,0 +1,150 @@
+import threading
+
+import pytest
+
+from session_store import MemorySessionStore, RedisSessionStore, SQLiteSessionStore
+
+
+def release_in_thread(lock):
+    """Exit a held store lock from a thread other than the one that took it"""
+    thread = threading.Thread(target=lock.__exit__, args=(None, None, None))
+    thread.start()
+    thread.join()
+
+
+def test_memory_lock_only_blocks_its_own_session():
+    store = MemorySessionStore()
+    held = store.lock("a")
+    held.__enter__()
+    try:
+        # Every other session stays free while "a" is held
+        for index in range(200):
+            with store.lock(f"other-{index}", timeout=0.1):
+                pass
+        with pytest.raises(TimeoutError):
+            with store.lock("a", timeout=0.05):
+                pass
+    finally:
+        held.__exit__(None, None, None)
+    with store.lock("a", timeout=0.1):
+        pass
+
+
+def test_memory_locks_are_dropped_once_unused():
+    store = MemorySessionStore()
+    for index in range(100):
+        with store.lock(f"session-{index}"):
+            pass
+    assert store._session_locks == {}
+
+
+def test_memory_lock_serializes_updates():
+    store = MemorySessionStore()
+    store.put("a", {"count": 0})
+
+    def increment():
+        for _ in range(200):
+            with store.lock("a"):
+                state = store.get("a")
+                state = {"count": state["count"] + 1}
+                store.put("a", state)
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.get("a") == {"count": 800}
+
+
+def test_memory_lock_released_from_another_thread():
+    store = MemorySessionStore()
+    lock = store.lock("a")
+    lock.__enter__()
+    release_in_thread(lock)
+    with store.lock("a", timeout=0.1):
+        pass
+
+
+def test_sqlite_lock_released_from_another_thread(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    lock = store.lock("a")
+    lock.__enter__()
+    release_in_thread(lock)
+    assert store._conn().execute("SELECT COUNT(*) FROM session_locks").fetchone()[0] == 0
+    with store.lock("a", timeout=0.1):
+        pass
+
+
+def test_sqlite_lock_times_out_while_held(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    with store.lock("a"):
+        with pytest.raises(TimeoutError):
+            with store.lock("a", timeout=0.05):
+                pass
+        with store.lock("b", timeout=0.1):
+            pass
+
+
+class WatchError(Exception):
+    pass
+
+
+class FakePipeline:
+    """Just enough of a redis pipeline for the lock's compare-and-delete"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def watch(self, key):
+        pass
+
+    def get(self, key):
+        return self.client.data.get(key)
+
+    def multi(self):
+        pass
+
+    def delete(self, key):
+        if self.client.taken_over:
+            raise WatchError()
+        self.client.data.pop(key, None)
+
+    def execute(self):
+        pass
+
+    def unwatch(self):
+        pass
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.taken_over = False
+
+    def set(self, key, value, nx=False, px=None, ex=None):
+        if nx and key in self.data:
+            return False
+        self.data[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+def test_redis_lock_release_tolerates_a_lost_lease():
+    client = FakeRedis()
+    store = RedisSessionStore(client=client)
+    with store.lock("a"):
+        assert store._key("a") + ":lock" in client.data
+    assert client.data == {}
+
+    # A WatchError on release means the lease changed hands; it must not escape
+    with store.lock("a"):
+        client.taken_over = True
@@ -0,0 +1,53 @@
+import asyncio
+import uuid
+
+import app
+import asgi
+from gemini_client import GeminiAPIError
+
+ENTRY = {
+    "puzzle_id": "test-stream-puzzle",
+    "puzzle": "A man pushes his car to a hotel and tells the owner he's bankrupt.",
+    "solution": "He is playing Monopoly.",
+    "hints": ["It's a game"],
+    "messages": [],
+}
+
+
+def new_session():
+    session_id = str(uuid.uuid4())
+    app.session_store.put(session_id, app.new_session_state(ENTRY, "medium"))
+    return session_id
+
+
+def failing_stream(*args, **kwargs):
+    yield "Ye"
+    raise GeminiAPIError("Error calling AI API: connection reset")
+
+
+async def failing_async_stream(*args, **kwargs):
+    yield "Ye"
+    raise GeminiAPIError("Error calling AI API: connection reset")
+
+
+def test_a_failed_stream_leaves_no_question_behind(monkeypatch):
+    monkeypatch.setattr(app, "stream_gemini_api", failing_stream)
+    session_id = new_session()
+    before = len(app.session_store.get(session_id)["messages"])
+
+    events = list(app.stream_answer(session_id, f"Was it raining? {uuid.uuid4()}"))
+    assert events[-1].startswith("event: error")
+    assert len(app.session_store.get(session_id)["messages"]) == before
+
+
+def test_a_failed_async_stream_leaves_no_question_behind(monkeypatch):
+    monkeypatch.setattr(asgi, "stream_gemini_api", failing_async_stream)
+    session_id = new_session()
+    before = len(app.session_store.get(session_id)["messages"])
+
+    async def play():
+        return [event async for event in asgi.stream_answer(session_id, f"Was it raining? {uuid.uuid4()}")]
+
+    events = asyncio.run(play())
+    assert events[-1].startswith("event: error")
+    assert len(app.session_store.get(session_id)["messages"]) == before